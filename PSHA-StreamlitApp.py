@@ -1,26 +1,140 @@
-from PSHAmainChannel import mainWebGUI_def
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PSHAmainChannel import *
+from PSHAjobs import *
 from visualizations.mapGen import *
 import numpy as np
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# Cached pipeline stages. Each stage is keyed only by the inputs it and its upstream stages depend on,
+# so a rerun recomputes from the first stage whose inputs changed. Cached objects are shared between
+# reruns and are never modified by the downstream stages. The optional _profiler is not part of the
+# cache key; only the stages that actually run are recorded in it. Spinners are off, since the stages
+# run in background jobs that report their progress themselves.
+PIPELINE_STAGES = ["source", "MFD", "scaling", "mesh", "distance", "GMM", "hazard", "design levels"]
+# Return periods (years) of the uniform hazard values, 10% and 2% probability of exceedance in 50 years.
+DESIGN_RETURN_PERIODS = [475, 2475]
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def cachedSource(coordinates, seismicDepth, dip, rake, strikes=None, _profiler=None):
+    with profileStage(_profiler, "source", len(coordinates)):
+        return sourceStage(coordinates, seismicDepth, dip, rake, strikes)
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def cachedMFD(minMag, maxMag, aGR, bGR, magnitudeTolerance=None, exceedanceKey=None, _profiler=None):
+    # Adaptive magnitude bins also depend on exceedanceKey, the (GMM, IM thresholds, rake, Vs30, IMT) of
+    # magnitudeExceedance; it is None for uniform bins, so that those are shared across these inputs.
+    with profileStage(_profiler, "MFD") as record:
+        exceedance = None
+        if magnitudeTolerance is not None:
+            GMM, IMthresholds, rake, soilConditionVs30, imts = exceedanceKey
+            exceedance = magnitudeExceedance(GMM, np.asarray(IMthresholds), REFERENCE_DISTANCES, rake,
+                                             soilConditionVs30, imts)
+        mfd = mfdStage(minMag, maxMag, aGR, bGR, magnitudeTolerance, exceedance)
+        record["rows"] = len(mfd.magRange)
+
+    return mfd
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def cachedScaling(sourceKey, mfdKey, _profiler=None):
+    eqSource, mfd = cachedSource(*sourceKey, _profiler=_profiler), cachedMFD(*mfdKey, _profiler=_profiler)
+    with profileStage(_profiler, "scaling", len(mfd.magRange)):
+        return scalingStage(eqSource, mfd)
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def cachedMesh(sourceKey, mfdKey, meshSpace, _profiler=None):
+    eqSource, mfd = cachedSource(*sourceKey, _profiler=_profiler), cachedMFD(*mfdKey, _profiler=_profiler)
+    magnScaling = cachedScaling(sourceKey, mfdKey, _profiler=_profiler)
+    with profileStage(_profiler, "mesh") as record:
+        eqSourceModeling = meshStage(eqSource, mfd, magnScaling, meshSpace)
+        record["rows"] = len(eqSourceModeling.ruptureSet)
+
+    return eqSourceModeling
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def cachedDistances(sourceKey, mfdKey, meshSpace, siteCoordinate, maxDistance, _profiler=None):
+    eqSourceModeling = cachedMesh(sourceKey, mfdKey, meshSpace, _profiler=_profiler)
+    with profileStage(_profiler, "distance") as record:
+        distances = distanceStage(eqSourceModeling, siteCoordinate, maxDistance)
+        record["rows"] = len(distances[0])
+
+    return distances
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def cachedGMM(sourceKey, mfdKey, meshSpace, siteCoordinate, maxDistance, soilConditionVs30, imts, GMM,
+              _profiler=None):
+    eqSourceModeling = cachedMesh(sourceKey, mfdKey, meshSpace, _profiler=_profiler)
+    distances = cachedDistances(sourceKey, mfdKey, meshSpace, siteCoordinate, maxDistance, _profiler=_profiler)
+    with profileStage(_profiler, "GMM", len(distances[0])):
+        return gmmStage(eqSourceModeling, distances, sourceKey[3], soilConditionVs30, imts, GMM)
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def cachedHazard(sourceKey, mfdKey, meshSpace, siteCoordinate, maxDistance, soilConditionVs30, imts, GMM,
+                 IMthresholds, _profiler=None):
+    ruptures = cachedGMM(sourceKey, mfdKey, meshSpace, siteCoordinate, maxDistance, soilConditionVs30, imts, GMM,
+                         _profiler=_profiler)
+    mfd = cachedMFD(*mfdKey, _profiler=_profiler)
+    with profileStage(_profiler, "hazard", len(IMthresholds)):
+        rateExceedance = hazardStage(ruptures, mfd, IMthresholds)
+
+    return ruptures, rateExceedance, plotHazardCurve(IMthresholds, rateExceedance, imts)
+
+# Calculations run on a shared thread pool, so the page stays responsive; a session keeps its job in
+# st.session_state and cancels it when the inputs change.
+@st.cache_resource
+def jobExecutor():
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="psha-job")
+
+def hazardJob(sourceKey, mfdKey, meshSpace, siteCoordinate, maxDistance, soilConditionVs30, imts, GMM, IMthresholds,
+              scriptContext, _profiler=None):
+    # st.cache_resource only reads and writes its cache in a thread with the session's ScriptRunContext.
+    # The thread gets a copy, since the cache flags the context while a cached function runs and the
+    # widgets of the session would then warn.
+    add_script_run_ctx(threading.current_thread(), copy.copy(scriptContext))
+    ruptures, rateExceedance, hazardCurveFigure = cachedHazard(sourceKey, mfdKey, meshSpace, siteCoordinate,
+                                                               maxDistance, soilConditionVs30, imts, GMM,
+                                                               IMthresholds, _profiler=_profiler)
+    eqSourceModeling = cachedMesh(sourceKey, mfdKey, meshSpace)
+    # IM levels at the design return periods, solved directly rather than read off the curve. The search starts
+    # from the range of the thresholds, which follows the IMT units. It is not cached, so it is always recorded.
+    with profileStage(_profiler, "design levels", len(DESIGN_RETURN_PERIODS)):
+        designLevels = inverseHazardCalculator(ruptures, cachedMFD(*mfdKey), 1 / np.asarray(DESIGN_RETURN_PERIODS),
+                                               imBounds=(np.min(IMthresholds), np.max(IMthresholds)))
+
+    return ruptures, ruptures.toDataframe(), hazardCurveFigure, eqSourceModeling, designLevels
+
+@st.experimental_fragment(run_every=0.5)
+def jobProgressPanel():
+    # Polls the running job; the whole page is rerun once it finishes, to draw the results.
+    job = st.session_state["hazardJob"]
+    if job.done():
+        st.rerun()
+    stage = job.progress.currentStage or "waiting for a worker"
+    st.progress(job.progress.fraction(), text=f"{job.status.capitalize()}: {stage} ({job.elapsed():.1f} s)")
+    if st.button("Cancel"):
+        job.cancel()
 
 # Streamlit App
 st.title('PSHA Streamlit App')
 st.write("This program performs Probabilistic Seismic Hazard Analysis (PSHA) for a specified site, "
-         "utilizing a single-segment 2D fault source (line source).")
+         "utilizing a single-segment 2D fault source (line source), a point source or an area source.")
 st.write("---")
 
-tab1, tab2 = st.tabs(["Inputs", "Outputs"])
+tab1, tab2, tab3 = st.tabs(["Inputs", "Outputs", "Stored Results"])
 
 with st.form("main form", clear_on_submit=True):
     with tab1:
         st.header('Program Inputs')
         with st.container():
             st.subheader('Source Characteristics')
+            sourceType = st.selectbox('Source type', ['Fault', 'Point', 'Area'])
             col1, col2 = st.columns(2)
             with col1:
-                startingCoordinate = st.text_input('Input starting point (Latitude, Longitude)', '28.0, 40.8')
+                startingCoordinate = st.text_input('Input starting point (Longitude, Latitude)', '28.0, 40.8')
             with col2:
-                endingCoordinate = st.text_input('Input ending point (Latitude, Longitude)', '29.5, 40.7')
+                endingCoordinate = st.text_input('Input ending point (Longitude, Latitude)', '29.5, 40.7')
             # Seismic Depth input using columns for side by side input
             col1, col2, col3, col4 = st.columns(4)
             with col1:
@@ -40,16 +154,28 @@ with st.form("main form", clear_on_submit=True):
                 aGR = st.number_input('aGR', value=4.00, step=0.01)
             with col4:
                 bGR = st.number_input('bGR', value=1.00, step=0.01)
-            # TODO: reopen when you add point/area source.
-            # strike = st.text_input('Strike (comma-separated values)', '0,60,120,180,240,300')
-            # strike = list(map(float, strike.split(',')))
+            # A point source is at the starting point; an area source is the polygon of the vertices.
+            areaVertices = st.text_input('Area source vertices (Longitude, Latitude; ...)',
+                                         '28.0, 40.5; 29.5, 40.4; 29.8, 41.0; 28.3, 41.2')
+            strike = st.text_input('Point and area source strikes (comma-separated values)', '0,30,60,90,120,150')
+            strike = list(map(float, strike.split(',')))
 
             st.subheader('Site Characteristics')
-            siteCoordinate = st.text_input('Site Coordinate (Latitude, Longitude)', '29.2, 41.0')
+            siteCoordinate = st.text_input('Site Coordinate (Longitude, Latitude)', '29.2, 41.0')
             soilConditionVs30 = st.number_input('Soil Condition VS30 (m/s)', value=700)
 
             st.subheader('Model Adjustments')
-            meshSpace = st.number_input('Fault Mesh Spacing Distance (km)', value=10.0)
+            meshSpace = st.number_input('Fault Mesh and Area Grid Spacing Distance (km)', value=10.0)
+            maxDistance = st.number_input('Maximum Integration Distance (km)', min_value=0.0, value=300.0)
+            col1, col2 = st.columns(2)
+            with col1:
+                adaptiveBins = st.checkbox('Adaptive magnitude bins', value=False)
+            with col2:
+                # Relative hazard error of the magnitude bins, for the GMM at the reference distances only.
+                magnitudeTolerance = st.number_input('Magnitude bin tolerance', min_value=0.001, max_value=0.5,
+                                                     value=0.01, step=0.001, format="%.3f")
+            magnitudeTolerance = magnitudeTolerance if adaptiveBins else None
+            recordPerformance = st.checkbox('Record stage time and memory', value=False)
 
             st.subheader('Ground Motion Model')
 
@@ -88,19 +214,48 @@ with st.form("main form", clear_on_submit=True):
             imts = imts.lower()
 
             # Convert input strings to lists
-            startingLat, startingLon = map(float, startingCoordinate.split(','))
-            endingLat, endingLon = map(float, endingCoordinate.split(','))
-            coordinates = [[startingLat, startingLon], [endingLat, endingLon]]
+            startingLon, startingLat = map(float, startingCoordinate.split(','))
+            endingLon, endingLat = map(float, endingCoordinate.split(','))
+            if sourceType == 'Fault':
+                coordinates = [[startingLon, startingLat], [endingLon, endingLat]]
+            elif sourceType == 'Point':
+                coordinates = [[startingLon, startingLat]]
+            else:
+                coordinates = [list(map(float, vertex.split(','))) for vertex in areaVertices.split(';')]
+                # Area sources are closed polygons.
+                if coordinates[0] != coordinates[-1]:
+                    coordinates.append(coordinates[0])
             seismicDepth = [float(seismicDepth_min), float(seismicDepth_max)]
             siteCoordinate = list(map(float, siteCoordinate.split(',')))
 
-    with tab2:
-        st.header('Program Outputs')
-        with st.container():
-            # Calculations
-            ruptureDataframe, hazardCurveFigure = mainWebGUI_def(coordinates, seismicDepth, minMag, maxMag, aGR,
-                                                                 bGR, dip, rake, siteCoordinate, soilConditionVs30,
-                                                                 meshSpace, imts, GMM, IMthresholds)
+with tab2:
+    st.header('Program Outputs')
+    with st.container():
+        # Calculations
+        sourceKey = (coordinates, seismicDepth, dip, rake, strike if sourceType != 'Fault' else None)
+        mfdKey = (minMag, maxMag, aGR, bGR, magnitudeTolerance,
+                  (GMM, tuple(IMthresholds.tolist()), rake, soilConditionVs30, imts) if adaptiveBins else None)
+        jobKey = (sourceKey, mfdKey, meshSpace, siteCoordinate, maxDistance, soilConditionVs30, imts, GMM,
+                  tuple(IMthresholds.tolist()), recordPerformance)
+        job = st.session_state.get("hazardJob")
+        if job is None or job.key != jobKey:
+            # The inputs changed: the previous job is superseded.
+            if job is not None:
+                job.cancel()
+            job = backgroundJob(jobExecutor(), hazardJob, sourceKey, mfdKey, meshSpace, siteCoordinate, maxDistance,
+                                soilConditionVs30, imts, GMM, IMthresholds, get_script_run_ctx(), key=jobKey,
+                                stages=PIPELINE_STAGES, traceMemory=recordPerformance)
+            st.session_state["hazardJob"] = job
+
+        if not job.done():
+            jobProgressPanel()
+        elif job.status == "cancelled":
+            st.write("The calculation was cancelled. Change an input to start a new one.")
+        elif job.status == "failed":
+            st.exception(job.future.exception())
+        else:
+            ruptures, ruptureDataframe, hazardCurveFigure, eqSourceModeling, designLevels = job.result()
+            ruptureCount = len(eqSourceModeling.ruptureSet)
 
             st.subheader('Simulated Ruptures')
             figRuptureMap = generateRuptureMap(coordinates, siteCoordinate, ruptureDataframe)
@@ -109,9 +264,58 @@ with st.form("main form", clear_on_submit=True):
             st.subheader('Rupture Table')
             st.write("The following table provides simulated ruptures' magnitude, coordinates, closest distance "
                      "(km) to the site, and GMIM results.")
+            if sourceType == 'Fault':
+                st.write(f"{ruptureCount - len(ruptures)} of {ruptureCount} ruptures are beyond the maximum "
+                         f"integration distance of {maxDistance:g} km and were skipped.")
+            else:
+                nodeCount = f"{len(eqSourceModeling.nodes)} nodes and " if sourceType == 'Area' else ""
+                st.write(f"The {sourceType.lower()} source has {nodeCount}{len(strike)} strikes. Its ruptures are "
+                         f"grouped by magnitude and Joyner-Boore distance into {len(ruptures)} rows within the "
+                         f"maximum integration distance of {maxDistance:g} km; they have no single location.")
             st.dataframe(ruptureDataframe)
 
             st.pyplot(hazardCurveFigure)
+            imUnit = 'g' if imts == 'pga' else 'cm/s'
+            st.dataframe([{"Return period (years)": period, f"{imts.upper()} ({imUnit})": level}
+                          for period, level in zip(DESIGN_RETURN_PERIODS, designLevels)])
+
+            if recordPerformance:
+                with st.expander("Performance"):
+                    # Stages missing from the report were served from the cache.
+                    report = job.progress.report()
+                    records = {record["stage"]: record for record in report["stages"]}
+                    st.dataframe([{"Stage": stage,
+                                   "Time (s)": records[stage]["seconds"] if stage in records else None,
+                                   "Peak memory (MB)": records[stage]["peakMemoryMB"] if stage in records else None,
+                                   "Rows": records[stage]["rows"] if stage in records else None,
+                                   "Cached": stage not in records}
+                                  for stage in PIPELINE_STAGES])
+                    st.write(f"Total stage time: {report['totalSeconds']:.3f} s")
+                    if any(record.get("memoryOverlap") for record in report["stages"]):
+                        st.write("Stages without a peak memory ran while another calculation was running, "
+                                 "so their peak could not be separated.")
+
+with tab3:
+    st.header('Stored Results')
+    st.write("Open a result directory written by PSHAbatch.py or mainHazardMap_def. Only the curve of the "
+             "selected site is read from disk.")
+    resultPath = st.text_input('Result directory', '')
+    if resultPath:
+        try:
+            store = resultStore(resultPath)
+        except (OSError, KeyError, ValueError) as error:
+            st.error(f"{resultPath} could not be opened: {error}")
+        else:
+            st.write(f"{len(store)} sites, {len(store.imThresholds)} IM thresholds, "
+                     f"{store.metadata['ruptureCount']} ruptures, created {store.metadata['created']}.")
+            with st.expander("Inputs"):
+                st.json(store.inputs)
+            storedSite = st.text_input('Stored site coordinate (Longitude, Latitude)',
+                                       ", ".join(f"{value:g}" for value in store.siteCoordinates[0]))
+            siteIndex = store.nearestSite(list(map(float, storedSite.split(','))))
+            st.write("Closest stored site: " + ", ".join(f"{value:g}" for value in store.siteCoordinates[siteIndex]))
+            st.pyplot(plotHazardCurve(store.imThresholds, store.siteCurve(siteIndex),
+                                      store.inputs.get("imts", "pga")))
 
 st.write("---")
 st.markdown("""<style>.small-font {font-size:14px;}</style>""", unsafe_allow_html=True)
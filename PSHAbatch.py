@@ -0,0 +1,215 @@
+### PSHA Batch Runner ###
+
+"""
+Headless runner for many PSHA scenarios.
+
+    Scenarios are read from a JSON file (a list of objects, or {"scenarios": [...]}) or a JSON Lines
+    file. Each scenario uses the argument names of mainWebGUI_def:
+
+        {"name": "izmit-site-1", "coordinates": [[28.0, 40.8], [29.5, 40.7]], "seismicDepth": [0, 20],
+         "minMag": 5, "maxMag": 8, "aGR": 4, "bGR": 1, "dip": 90, "rake": 180,
+         "siteCoordinate": [29.2, 41.0], "soilConditionVs30": 300, "imts": "pga",
+         "IMthresholds": {"start": 0.01, "stop": 2.0, "num": 100}}
+
+    meshSpace, GMM, maxDistance, strikes, magnitudeTolerance and name are optional. coordinates may also be one point, a
+    point source, or a closed polygon, an area source; strikes are the rupture strikes of those sources.
+    magnitudeTolerance, e.g. 0.01, chooses the magnitude bins adaptively as in mainWebGUI_def.
+    IMthresholds is a list of values or a logarithmically spaced range. Scenarios sharing a source,
+    MFD and mesh spacing are run in the same task, so their ruptures are meshed once. Each scenario
+    writes hazardCurve.csv and ruptures.csv to its own directory, or with --format store a result
+    directory of PSHAresultStore (Parquet ruptures, memory-mapped hazard curve and metadata), and
+    summary.json lists the status of every scenario. Scenario names are directory names, so they may
+    not hold path separators or "..".
+
+        python PSHAbatch.py scenarios.json --output results --workers 8
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from PSHAmainChannel import *
+
+SCENARIO_DEFAULTS = dict(meshSpace=5.0, GMM='ASB14', imts='pga', maxDistance=None, strikes=None,
+                         magnitudeTolerance=None)
+SCENARIO_KEYS = ["coordinates", "seismicDepth", "minMag", "maxMag", "aGR", "bGR", "dip", "rake", "siteCoordinate",
+                 "soilConditionVs30", "IMthresholds"]
+
+def checkScenarioName(name):
+    # Names are used as directory names under the output directory.
+    if not isinstance(name, str) or name.strip() in ("", ".") or ".." in name or "/" in name or "\\" in name:
+        raise Exception(repr(name) + " is not a valid scenario name; it may not be empty or hold path separators "
+                        "or \"..\".")
+
+def readScenarios(path):
+    """
+    Read and validate the scenarios of a JSON or JSON Lines file.
+    :return: List of scenario dictionaries with defaults filled in and a name for each.
+    """
+    with open(path) as file:
+        if path.endswith(".jsonl"):
+            scenarios = [json.loads(line) for line in file if line.strip()]
+        else:
+            scenarios = json.load(file)
+    if isinstance(scenarios, dict):
+        scenarios = scenarios["scenarios"]
+
+    validScenarios = []
+    for index, scenario in enumerate(scenarios):
+        missing = [key for key in SCENARIO_KEYS if key not in scenario]
+        if missing:
+            raise Exception("Scenario " + str(index) + " misses " + ", ".join(missing) + ".")
+        validScenarios.append(dict(SCENARIO_DEFAULTS, name=f"scenario_{index:05d}") | scenario)
+
+    names = [scenario["name"] for scenario in validScenarios]
+    for name in names:
+        checkScenarioName(name)
+    if len(set(names)) != len(names):
+        raise Exception("Scenario names are not unique.")
+
+    return validScenarios
+
+def thresholdValues(IMthresholds):
+    # A list of thresholds, or a {"start", "stop", "num"} range spaced logarithmically.
+    if isinstance(IMthresholds, dict):
+        return np.logspace(np.log10(IMthresholds["start"]), np.log10(IMthresholds["stop"]), IMthresholds["num"])
+    return np.asarray(IMthresholds, dtype=float)
+
+def sourceGroupKey(scenario):
+    # Scenarios with the same key share the rupture mesh. Adaptive magnitude bins also depend on the GMM,
+    # the site conditions and the thresholds.
+    keys = ["coordinates", "seismicDepth", "dip", "rake", "strikes", "minMag", "maxMag", "aGR", "bGR", "meshSpace",
+            "magnitudeTolerance"]
+    if scenario["magnitudeTolerance"] is not None:
+        keys += ["GMM", "imts", "soilConditionVs30", "IMthresholds"]
+    return json.dumps([scenario[key] for key in keys])
+
+def writeScenarioResults(outputDir, scenario, IMthresholds, rateExceedance, ruptures, resultFormat="csv"):
+    # Scenarios given to runBatch directly are not validated by readScenarios.
+    checkScenarioName(scenario["name"])
+    scenarioDir = os.path.join(outputDir, scenario["name"])
+    if resultFormat == "store":
+        return saveResult(scenarioDir, IMthresholds, rateExceedance, scenario["siteCoordinate"],
+                          scenario["soilConditionVs30"], ruptures, scenario)
+    elif resultFormat != "csv":
+        raise Exception(str(resultFormat) + " is not a valid result format.")
+    import pandas as pd
+
+    os.makedirs(scenarioDir, exist_ok=True)
+
+    pd.DataFrame({"IM threshold": np.round(IMthresholds, 4), "Annual rate of exceedance": rateExceedance}).to_csv(
+        os.path.join(scenarioDir, "hazardCurve.csv"), index=False)
+    ruptures.toDataframe().to_csv(os.path.join(scenarioDir, "ruptures.csv"), index_label="Rupture")
+    with open(os.path.join(scenarioDir, "scenario.json"), "w") as file:
+        json.dump(scenario, file, indent=2)
+
+    return scenarioDir
+
+def runScenarioGroup(task):
+    """
+    Run scenarios sharing one source; top-level so that it can be sent to worker processes.
+    :return: List of summary records, one per scenario.
+    """
+    scenarios, outputDir, profile, resultFormat = task
+    first = scenarios[0]
+    summaries = []
+
+    try:
+        eqSource = sourceStage(first["coordinates"], first["seismicDepth"], first["dip"], first["rake"],
+                               first["strikes"])
+        exceedance = None
+        if first["magnitudeTolerance"] is not None:
+            exceedance = magnitudeExceedance(first["GMM"], thresholdValues(first["IMthresholds"]),
+                                             REFERENCE_DISTANCES, first["rake"], first["soilConditionVs30"],
+                                             first["imts"])
+        mfd = mfdStage(first["minMag"], first["maxMag"], first["aGR"], first["bGR"], first["magnitudeTolerance"],
+                       exceedance)
+        magnScaling = scalingStage(eqSource, mfd)
+        eqSourceModeling = meshStage(eqSource, mfd, magnScaling, first["meshSpace"])
+    except Exception:
+        error = traceback.format_exc(limit=3)
+        return [dict(name=scenario["name"], status="failed", error=error) for scenario in scenarios]
+
+    for scenario in scenarios:
+        start = time.perf_counter()
+        profiler = stageProfiler() if profile else None
+        try:
+            IMthresholds = thresholdValues(scenario["IMthresholds"])
+            with profileStage(profiler, "distance") as record:
+                distances = distanceStage(eqSourceModeling, scenario["siteCoordinate"], scenario["maxDistance"])
+                record["rows"] = len(distances[0])
+            with profileStage(profiler, "GMM", len(distances[0])):
+                ruptures = gmmStage(eqSourceModeling, distances, scenario["rake"], scenario["soilConditionVs30"],
+                                    scenario["imts"], scenario["GMM"])
+            with profileStage(profiler, "hazard", len(IMthresholds)):
+                rateExceedance = hazardStage(ruptures, mfd, IMthresholds)
+
+            scenarioDir = writeScenarioResults(outputDir, scenario, IMthresholds, rateExceedance, ruptures,
+                                               resultFormat)
+            if profiler is not None:
+                profiler.hooks.append(jsonReportHook(os.path.join(scenarioDir, "performance.json")))
+                profiler.finish()
+            summaries.append(dict(name=scenario["name"], status="done", seconds=time.perf_counter() - start,
+                                  ruptures=len(ruptures), directory=scenarioDir))
+        except Exception:
+            summaries.append(dict(name=scenario["name"], status="failed", error=traceback.format_exc(limit=3)))
+
+    return summaries
+
+def runBatch(scenarios, outputDir, nWorkers=None, groupSize=64, profile=False, resultFormat="csv"):
+    """
+    Run the scenarios on a process pool and write their results.
+    :param nWorkers: Number of worker processes; 1 runs the scenarios in this process.
+    :param groupSize: Largest number of scenarios of one source in a task.
+    :param profile: Write the stage report of every scenario to its performance.json.
+    :param resultFormat: "csv" for CSV tables, or "store" for result store directories.
+    :return: List of summary records, in the order of the scenarios.
+    """
+    os.makedirs(outputDir, exist_ok=True)
+
+    groups = {}
+    for scenario in scenarios:
+        groups.setdefault(sourceGroupKey(scenario), []).append(scenario)
+    tasks = [(group[start:start + groupSize], outputDir, profile, resultFormat)
+             for group in groups.values() for start in range(0, len(group), groupSize)]
+
+    summaries = []
+    workerCount = nWorkers or os.cpu_count() or 1
+    if workerCount == 1:
+        for task in tasks:
+            summaries += runScenarioGroup(task)
+            print(f"{len(summaries)}/{len(scenarios)} scenarios finished", file=sys.stderr)
+    else:
+        with ProcessPoolExecutor(max_workers=workerCount) as executor:
+            for future in as_completed([executor.submit(runScenarioGroup, task) for task in tasks]):
+                summaries += future.result()
+                print(f"{len(summaries)}/{len(scenarios)} scenarios finished", file=sys.stderr)
+
+    order = {scenario["name"]: index for index, scenario in enumerate(scenarios)}
+    summaries.sort(key=lambda summary: order[summary["name"]])
+    with open(os.path.join(outputDir, "summary.json"), "w") as file:
+        json.dump(summaries, file, indent=2)
+
+    return summaries
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run PSHA scenarios without the Streamlit app.")
+    parser.add_argument("scenarios", help="JSON or JSON Lines file of scenarios.")
+    parser.add_argument("--output", default="results", help="Directory of the results.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes; all cores by default.")
+    parser.add_argument("--group-size", type=int, default=64,
+                        help="Largest number of scenarios of one source in a task.")
+    parser.add_argument("--profile", action="store_true", help="Write the stage report of every scenario.")
+    parser.add_argument("--format", choices=["csv", "store"], default="csv",
+                        help="CSV tables, or result store directories with Parquet and memory-mapped arrays.")
+    args = parser.parse_args()
+
+    summaries = runBatch(readScenarios(args.scenarios), args.output, args.workers, args.group_size, args.profile,
+                         args.format)
+    failed = [summary["name"] for summary in summaries if summary["status"] != "done"]
+    if failed:
+        sys.exit(f"{len(failed)} of {len(summaries)} scenarios failed: " + ", ".join(failed[:10]))
@@ -0,0 +1,93 @@
+### PSHA Background Jobs ###
+
+"""
+Background execution of PSHA runs with per-stage progress and cancellation.
+
+    A backgroundJob submits a function to an executor and passes it a jobProgress as its _profiler
+    keyword, the profiler argument taken by the pipeline stages. The stages report to it as they start
+    and finish, and a cancelled job stops at the next stage boundary by raising jobCancelled; a job still
+    waiting in the executor queue is not started at all.
+"""
+
+import threading
+import time
+from concurrent.futures import CancelledError
+from contextlib import contextmanager
+from PSHAprofiler import stageProfiler
+
+class jobCancelled(Exception):
+    # Raised at the start of a stage of a cancelled job.
+    pass
+
+class jobProgress(stageProfiler):
+
+    def __init__(self, stages, traceMemory=False):
+        """
+        :param stages: Names of the stages a job may run, in order, for the progress fraction.
+        :param traceMemory: Also record the peak memory of each stage.
+        """
+        super().__init__(traceMemory)
+        self.stages = list(stages)
+        self.currentStage = None
+        self.cancelEvent = threading.Event()
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        if self.cancelEvent.is_set():
+            raise jobCancelled(name + " was not started, the job is cancelled.")
+        self.currentStage = name
+        try:
+            with super().stage(name, rows) as record:
+                yield record
+        finally:
+            self.currentStage = None
+
+    def fraction(self):
+        # Share of the stages that finished; stages served from a cache are never recorded.
+        finished = {record["stage"] for record in self.records}
+        return len(finished & set(self.stages)) / max(len(self.stages), 1)
+
+class backgroundJob():
+
+    def __init__(self, executor, function, *args, key=None, stages=(), traceMemory=False, **kwargs):
+        """
+        Submit function(*args, _profiler=progress, **kwargs) to the executor.
+        :param key: Inputs of the job, compared with the current inputs to find superseded jobs.
+        :param stages: Stage names of the function, see jobProgress.
+        """
+        self.key = key
+        self.progress = jobProgress(stages, traceMemory)
+        self.started = time.perf_counter()
+        self.future = executor.submit(function, *args, _profiler=self.progress, **kwargs)
+
+    def cancel(self):
+        # Request the cancellation; a running stage is finished first.
+        self.progress.cancelEvent.set()
+        self.future.cancel()
+
+    def done(self):
+        return self.future.done()
+
+    @property
+    def status(self):
+        """
+        "queued", "running", "done", "cancelled" or "failed".
+        """
+        if not self.future.done():
+            return "cancelled" if self.progress.cancelEvent.is_set() else (
+                "running" if self.future.running() else "queued")
+        if self.future.cancelled() or isinstance(self.future.exception(), jobCancelled):
+            return "cancelled"
+        return "failed" if self.future.exception() is not None else "done"
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def result(self, timeout=None):
+        """
+        :return: Return value of the function; raises jobCancelled for a cancelled job.
+        """
+        try:
+            return self.future.result(timeout)
+        except CancelledError:
+            raise jobCancelled("The job was cancelled before it started.")
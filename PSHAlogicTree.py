@@ -0,0 +1,212 @@
+### PSHA Logic Tree ###
+
+"""
+Logic-tree runner for the PSHA pipeline.
+
+    Each branch combines one Gutenberg-Richter (aGR, bGR) pair, one maximum magnitude, one
+    magnitude-area scaling relation and one GMM. Branches with the same maximum magnitude and
+    scaling relation share the rupture geometry and distances; within them, each GMM is evaluated
+    once and all rate branches are integrated together. Branch groups run on a process pool; their
+    hazard curves are added to the weighted mean as they arrive and kept in a memory-mapped file,
+    from which the fractile curves are computed a block of sites at a time.
+"""
+
+import itertools
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from PSHAmainChannel import *
+
+class logicTree():
+
+    def __init__(self, grBranches, maxMagBranches, scalingBranches=None, gmmBranches=None):
+        """
+        Each argument is a list of (value, weight) pairs; the weights of a list sum to 1.
+        :param grBranches: ((aGR, bGR), weight) pairs.
+        :param maxMagBranches: (maxMag, weight) pairs.
+        :param scalingBranches: (scaling relation name, weight) pairs, see scalingStage.
+        :param gmmBranches: (GMM name, weight) pairs.
+        """
+        self.grBranches = grBranches
+        self.maxMagBranches = maxMagBranches
+        self.scalingBranches = scalingBranches if scalingBranches is not None else [('Leonard2014', 1.0)]
+        self.gmmBranches = gmmBranches if gmmBranches is not None else [('ASB14', 1.0)]
+
+    def __len__(self):
+        return len(self.grBranches) * len(self.maxMagBranches) * len(self.scalingBranches) * len(self.gmmBranches)
+
+    def geometryGroups(self):
+        """
+        Split the branches into groups sharing rupture geometry, i.e. the same maximum magnitude
+        and scaling relation.
+        :return: List of (maxMag, scaling relation, group weight) tuples.
+        """
+        return [(maxMag, scaling, maxMagWeight * scalingWeight)
+                for (maxMag, maxMagWeight), (scaling, scalingWeight)
+                in itertools.product(self.maxMagBranches, self.scalingBranches)]
+
+class hazardCurveStatistics():
+    """
+    Weighted mean and fractiles of hazard curves. The mean is accumulated as branch curves arrive;
+    the curves are written to a memory-mapped temporary file, and the fractiles are computed from it
+    a block of cells at a time, so memory stays bounded by maxChunkElements.
+    """
+
+    def __init__(self, curveShape, branchCount, directory=None, maxChunkElements=2_000_000):
+        """
+        :param curveShape: Shape of the curves of a branch, e.g. (nSites, nThresholds).
+        :param branchCount: Number of branch curves that will be added.
+        :param directory: Directory of the temporary file; the default temporary directory if None.
+        """
+        self.curveShape = curveShape
+        self.maxChunkElements = maxChunkElements
+        self.weightedSum = np.zeros(curveShape)
+        self.weights = np.zeros(branchCount)
+        self.count = 0
+        self._file = tempfile.TemporaryFile(dir=directory)
+        self.curves = np.memmap(self._file, dtype=np.float64, mode='w+',
+                                shape=(branchCount, int(np.prod(curveShape, dtype=int))))
+
+    def add(self, curves, weights):
+        """
+        Add branch curves, shape (nBranches,) + curveShape, with their weights, shape (nBranches,).
+        """
+        curves = np.asarray(curves, dtype=float).reshape(len(weights), -1)
+        weights = np.asarray(weights, dtype=float)
+        if self.count + len(weights) > len(self.weights):
+            raise Exception("More branch curves were added than the " + str(len(self.weights)) + " expected.")
+
+        self.weightedSum += (weights @ curves).reshape(self.curveShape)
+        self.curves[self.count:self.count + len(weights)] = curves
+        self.weights[self.count:self.count + len(weights)] = weights
+        self.count += len(weights)
+
+    def mean(self):
+        return self.weightedSum / self.weights[:self.count].sum()
+
+    def fractiles(self, quantiles):
+        """
+        Weighted fractile curves: the smallest branch value whose cumulative weight reaches the quantile.
+        Zero rates are ordinary values, so a fractile is zero where enough branches have a zero rate.
+        :return: Dictionary of the fractile curves of every quantile.
+        """
+        weights = self.weights[:self.count]
+        targets = np.asarray(quantiles, dtype=float) * weights.sum() * (1 - 1e-12)
+        values = np.zeros((len(targets), self.curves.shape[1]))
+
+        cellsPerChunk = max(1, self.maxChunkElements // max(self.count, 1))
+        for start in range(0, self.curves.shape[1], cellsPerChunk):
+            stop = min(start + cellsPerChunk, self.curves.shape[1])
+            curves = np.asarray(self.curves[:self.count, start:stop])
+            order = np.argsort(curves, axis=0)
+            sortedCurves = np.take_along_axis(curves, order, axis=0)
+            cumulative = np.cumsum(weights[order], axis=0)
+            for index, target in enumerate(targets):
+                rank = np.minimum((cumulative < target).sum(axis=0), self.count - 1)
+                values[index, start:stop] = np.take_along_axis(sortedCurves, rank[None], axis=0)[0]
+
+        return {quantile: value.reshape(self.curveShape) for quantile, value in zip(quantiles, values)}
+
+    def fractile(self, quantile):
+        return self.fractiles([quantile])[quantile]
+
+    def close(self):
+        # Removes the temporary file of the branch curves.
+        del self.curves
+        self._file.close()
+
+def _runGeometryGroup(task):
+    # Runs the given rate branches of one geometry group for every GMM branch; top-level so that it can
+    # be sent to worker processes.
+    (coordinates, seismicDepth, minMag, maxMag, dip, rake, scaling, sites, meshSpace, imts, IMthresholds,
+     grBranches, gmmBranches, groupWeight, maxChunkElements, maxDistance, magBinEdges) = task
+
+    grMFDs = [mfdStage(minMag, maxMag, aGR, bGR, magBinEdges=magBinEdges) for (aGR, bGR), _ in grBranches]
+    grWeights = np.array([weight for _, weight in grBranches])
+
+    # Rupture geometry only depends on the magnitude bins, which all rate branches share. The mean
+    # magnitude of a non-uniform bin depends on bGR; the ruptures take that of the first rate branch.
+    eqSource = sourceStage(coordinates, seismicDepth, dip, rake)
+    magnScaling = scalingStage(eqSource, grMFDs[0], scaling)
+    eqSourceModeling = meshStage(eqSource, grMFDs[0], magnScaling, meshSpace)
+    ruptures = eqSourceModeling.ruptureSet
+
+    # Rates of every rate branch on the shared ruptures, shape (nGR, nRuptures).
+    ruptureCounts = np.diff(ruptures.magnitudeOffsets)
+    ruptureRates = np.array([np.repeat(grMFD.pmfMFD, ruptureCounts) * ruptures.distancePMF * grMFD.sourceRate
+                             for grMFD in grMFDs])
+
+    imThresholdList = np.asarray(IMthresholds, dtype=float)
+    gmmCalc = gmmCalculations(eqSourceModeling, rake, sites.soilConditionVs30, imts)
+    hazardCurves = np.zeros((len(gmmBranches), len(sites), len(grBranches), len(imThresholdList)))
+    sitesPerChunk = max(1, maxChunkElements // len(ruptures))
+    for start in range(0, len(sites), sitesPerChunk):
+        stop = min(start + sitesPerChunk, len(sites))
+        # Distances are computed once and shared by the GMM branches.
+        ruptureIndex, (distanceMatrix, _, _), inRange = eqSourceModeling.siteRuptureDistances(
+            sites.siteCoordinates[start:stop], maxDistance)
+        for index, (GMM, _) in enumerate(gmmBranches):
+            median, tau, phi, sig = gmmCalc.getGMIMMatrix(GMM, distanceMatrix, sites.soilConditionVs30[start:stop],
+                                                          ruptureIndex)
+            hazardCurves[index, start:stop] = hazardIntegral(np.where(inRange, median, 0.0), sig,
+                                                             ruptureRates[:, ruptureIndex], imThresholdList,
+                                                             maxChunkElements)
+
+    # Branch curves, shape (nGMM * nGR, nSites, nThresholds), and their weights.
+    curves = np.moveaxis(hazardCurves, 2, 1).reshape(-1, len(sites), len(imThresholdList))
+    weights = np.outer([weight for _, weight in gmmBranches], grWeights).ravel() * groupWeight
+
+    return curves, weights
+
+def adaptiveMagnitudeEdges(tree, minMag, maxMag, rake, sites, imts, IMthresholds, magnitudeTolerance):
+    # Union of the adaptive bin edges of every rate branch, GMM branch and site Vs30, so that the branches
+    # of a geometry group keep sharing their ruptures and each stays under the tolerance.
+    edges = []
+    for GMM, _ in tree.gmmBranches:
+        for vs30 in np.unique(sites.soilConditionVs30):
+            exceedance = magnitudeExceedance(GMM, IMthresholds, REFERENCE_DISTANCES, rake, vs30, imts)
+            edges += [DoublyBoundedGRModel.adaptive(minMag, maxMag, aGR, bGR, exceedance,
+                                                    magnitudeTolerance).magBinEdges
+                      for (aGR, bGR), _ in tree.grBranches]
+
+    return np.unique(np.concatenate(edges))
+
+def runLogicTree(tree, coordinates, seismicDepth, minMag, dip, rake, sites, meshSpace, imts, IMthresholds,
+                 fractiles=(0.16, 0.5, 0.84), nWorkers=None, maxChunkElements=2_000_000, maxDistance=None,
+                 magnitudeTolerance=None):
+    """
+    Run every branch of the logic tree for a site collection.
+    :param nWorkers: Number of worker processes; 1 runs the branches in this process.
+    :param maxDistance: Integration distance in km, or an integrationDistance; None keeps all ruptures.
+    :param magnitudeTolerance: Tolerance of adaptive magnitude bins, see mainWebGUI_def; the bins of a maximum
+    magnitude are shared by all its branches. None keeps the uniform bins.
+    :return: Weighted mean hazard curves, shape (nSites, nThresholds), and a dictionary of fractile curves.
+    """
+    # Rate branches of a geometry group are split across tasks when there are fewer groups than workers.
+    geometryGroups = tree.geometryGroups()
+    workerCount = nWorkers or os.cpu_count() or 1
+    splitCount = min(len(tree.grBranches), max(1, workerCount // len(geometryGroups)))
+    magBinEdges = {maxMag: None if magnitudeTolerance is None else
+                   adaptiveMagnitudeEdges(tree, minMag, maxMag, rake, sites, imts, IMthresholds, magnitudeTolerance)
+                   for maxMag, _, _ in geometryGroups}
+    tasks = [(coordinates, seismicDepth, minMag, maxMag, dip, rake, scaling, sites, meshSpace, imts, IMthresholds,
+              [tree.grBranches[i] for i in grIndices], tree.gmmBranches, groupWeight, maxChunkElements, maxDistance,
+              magBinEdges[maxMag])
+             for maxMag, scaling, groupWeight in geometryGroups
+             for grIndices in np.array_split(np.arange(len(tree.grBranches)), splitCount)]
+
+    statistics = hazardCurveStatistics((len(sites), len(IMthresholds)), len(tree),
+                                       maxChunkElements=maxChunkElements)
+    if workerCount == 1:
+        for task in tasks:
+            statistics.add(*_runGeometryGroup(task))
+    else:
+        with ProcessPoolExecutor(max_workers=workerCount) as executor:
+            for future in as_completed([executor.submit(_runGeometryGroup, task) for task in tasks]):
+                statistics.add(*future.result())
+
+    meanCurves, fractileCurves = statistics.mean(), statistics.fractiles(fractiles)
+    statistics.close()
+
+    return meanCurves, fractileCurves
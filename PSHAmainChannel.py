@@ -18,42 +18,257 @@ This code is written for understanding probabilistic seismic hazard analysis.
     (Baker, Jack W. (2013) Probabilistic Seismic Hazard Analysis. White Paper Version 2.0.1, 79 pp.)
 """
 
+import copy
+import os
 from ruptureUtils.magnitudeFreqDist import *
 from ruptureUtils.earthquakeSourceCharacteristics import *
 from ruptureUtils.magnitudeAreaScalingRelation import *
 from ruptureUtils.sourceModeling import *
+from ruptureUtils.griddedSourceModeling import *
+from ruptureUtils.integrationDistance import *
+from ruptureUtils.geometryCache import *
 from gmmFile.gmmMain import *
 from visualizations.hazardCurve import *
+from visualizations.eventBasedHazard import *
+from visualizations.disaggregation import *
+from siteUtils.siteCollection import *
+from PSHAprofiler import *
+from PSHAresultStore import *
 
-def mainWebGUI_def(coordinates, seismicDepth, minMag, maxMag, aGR, bGR, dip, rake, siteCoordinate,
-                   soilConditionVs30, meshSpace, imts, GMM, IMthresholds):
-    # PSHA Steps
+# Pipeline stages. Each stage only depends on its arguments and does not modify them, so its
+# output can be cached by the caller with a key made of the inputs of the stage and its upstream stages.
+
+def sourceStage(coordinates, seismicDepth, dip, rake, strikes=None):
     # Identify all earthquake sources capable of producing damaging ground motions.
-    eqSource = earthquakeSources(coordinates, seismicDepth, dip, rake)
+    # strikes are those of the ruptures of a point or area source.
+    eqSource = earthquakeSources(coordinates, seismicDepth, dip, rake, strikes)
     eqSource.sourceCharacteristics()
 
-    # Characterize the distribution of earthquake magnitudes.
-    mfd = DoublyBoundedGRModel(minMag, maxMag, aGR, bGR)
+    return eqSource
+
+# Distances (km) at which the adaptive magnitude bins keep the hazard error under the tolerance. The
+# error is that of the GMM's magnitude dependence at these fixed distances; how the rupture geometry,
+# and so the distance distribution, changes with magnitude is not part of it.
+REFERENCE_DISTANCES = [1.0, 5.0, 20.0, 50.0, 100.0, 200.0]
+
+def mfdStage(minMag, maxMag, aGR, bGR, magnitudeTolerance=None, exceedance=None, magBinEdges=None):
+    # Characterize the distribution of earthquake magnitudes. With magnitudeTolerance, the magnitude bins
+    # are chosen adaptively for the exceedance measure, see DoublyBoundedGRModel.adaptive; magBinEdges
+    # gives bins chosen before, e.g. shared by the branches of a logic tree.
+    if magBinEdges is not None:
+        mfd = DoublyBoundedGRModel(minMag, maxMag, aGR, bGR, magBinEdges=magBinEdges)
+    elif magnitudeTolerance is None:
+        mfd = DoublyBoundedGRModel(minMag, maxMag, aGR, bGR)
+    else:
+        mfd = DoublyBoundedGRModel.adaptive(minMag, maxMag, aGR, bGR, exceedance, magnitudeTolerance)
     mfd.db_gr_mfd_model()
 
-    # Characterize the distribution of source-to-site distances.
-    # Magnitude-Area scaling relation
+    return mfd
+
+# Rupture geometry does not depend on the rates, site, Vs30 or IMT, so scaling and meshing results are
+# shared through this cache. Set PSHA_GEOMETRY_CACHE to a directory to also keep them on disk.
+GEOMETRY_CACHE = geometryCache(cacheDir=os.environ.get("PSHA_GEOMETRY_CACHE"))
+SCALING_ATTRIBUTES = ["ruptureLength", "ruptureWidth", "ruptureTopDepth"]
+MESH_ARRAYS = ["pieceStartingCoordinates", "pieceEndingCoordinates", "magnitudeOffsets"]
+
+def scalingStage(eqSource, mfd, scalingRelation='Leonard2014', cache=GEOMETRY_CACHE):
+    # Magnitude-Area scaling relation, given by the suffix of the magnitudeScaling method.
     magnScaling = magnitudeScaling(eqSource.faultingMechanism, eqSource.faultLength, eqSource.faultWidth,
                                    eqSource.seismicDepth[0])
-    magnScaling.magnScalingLeonard2014(mfd, eqSource)
+    if not hasattr(magnScaling, 'magnScaling' + scalingRelation):
+        raise Exception(scalingRelation + " is not a valid scaling relation.")
+
+    key = geometryKey("scaling", scalingRelation, *sourceKeyParts(eqSource), np.asarray(mfd.magRange, dtype=float))
+    geometry = cache.get(key) if cache is not None else None
+    if geometry is None:
+        getattr(magnScaling, 'magnScaling' + scalingRelation)(mfd, eqSource)
+        if cache is not None:
+            cache.put(key, {name: getattr(magnScaling, name) for name in SCALING_ATTRIBUTES})
+    else:
+        for name in SCALING_ATTRIBUTES:
+            setattr(magnScaling, name, geometry[name].tolist())
 
-    # Meshing line (fault) source.
+    return magnScaling
+
+def meshStage(eqSource, mfd, magnScaling, meshSpace, cache=GEOMETRY_CACHE):
+    # Meshing line (fault) source, or gridding a point or area source.
+    if eqSource.sourceType in GRIDDED_SOURCE_TYPES:
+        return griddedMeshStage(eqSource, mfd, magnScaling, meshSpace, cache)
     eqSourceModeling = earthquakeSourcesModeling(eqSource, mfd, magnScaling, meshSpace)
-    eqSourceModeling.ruptureProps()
 
-    # Calculates closest distance between site and ruptures.
-    eqSourceModeling.calculateClosestDistance(siteCoordinate)
+    key = geometryKey("mesh", *sourceKeyParts(eqSource), float(meshSpace),
+                      *[np.asarray(getattr(magnScaling, name), dtype=float) for name in SCALING_ATTRIBUTES])
+    geometry = cache.get(key) if cache is not None else None
+    if geometry is None:
+        ruptureCoordinates = eqSourceModeling.getRuptureCoordinate()
+        if cache is not None:
+            cache.put(key, dict(zip(MESH_ARRAYS, ruptureCoordinates)))
+    else:
+        ruptureCoordinates = tuple(geometry[name] for name in MESH_ARRAYS)
+    eqSourceModeling.ruptureProps(ruptureCoordinates)
+
+    return eqSourceModeling
+
+def griddedMeshStage(eqSource, mfd, magnScaling, meshSpace, cache=GEOMETRY_CACHE):
+    # Nodes of a point or area source and its distance table. The table only depends on the rupture
+    # dimensions and dip, so it is shared by every source with the same scaling results.
+    eqSourceModeling = griddedSourcesModeling(eqSource, mfd, magnScaling, meshSpace)
+
+    key = geometryKey("distanceTable", float(eqSource.dip), eqSourceModeling.distanceGrid,
+                      eqSourceModeling.azimuthBins, np.asarray(magnScaling.ruptureLength, dtype=float),
+                      np.asarray(magnScaling.ruptureWidth, dtype=float))
+    geometry = cache.get(key) if cache is not None else None
+    if geometry is None:
+        distanceTable = eqSourceModeling.getDistanceTable()
+        if cache is not None:
+            cache.put(key, {"distanceTable": distanceTable})
+    else:
+        distanceTable = geometry["distanceTable"]
+    eqSourceModeling.ruptureProps(distanceTable)
+
+    return eqSourceModeling
+
+def distanceStage(eqSourceModeling, siteCoordinate, maxDistance=None):
+    # Calculates Rjb, Rrup and Rx between site and the rupture surfaces within the integration distance.
+    # Returns the indices of those ruptures and their distances.
+    ruptureIndex, distances, inRange = eqSourceModeling.siteRuptureDistances([siteCoordinate], maxDistance)
+
+    return ruptureIndex[inRange[0]], tuple(values[0, inRange[0]] for values in distances)
+
+def gmmStage(eqSourceModeling, distances, rake, soilConditionVs30, imts, GMM):
+    # GMM, evaluated on a copy of the rupture set holding the ruptures within the integration distance.
+    siteModeling = copy.copy(eqSourceModeling)
+    siteModeling.ruptureSet = eqSourceModeling.siteRuptureSet(*distances)
 
-    # GMM
-    gmmCalc = gmmCalculations(eqSourceModeling, rake, soilConditionVs30, imts)
+    gmmCalc = gmmCalculations(siteModeling, rake, soilConditionVs30, imts)
     gmmCalc.getGMIM(GMM)
 
+    return siteModeling.ruptureSet
+
+def hazardStage(ruptures, mfd, IMthresholds):
     # Hazard Curve
-    hazardCurveFigure = hazardCurveCalculator(eqSourceModeling.ruptureDataframe, mfd, IMthresholds, imts)
+    return hazardCurveCalculator(ruptures, mfd, IMthresholds)
+
+def eventBasedHazardStage(ruptures, mfd, IMthresholds, investigationYears=1_000_000, seed=42, nWorkers=1):
+    # Hazard curve from a stochastic event catalog, an alternative to hazardStage.
+    return eventBasedHazardCalculator(ruptures, mfd, IMthresholds, investigationYears, seed, nWorkers=nWorkers)
+
+def mainWebGUI_def(coordinates, seismicDepth, minMag, maxMag, aGR, bGR, dip, rake, siteCoordinate,
+                   soilConditionVs30, meshSpace, imts, GMM, IMthresholds, maxDistance=None, profiler=None,
+                   magnitudeTolerance=None, strikes=None):
+    # With a stageProfiler, the time, peak memory and row count of every stage are recorded in it.
+    # With magnitudeTolerance, e.g. 0.01, the magnitude bins are the fewest keeping the relative hazard
+    # error of the discretization under it at the IM thresholds and REFERENCE_DISTANCES. Only the error of
+    # the GMM's magnitude dependence at those distances is controlled, not that of the rupture geometry.
+    # PSHA Steps
+    with profileStage(profiler, "source") as record:
+        eqSource = sourceStage(coordinates, seismicDepth, dip, rake, strikes)
+        record["rows"] = len(coordinates)
+    with profileStage(profiler, "MFD") as record:
+        exceedance = (magnitudeExceedance(GMM, IMthresholds, REFERENCE_DISTANCES, rake, soilConditionVs30, imts)
+                      if magnitudeTolerance is not None else None)
+        mfd = mfdStage(minMag, maxMag, aGR, bGR, magnitudeTolerance, exceedance)
+        record["rows"] = len(mfd.magRange)
+
+    # Characterize the distribution of source-to-site distances.
+    with profileStage(profiler, "scaling") as record:
+        magnScaling = scalingStage(eqSource, mfd)
+        record["rows"] = len(magnScaling.ruptureLength)
+    with profileStage(profiler, "mesh") as record:
+        eqSourceModeling = meshStage(eqSource, mfd, magnScaling, meshSpace)
+        record["rows"] = len(eqSourceModeling.ruptureSet)
+    with profileStage(profiler, "distance") as record:
+        distances = distanceStage(eqSourceModeling, siteCoordinate, maxDistance)
+        record["rows"] = len(distances[0])
+
+    # Predict the distribution of ground motion intensity and combine uncertainties.
+    with profileStage(profiler, "GMM") as record:
+        ruptures = gmmStage(eqSourceModeling, distances, rake, soilConditionVs30, imts, GMM)
+        record["rows"] = len(ruptures)
+    with profileStage(profiler, "hazard") as record:
+        rateExceedance = hazardStage(ruptures, mfd, IMthresholds)
+        record["rows"] = len(IMthresholds)
+    hazardCurveFigure = plotHazardCurve(IMthresholds, rateExceedance, imts)
+
+    return ruptures.toDataframe(), hazardCurveFigure
+
+def mainHazardMap_def(coordinates, seismicDepth, minMag, maxMag, aGR, bGR, dip, rake, sites,
+                      meshSpace, imts, GMM, IMthresholds, maxChunkElements=2_000_000,
+                      disaggregationRate=None, distanceBins=DEFAULT_DISTANCE_BINS, epsilonBins=DEFAULT_EPSILON_BINS,
+                      maxDistance=None, resultPath=None, inputs=None, strikes=None):
+    # Site/rupture pairs beyond maxDistance (km, or an integrationDistance) are left out of the integral.
+    # With resultPath, the hazard curves, sites and ruptures are also written there in the result store
+    # format, with the inputs dictionary as metadata.
+    # With disaggregationRate, the M-R-epsilon disaggregation of every site at that annual rate is
+    # computed in the same pass and returned as a third value.
+    # Source, MFD, scaling and rupture mesh do not depend on the site, so they are built once.
+    eqSource = sourceStage(coordinates, seismicDepth, dip, rake, strikes)
+    mfd = mfdStage(minMag, maxMag, aGR, bGR)
+    magnScaling = scalingStage(eqSource, mfd)
+    eqSourceModeling = meshStage(eqSource, mfd, magnScaling, meshSpace)
+    gmmCalc = gmmCalculations(eqSourceModeling, rake, sites.soilConditionVs30, imts)
+    # Curves are evaluated and stored at the given thresholds; rounding is left to the displays.
+    imThresholdList = np.asarray(IMthresholds, dtype=float)
+
+    # Distances, GMM and hazard integral are evaluated as (sites x ruptures) arrays, in site chunks.
+    hazardCurves = np.zeros((len(sites), len(imThresholdList)))
+    disaggregationChunks = []
+    sitesPerChunk = max(1, maxChunkElements // len(eqSourceModeling.ruptureSet))
+    for start in range(0, len(sites), sitesPerChunk):
+        stop = min(start + sitesPerChunk, len(sites))
+        ruptureIndex, distances, inRange = eqSourceModeling.siteRuptureDistances(sites.siteCoordinates[start:stop],
+                                                                                 maxDistance)
+        distanceMatrix = distances[0]
+        median, tau, phi, sig = gmmCalc.getGMIMMatrix(GMM, distanceMatrix, sites.soilConditionVs30[start:stop],
+                                                      ruptureIndex)
+        # A zero median removes an out-of-range pair from the integral.
+        median = np.where(inRange, median, 0.0)
+        # Rates of gridded sources differ by site, shape (nSites, nKept).
+        ruptureRates = eqSourceModeling.siteRuptureRates(mfd.sourceRate, ruptureIndex, distances)
+        hazardCurves[start:stop] = hazardIntegral(median, sig, ruptureRates, imThresholdList, maxChunkElements,
+                                                  siteRates=np.ndim(ruptureRates) == 2)
+
+        if disaggregationRate is not None:
+            imLevel = hazardMapValues(imThresholdList, hazardCurves[start:stop], [disaggregationRate])[:, 0]
+            disaggregationChunks.append(disaggregationAtIMLevel(
+                eqSourceModeling.ruptureSet.magnitude[ruptureIndex], distanceMatrix, median, sig,
+                ruptureRates, imLevel,
+                magnitudeBinEdges(mfd.magRange), distanceBins, epsilonBins))
+
+    if resultPath is not None:
+        saveResult(resultPath, imThresholdList, hazardCurves, sites.siteCoordinates, sites.soilConditionVs30,
+                   eqSourceModeling.ruptureSet, inputs, sites.gridShape)
+
+    if disaggregationRate is None:
+        return eqSourceModeling.ruptureSet, hazardCurves
+
+    disaggregation = {key: (np.concatenate([chunk[key] for chunk in disaggregationChunks])
+                            if not key.endswith("Bins") else disaggregationChunks[0][key])
+                      for key in disaggregationChunks[0]}
+    return eqSourceModeling.ruptureSet, hazardCurves, disaggregation
+
+def mainUniformHazard_def(coordinates, seismicDepth, minMag, maxMag, aGR, bGR, dip, rake, sites,
+                          meshSpace, imts, GMM, targetRates, imBounds=(1e-4, 10.0), maxChunkElements=2_000_000,
+                          maxDistance=None, strikes=None):
+    # IM levels of every site at the target annual rates, e.g. poeToAnnualRate([0.1, 0.02], 50), solved
+    # directly instead of being interpolated from hazard curves on a dense threshold grid.
+    eqSource = sourceStage(coordinates, seismicDepth, dip, rake, strikes)
+    mfd = mfdStage(minMag, maxMag, aGR, bGR)
+    magnScaling = scalingStage(eqSource, mfd)
+    eqSourceModeling = meshStage(eqSource, mfd, magnScaling, meshSpace)
+    gmmCalc = gmmCalculations(eqSourceModeling, rake, sites.soilConditionVs30, imts)
+
+    imLevels = np.zeros((len(sites), np.size(targetRates)))
+    sitesPerChunk = max(1, maxChunkElements // len(eqSourceModeling.ruptureSet))
+    for start in range(0, len(sites), sitesPerChunk):
+        stop = min(start + sitesPerChunk, len(sites))
+        ruptureIndex, distances, inRange = eqSourceModeling.siteRuptureDistances(sites.siteCoordinates[start:stop],
+                                                                                 maxDistance)
+        median, tau, phi, sig = gmmCalc.getGMIMMatrix(GMM, distances[0], sites.soilConditionVs30[start:stop],
+                                                      ruptureIndex)
+        median = np.where(inRange, median, 0.0)
+        ruptureRates = eqSourceModeling.siteRuptureRates(mfd.sourceRate, ruptureIndex, distances)
+        imLevels[start:stop] = inverseHazard(median, sig, ruptureRates, targetRates, imBounds,
+                                             maxChunkElements=maxChunkElements)
 
-    return eqSourceModeling.ruptureDataframe, hazardCurveFigure
\ No newline at end of file
+    return eqSourceModeling.ruptureSet, imLevels
@@ -0,0 +1,112 @@
+### PSHA Stage Profiler ###
+
+"""
+Optional per-stage instrumentation of the PSHA pipeline.
+
+    A stageProfiler records the wall time, the peak memory allocated above the stage's starting point
+    (tracemalloc) and a row count for each stage it wraps. The records are returned as a report
+    dictionary, which hooks can write elsewhere, e.g. to JSON for batch runs.
+
+    tracemalloc traces the whole process. Profiled stages of concurrent jobs, e.g. in the threads of the
+    app, share the tracing; a stage that overlapped another one has no peak memory and is marked with
+    memoryOverlap, since its peak would include, or be reset by, the other stage.
+"""
+
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Tracing shared by the profiled stages of the process: the number of running stages, the number of
+# stages started so far, and whether the profilers started tracing.
+_TRACE_LOCK = threading.Lock()
+_traceState = {"running": 0, "started": 0, "tracingStarted": False}
+
+class stageProfiler():
+
+    def __init__(self, traceMemory=True, hooks=None):
+        """
+        :param traceMemory: Record the peak memory of each stage; tracing slows the stages down a little.
+        :param hooks: Callables receiving the report when finish() is called.
+        """
+        self.traceMemory = traceMemory
+        self.hooks = list(hooks) if hooks is not None else []
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        Profile the block of a stage. The yielded record can be updated inside the block, e.g. with the
+        number of rows the stage produced.
+        """
+        record = {"stage": name, "seconds": None, "peakMemoryMB": None, "rows": rows}
+
+        if self.traceMemory:
+            record["memoryOverlap"] = False
+            with _TRACE_LOCK:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    _traceState["tracingStarted"] = True
+                _traceState["running"] += 1
+                _traceState["started"] += 1
+                startedBefore = _traceState["started"]
+                overlapped = _traceState["running"] > 1
+                if not overlapped:
+                    tracemalloc.reset_peak()
+                startMemory = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            if self.traceMemory:
+                with _TRACE_LOCK:
+                    # Another stage ran at some point of this one if it was running at the start, or
+                    # started since.
+                    overlapped = overlapped or _traceState["started"] != startedBefore
+                    if overlapped:
+                        record["memoryOverlap"] = True
+                    else:
+                        record["peakMemoryMB"] = (tracemalloc.get_traced_memory()[1] - startMemory) / 2 ** 20
+                    _traceState["running"] -= 1
+                    if _traceState["running"] == 0 and _traceState["tracingStarted"]:
+                        tracemalloc.stop()
+                        _traceState["tracingStarted"] = False
+            self.records.append(record)
+
+    def report(self):
+        """
+        :return: Dictionary with the stage records, in the order they ran, and their totals.
+        """
+        peaks = [record["peakMemoryMB"] for record in self.records if record["peakMemoryMB"] is not None]
+        return {
+            "stages": [dict(record) for record in self.records],
+            "totalSeconds": sum(record["seconds"] for record in self.records),
+            "peakMemoryMB": max(peaks) if peaks else None,
+        }
+
+    def finish(self):
+        # Pass the report to the hooks and return it.
+        report = self.report()
+        for hook in self.hooks:
+            hook(report)
+
+        return report
+
+def profileStage(profiler, name, rows=None):
+    # Stage context of the profiler, or a no-op context without a profiler.
+    if profiler is None:
+        return nullcontext({})
+    return profiler.stage(name, rows)
+
+def jsonReportHook(path):
+    """
+    Hook writing the report to a JSON file.
+    """
+    def writeReport(report):
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2)
+
+    return writeReport
@@ -0,0 +1,223 @@
+### PSHA Result Store ###
+
+"""
+Columnar on-disk format of PSHA results.
+
+    A result is a directory holding
+        metadata.json           inputs of the run, shapes and the file list
+        imThresholds.npy        IM thresholds of the curves, shape (nThresholds,)
+        hazardCurves.npy        rates of exceedance, shape (nSites, nThresholds), read memory-mapped
+        siteCoordinates.npy     site coordinates, shape (nSites, 2)
+        soilConditionVs30.npy   site Vs30, shape (nSites,)
+        ruptures.parquet        rupture set, one column per array (coordinates split in x and y)
+
+    Hazard curves are opened with np.load(mmap_mode='r'), so one site's curve is read without loading
+    the whole matrix, and rupture columns are read from Parquet on demand. One site's curve can be
+    printed as CSV from the command line:
+
+        python PSHAresultStore.py results/izmit-grid --site 29.2,41.0
+"""
+
+import argparse
+import json
+import sys
+import os
+from datetime import datetime, timezone
+import numpy as np
+from ruptureUtils.ruptureSet import ruptureSet
+
+# Version 1 stored the IM thresholds rounded to 4 decimals in metadata.json.
+RESULT_FORMAT_VERSION = 2
+
+# Per-rupture arrays of a ruptureSet stored as single Parquet columns.
+RUPTURE_COLUMNS = ["magnitude", "magnitudePMF", "distancePMF", "ruptureWidth", "ruptureTopDepth", "closestDistance",
+                   "ruptureDistance", "strikeNormalDistance", "imMedian"]
+
+def ruptureSetToTable(ruptures):
+    """
+    Flat table of a rupture set with numeric columns only; arrays that are not set are left out.
+    """
+    import pandas as pd
+
+    data = {
+        "startingX": ruptures.startingCoordinates[:, 0],
+        "startingY": ruptures.startingCoordinates[:, 1],
+        "endingX": ruptures.endingCoordinates[:, 0],
+        "endingY": ruptures.endingCoordinates[:, 1],
+    }
+    for name in RUPTURE_COLUMNS:
+        values = getattr(ruptures, name)
+        if values is not None and np.ndim(values) == 1:
+            data[name] = values
+
+    return pd.DataFrame(data)
+
+def ruptureSetFromTable(table, magnitudeOffsets=None, residuals=None):
+    """
+    Rebuild a rupture set from its table.
+    :param residuals: Optional tau, phi and totalSigma dictionary of the GMM.
+    """
+    ruptures = ruptureSet(table["magnitude"].to_numpy(), table["magnitudePMF"].to_numpy(),
+                          table["distancePMF"].to_numpy(), table[["startingX", "startingY"]].to_numpy(),
+                          table[["endingX", "endingY"]].to_numpy(), magnitudeOffsets)
+    for name in RUPTURE_COLUMNS[3:]:
+        if name in table:
+            setattr(ruptures, name, table[name].to_numpy())
+    for name, value in (residuals or {}).items():
+        setattr(ruptures, name, value)
+
+    return ruptures
+
+def _jsonValue(value):
+    # Inputs as JSON values: arrays to lists, numpy scalars to Python numbers, other objects to strings.
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_jsonValue(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _jsonValue(item) for key, item in value.items()}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+def saveResult(path, imThresholds, hazardCurves, siteCoordinates, soilConditionVs30=None, ruptures=None,
+               inputs=None, gridShape=None):
+    """
+    Write a result directory.
+    :param imThresholds: IM thresholds, shape (nThresholds,).
+    :param hazardCurves: Rates of exceedance, shape (nThresholds,) for one site or (nSites, nThresholds).
+    :param siteCoordinates: Site coordinates, shape (2,) or (nSites, 2).
+    :param ruptures: Optional rupture set, written to ruptures.parquet.
+    :param inputs: Dictionary of the run inputs, recorded in the metadata.
+    :param gridShape: Grid shape of the sites, e.g. siteCollection.gridShape.
+    :return: Path of the result directory.
+    """
+    os.makedirs(path, exist_ok=True)
+    siteCoordinates = np.atleast_2d(np.asarray(siteCoordinates, dtype=float))
+    hazardCurves = np.asarray(hazardCurves, dtype=float).reshape(len(siteCoordinates), -1)
+
+    # Written through a memory map, so the file has the layout np.load(mmap_mode='r') reads.
+    curveFile = np.lib.format.open_memmap(os.path.join(path, "hazardCurves.npy"), mode="w+", dtype=np.float64,
+                                          shape=hazardCurves.shape)
+    curveFile[:] = hazardCurves
+    curveFile.flush()
+    del curveFile
+
+    # Thresholds at full precision, so that they stay the abscissae of the curves.
+    np.save(os.path.join(path, "imThresholds.npy"), np.asarray(imThresholds, dtype=np.float64))
+    np.save(os.path.join(path, "siteCoordinates.npy"), siteCoordinates)
+    if soilConditionVs30 is not None:
+        np.save(os.path.join(path, "soilConditionVs30.npy"),
+                np.broadcast_to(np.asarray(soilConditionVs30, dtype=float), (len(siteCoordinates),)))
+
+    files = ["imThresholds.npy", "hazardCurves.npy", "siteCoordinates.npy"] + (["soilConditionVs30.npy"] if soilConditionVs30 is not None
+                                                           else [])
+    residuals = None
+    magnitudeOffsets = None
+    if ruptures is not None:
+        ruptureSetToTable(ruptures).to_parquet(os.path.join(path, "ruptures.parquet"), index=False)
+        files.append("ruptures.parquet")
+        residuals = {name: _jsonValue(getattr(ruptures, name)) for name in ["tau", "phi", "totalSigma"]
+                     if getattr(ruptures, name) is not None}
+        magnitudeOffsets = _jsonValue(ruptures.magnitudeOffsets)
+
+    metadata = {
+        "formatVersion": RESULT_FORMAT_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "inputs": _jsonValue(inputs or {}),
+        "siteCount": len(siteCoordinates),
+        "gridShape": _jsonValue(gridShape),
+        "ruptureCount": None if ruptures is None else len(ruptures),
+        "magnitudeOffsets": magnitudeOffsets,
+        "residuals": residuals,
+        "files": files,
+    }
+    with open(os.path.join(path, "metadata.json"), "w") as file:
+        json.dump(metadata, file, indent=2)
+
+    return path
+
+class resultStore():
+    """
+    Read access to a result directory; arrays are opened lazily and hazard curves are memory-mapped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "metadata.json")) as file:
+            self.metadata = json.load(file)
+        if self.metadata["formatVersion"] > RESULT_FORMAT_VERSION:
+            raise Exception(str(self.metadata["formatVersion"]) + " is not a valid result format version.")
+        if "imThresholds.npy" in self.metadata["files"]:
+            self.imThresholds = np.load(os.path.join(path, "imThresholds.npy"))
+        else:
+            self.imThresholds = np.asarray(self.metadata["imThresholds"])
+        self._hazardCurves = None
+        self._siteCoordinates = None
+
+    def __len__(self):
+        return self.metadata["siteCount"]
+
+    @property
+    def inputs(self):
+        return self.metadata["inputs"]
+
+    @property
+    def hazardCurves(self):
+        # Read-only memory map; slicing it only reads the requested rows.
+        if self._hazardCurves is None:
+            self._hazardCurves = np.load(os.path.join(self.path, "hazardCurves.npy"), mmap_mode="r")
+        return self._hazardCurves
+
+    @property
+    def siteCoordinates(self):
+        if self._siteCoordinates is None:
+            self._siteCoordinates = np.load(os.path.join(self.path, "siteCoordinates.npy"), mmap_mode="r")
+        return self._siteCoordinates
+
+    def siteCurve(self, index):
+        # Hazard curve of one site, read from the memory map.
+        return np.array(self.hazardCurves[index])
+
+    def nearestSite(self, siteCoordinate):
+        """
+        Index of the stored site closest to a coordinate (longitude, latitude).
+        """
+        coordinates = np.radians(self.siteCoordinates)
+        siteCoordinate = np.radians(np.asarray(siteCoordinate, dtype=float))
+        # Squared great-circle chord between unit vectors, without building them.
+        chord = (np.sin((coordinates[:, 1] - siteCoordinate[1]) / 2) ** 2 + np.cos(coordinates[:, 1]) *
+                 np.cos(siteCoordinate[1]) * np.sin((coordinates[:, 0] - siteCoordinate[0]) / 2) ** 2)
+        return int(np.argmin(chord))
+
+    def ruptureTable(self, columns=None):
+        """
+        Rupture table, or only the given columns of it.
+        """
+        if "ruptures.parquet" not in self.metadata["files"]:
+            raise Exception(self.path + " is not a result with ruptures.")
+        import pandas as pd
+
+        return pd.read_parquet(os.path.join(self.path, "ruptures.parquet"), columns=columns)
+
+    def ruptureSet(self):
+        # Rupture set with the stored arrays and GMM residuals.
+        return ruptureSetFromTable(self.ruptureTable(), self.metadata["magnitudeOffsets"], self.metadata["residuals"])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the hazard curve of one site of a stored result as CSV.")
+    parser.add_argument("result", help="Result directory.")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--index", type=int, default=0, help="Index of the site.")
+    group.add_argument("--site", help="Coordinate of the site; the closest stored site is used.")
+    args = parser.parse_args()
+
+    import pandas as pd
+
+    store = resultStore(args.result)
+    index = store.nearestSite(list(map(float, args.site.split(",")))) if args.site else args.index
+    print(f"# site {index}: " + ", ".join(f"{value:g}" for value in store.siteCoordinates[index]), file=sys.stderr)
+    pd.DataFrame({"IM threshold": store.imThresholds, "Annual rate of exceedance": store.siteCurve(index)}).to_csv(
+        sys.stdout, index=False)
@@ -0,0 +1,204 @@
+### PSHA Source Model ###
+
+"""
+Hazard of a source model holding many sources, e.g. the fault database of a region.
+
+    Each source uses the argument names of sourceStage and mfdStage:
+
+        {"name": "NAF-Izmit", "coordinates": [[29.0, 40.72], [29.9, 40.75], [30.6, 40.70]],
+         "seismicDepth": [0, 20], "dip": 90, "rake": 180, "minMag": 5, "maxMag": 7.6, "aGR": 3.5, "bGR": 1}
+
+    name, strikes and meshSpace are optional; meshSpace replaces the mesh spacing of the run for that
+    source. Fault traces may have any number of points, and their ruptures follow the trace. Sources
+    are read from a JSON file (a list of objects, or {"sources": [...]}), a JSON Lines file, or a GeoJSON
+    FeatureCollection whose features hold the other arguments as properties.
+
+    Sources are independent, so each one is meshed and integrated over the sites in its own task on a
+    process pool. Occurrences are Poissonian, so the rates of exceedance of the sources add up to the
+    rate of exceedance of the model; they are summed as the tasks finish.
+
+        python PSHAsourceModel.py faults.geojson --grid 28,31,40,41.5,0.05 --vs30 400 --max-distance 200
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from PSHAmainChannel import *
+
+SOURCE_DEFAULTS = dict(strikes=None, meshSpace=None)
+SOURCE_KEYS = ["coordinates", "seismicDepth", "dip", "rake", "minMag", "maxMag", "aGR", "bGR"]
+
+def geojsonSources(collection):
+    """
+    Sources of a GeoJSON FeatureCollection: LineString features are faults, Point features point sources
+    and Polygon features area sources.
+    :return: List of source dictionaries.
+    """
+    sources = []
+    for feature in collection["features"]:
+        geometry = feature["geometry"]
+        if geometry["type"] == "LineString":
+            coordinates = geometry["coordinates"]
+        elif geometry["type"] == "Point":
+            coordinates = [geometry["coordinates"]]
+        elif geometry["type"] == "Polygon":
+            # Exterior ring; GeoJSON rings repeat their first point at the end.
+            coordinates = geometry["coordinates"][0]
+        else:
+            raise Exception(geometry["type"] + " is not a valid source geometry.")
+
+        source = dict(feature.get("properties") or {})
+        # Elevations are dropped; depths are given by seismicDepth.
+        source["coordinates"] = [[float(value) for value in point[:2]] for point in coordinates]
+        if "name" not in source and "id" in feature:
+            source["name"] = str(feature["id"])
+        sources.append(source)
+
+    return sources
+
+class sourceModel():
+
+    def __init__(self, sources):
+        """
+        :param sources: List of source dictionaries, see the module docstring.
+        """
+        validSources = []
+        for index, source in enumerate(sources):
+            missing = [key for key in SOURCE_KEYS if key not in source]
+            if missing:
+                raise Exception("Source " + str(index) + " misses " + ", ".join(missing) + ".")
+            validSources.append(dict(SOURCE_DEFAULTS, name=f"source_{index:05d}") | source)
+
+        names = [source["name"] for source in validSources]
+        if len(set(names)) != len(names):
+            raise Exception("Source names are not unique.")
+        self.sources = validSources
+
+    def __len__(self):
+        return len(self.sources)
+
+    @classmethod
+    def fromFile(cls, path):
+        """
+        Read the sources of a JSON, JSON Lines or GeoJSON file.
+        """
+        with open(path) as file:
+            if path.endswith(".jsonl"):
+                sources = [json.loads(line) for line in file if line.strip()]
+            else:
+                sources = json.load(file)
+        if isinstance(sources, dict):
+            sources = geojsonSources(sources) if sources.get("type") == "FeatureCollection" else sources["sources"]
+
+        return cls(sources)
+
+def _runSource(task):
+    # Hazard curves of one source at a part of the sites; top-level so that it can be sent to worker processes.
+    (sourceIndex, source, siteSlice, sites, meshSpace, imts, GMM, IMthresholds, maxChunkElements,
+     maxDistance) = task
+    start = time.perf_counter()
+
+    try:
+        ruptures, hazardCurves = mainHazardMap_def(
+            source["coordinates"], source["seismicDepth"], source["minMag"], source["maxMag"], source["aGR"],
+            source["bGR"], source["dip"], source["rake"], sites,
+            meshSpace if source["meshSpace"] is None else source["meshSpace"], imts, GMM, IMthresholds,
+            maxChunkElements, maxDistance=maxDistance, strikes=source["strikes"])
+    except Exception as error:
+        raise Exception("Source " + source["name"] + " failed: " + str(error)) from error
+
+    return sourceIndex, siteSlice, hazardCurves, len(ruptures), time.perf_counter() - start
+
+def runSourceModel(model, sites, meshSpace, imts, GMM, IMthresholds, nWorkers=None, maxChunkElements=2_000_000,
+                   maxDistance=None, sourceCurves=False):
+    """
+    Total hazard of every source of a source model at a site collection.
+    :param model: sourceModel.
+    :param nWorkers: Number of worker processes; 1 runs the sources in this process.
+    :param maxDistance: Integration distance in km, or an integrationDistance; None keeps all ruptures.
+    :param sourceCurves: Also return the hazard curves of every source.
+    :return: Hazard curves, shape (nSites, nThresholds), and a summary record of every source. With sourceCurves,
+    the curves of the sources, shape (nSources, nSites, nThresholds), are returned as a third value.
+    """
+    # The sites are split across tasks when there are fewer sources than workers.
+    workerCount = nWorkers or os.cpu_count() or 1
+    splitCount = min(len(sites), max(1, workerCount // len(model)))
+    bounds = np.linspace(0, len(sites), splitCount + 1).astype(int)
+    tasks = [(index, source, slice(start, stop),
+              siteCollection(sites.siteCoordinates[start:stop], sites.soilConditionVs30[start:stop]), meshSpace, imts,
+              GMM, IMthresholds, maxChunkElements, maxDistance)
+             for index, source in enumerate(model.sources) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    hazardCurves = np.zeros((len(sites), len(IMthresholds)))
+    contributions = np.zeros((len(model), len(sites), len(IMthresholds))) if sourceCurves else None
+    summaries = [dict(name=source["name"], ruptures=0, seconds=0.0) for source in model.sources]
+
+    def addSourceHazard(sourceIndex, siteSlice, curves, ruptureCount, seconds):
+        hazardCurves[siteSlice] += curves
+        if contributions is not None:
+            contributions[sourceIndex, siteSlice] = curves
+        summaries[sourceIndex]["ruptures"] = ruptureCount
+        summaries[sourceIndex]["seconds"] += seconds
+
+    if workerCount == 1:
+        for done, task in enumerate(tasks, start=1):
+            addSourceHazard(*_runSource(task))
+            print(f"{done}/{len(tasks)} source tasks finished", file=sys.stderr)
+    else:
+        with ProcessPoolExecutor(max_workers=workerCount) as executor:
+            futures = [executor.submit(_runSource, task) for task in tasks]
+            for done, future in enumerate(as_completed(futures), start=1):
+                addSourceHazard(*future.result())
+                print(f"{done}/{len(tasks)} source tasks finished", file=sys.stderr)
+
+    if contributions is None:
+        return hazardCurves, summaries
+    return hazardCurves, summaries, contributions
+
+def parseNumbers(text, count=None):
+    # Comma-separated numbers of a command line argument.
+    values = [float(value) for value in text.split(",")]
+    if count is not None and len(values) != count:
+        raise argparse.ArgumentTypeError(text + " is not a list of " + str(count) + " numbers.")
+    return values
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the hazard of a source model without the Streamlit app.")
+    parser.add_argument("sources", help="JSON, JSON Lines or GeoJSON file of sources.")
+    parser.add_argument("--site", action="append", type=lambda text: parseNumbers(text, 2), default=[],
+                        help="Site as longitude,latitude; may be repeated.")
+    parser.add_argument("--grid", type=lambda text: parseNumbers(text, 5),
+                        help="Site grid as minimum longitude,maximum longitude,minimum latitude,maximum latitude,"
+                             "spacing in degrees.")
+    parser.add_argument("--vs30", type=float, default=760.0, help="Vs30 (m/s) of the sites.")
+    parser.add_argument("--imts", default="pga", help="Intensity measure type.")
+    parser.add_argument("--gmm", default="ASB14", help="Ground motion model.")
+    parser.add_argument("--thresholds", type=lambda text: parseNumbers(text, 3), default=[0.01, 2.0, 100],
+                        help="IM thresholds as start,stop,number, spaced logarithmically.")
+    parser.add_argument("--mesh-space", type=float, default=5.0, help="Rupture mesh spacing (km).")
+    parser.add_argument("--max-distance", type=float, default=None, help="Integration distance (km).")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes; all cores by default.")
+    parser.add_argument("--output", default="results/sourceModel", help="Result store directory.")
+    args = parser.parse_args()
+
+    if args.grid is not None:
+        sites = siteCollection.fromGrid(args.grid[0:2], args.grid[2:4], args.grid[4], args.vs30)
+    elif args.site:
+        sites = siteCollection(args.site, args.vs30)
+    else:
+        parser.error("one of --site or --grid is required.")
+
+    model = sourceModel.fromFile(args.sources)
+    IMthresholds = np.logspace(np.log10(args.thresholds[0]), np.log10(args.thresholds[1]), int(args.thresholds[2]))
+    hazardCurves, summaries = runSourceModel(model, sites, args.mesh_space, args.imts, args.gmm, IMthresholds,
+                                             args.workers, maxDistance=args.max_distance)
+
+    resultPath = saveResult(args.output, IMthresholds, hazardCurves, sites.siteCoordinates,
+                            sites.soilConditionVs30, inputs=vars(args) | {"sourceCount": len(model)},
+                            gridShape=sites.gridShape)
+    with open(os.path.join(resultPath, "sources.json"), "w") as file:
+        json.dump(summaries, file, indent=2)
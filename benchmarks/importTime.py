@@ -0,0 +1,74 @@
+### PSHA Import Time ###
+
+"""
+Cold-start import time of the calculation modules.
+
+    Each module is imported in a fresh interpreter, several times, and the best wall time is compared
+    with its budget. The modules must not load the plotting, mapping or UI dependencies, which are
+    imported by the functions that use them:
+
+        python -m benchmarks.importTime
+        python -m benchmarks.importTime --budget 0.3 --repeat 10
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+# Modules loaded lazily; importing the calculation core must not pull in any of them.
+LAZY_DEPENDENCIES = ["scipy", "pandas", "pyarrow", "matplotlib", "shapely", "geopy", "cartopy", "streamlit", "PIL"]
+
+# Modules timed by default.
+CORE_MODULES = ["PSHAmainChannel", "PSHAlogicTree", "PSHAbatch", "PSHAresultStore", "visualizations.mapGen"]
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "modules": sorted({{name.split(".")[0] for name in sys.modules}})}}))
+"""
+
+def measureImport(module, repeat=5):
+    """
+    Import a module in fresh interpreters.
+    :return: Best wall time in seconds and the lazy dependencies the import loaded.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", _IMPORT_SCRIPT.format(module=module)], capture_output=True,
+                                text=True, check=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        best = min(best, result["seconds"])
+
+    return best, [name for name in LAZY_DEPENDENCIES if name in result["modules"]]
+
+def checkImports(modules=CORE_MODULES, budget=0.5, repeat=5):
+    """
+    :param budget: Largest import time of each module, in seconds.
+    :return: List of (module, seconds, loaded lazy dependencies, within budget).
+    """
+    rows = []
+    for module in modules:
+        seconds, loaded = measureImport(module, repeat)
+        rows.append((module, seconds, loaded, seconds <= budget and not loaded))
+
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the cold-start import time of the calculation modules.")
+    parser.add_argument("modules", nargs="*", default=CORE_MODULES, help="Modules to import.")
+    parser.add_argument("--budget", type=float, default=0.5, help="Largest import time of a module, in seconds.")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh imports per module; the best time is kept.")
+    args = parser.parse_args()
+
+    rows = checkImports(args.modules, args.budget, args.repeat)
+    print(f"{'module':<28}{'seconds':>10}  loaded")
+    for module, seconds, loaded, passed in rows:
+        print(f"{module:<28}{seconds:>10.3f}  {', '.join(loaded)}{'' if passed else '  over budget'}")
+
+    failed = [row[0] for row in rows if not row[3]]
+    if failed:
+        sys.exit(f"{len(failed)} modules exceed the {args.budget:g} s budget or load lazy dependencies: "
+                 + ", ".join(failed))
@@ -0,0 +1,109 @@
+"""
+Reference implementations of the pipeline stages, as they were before vectorization. They are kept so
+that every optimization can be timed and checked against the original behaviour; they are not used by
+the app.
+"""
+
+import math
+import warnings
+from io import StringIO
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+from shapely.geometry import LineString, Point
+from geopy.distance import geodesic
+from gmmFile.gmmASB14 import AkkarEtAlRjb2014, _compute_mean, _compute_non_linear_term
+
+def referenceRuptureProps(eqSourceModeling):
+    """
+    Rupture table built magnitude by magnitude with per-point loops and DataFrame concatenation.
+    :return: Rupture DataFrame with the columns of the original implementation.
+    """
+    eqSource, mfd, magnScaling = eqSourceModeling.eqSource, eqSourceModeling.mfd, eqSourceModeling.magnScaling
+    meshSpace = eqSourceModeling.meshSpace
+
+    def getNewCoordinate(lon, lat, distanceList, azimuth):
+        lat, lon, azimuth = math.radians(lat), math.radians(lon), math.radians(azimuth)
+        R = 6371.0
+
+        newCoordinates = []
+        for distance in distanceList:
+            newLat = math.asin(math.sin(lat) * math.cos(distance / R) +
+                               math.cos(lat) * math.sin(distance / R) * math.cos(azimuth))
+            newLon = lon + math.atan2(math.sin(azimuth) * math.sin(distance / R) * math.cos(lat),
+                                      math.cos(distance / R) - math.sin(lat) * math.sin(newLat))
+            newCoordinates.append([np.round(math.degrees(newLon), 4), np.round(math.degrees(newLat), 4)])
+
+        return newCoordinates
+
+    ruptureDataframe = pd.DataFrame(columns=["Magnitude", "Starting coordinate", "Ending coordinate"])
+    for i, magnitude in enumerate(mfd.magRange):
+        ruptureLength = min(magnScaling.ruptureLength[i], eqSource.faultLength)
+        meshSpaceChanged = int(ruptureLength / meshSpace) * meshSpace
+        faultMeshDistances = np.arange(0, eqSource.faultLength - meshSpaceChanged, meshSpace)
+        lastUnrupturedPart = eqSource.faultLength - (faultMeshDistances[-1] + magnScaling.ruptureLength[i])
+        faultMeshDistances = faultMeshDistances + lastUnrupturedPart / 2
+
+        startingCoordinates = getNewCoordinate(eqSource.coordinates[0][0], eqSource.coordinates[0][1],
+                                               faultMeshDistances, eqSource.strike)
+        endingCoordinates = [getNewCoordinate(start[0], start[1], [magnScaling.ruptureLength[i]], eqSource.strike)[0]
+                             for start in startingCoordinates]
+
+        data = {
+            "Magnitude": [magnitude] * len(startingCoordinates),
+            "P(M=m)": [mfd.pmfMFD[np.where(mfd.magRange == magnitude)[0]][0]] * len(startingCoordinates),
+            "P(R=r|m)": [1 / len(startingCoordinates)] * len(startingCoordinates),
+            "Starting coordinate": startingCoordinates,
+            "Ending coordinate": endingCoordinates,
+        }
+        with warnings.catch_warnings():
+            # pandas warns about concatenating to the initial empty frame.
+            warnings.simplefilter("ignore", FutureWarning)
+            ruptureDataframe = pd.concat([ruptureDataframe, pd.DataFrame(data)], ignore_index=True)
+        ruptureDataframe.index = ruptureDataframe.index + 1
+
+    return ruptureDataframe
+
+def referenceClosestDistance(ruptureDataframe, siteCoordinate):
+    # Row by row shapely projection and geodesic distance to the rupture traces.
+    distances = []
+    point_geom = Point(siteCoordinate)
+    for _, row in ruptureDataframe.iterrows():
+        line = LineString([row["Starting coordinate"], row["Ending coordinate"]])
+        nearest_point = line.interpolate(line.project(point_geom))
+        distances.append(geodesic((point_geom.y, point_geom.x), (nearest_point.y, nearest_point.x)).kilometers)
+
+    ruptureDataframe["Closest Distance"] = distances
+
+def referenceGetGMIM(ruptureDataframe, rake, soilConditionVs30, imts):
+    # ASB14 with the coefficient table parsed from text on every call.
+    gmm = AkkarEtAlRjb2014()
+    coeffs = pd.read_csv(StringIO(gmm.COEFFS), sep=r'\s+').set_index('IMT')
+
+    mag, rjb = ruptureDataframe['Magnitude'].astype(float), ruptureDataframe['Closest Distance']
+    median_pga = np.exp(_compute_mean(gmm.kind, coeffs.loc["pga"], gmm.c1, mag, rjb, rake))
+    C = coeffs.loc[imts]
+    mean = (_compute_mean(gmm.kind, C, gmm.c1, mag, rjb, rake) +
+            _compute_non_linear_term(C, median_pga, soilConditionVs30) + gmm.adjustment_factor)
+
+    ruptureDataframe["IM median"] = np.exp(mean)
+    ruptureDataframe["Between-event (tau) Residual"] = [C['tau']] * len(mean)
+    ruptureDataframe["Within-event (phi) Residual"] = [C['sigma']] * len(mean)
+    ruptureDataframe["Total Residual"] = [np.sqrt(C['sigma'] ** 2 + C['tau'] ** 2)] * len(mean)
+
+def referenceHazardCurve(ruptureDataframe, mfd, imThresholds):
+    # Double loop over thresholds and ruptures with scipy's normal CDF.
+    median = ruptureDataframe['IM median'].values
+    totalSigma = ruptureDataframe['Total Residual'].values
+    magnitudePMFs = ruptureDataframe["P(M=m)"].values
+    distancePMFs = ruptureDataframe["P(R=r|m)"].values
+
+    rateExceedance = []
+    for imThreshold in np.round(imThresholds, 4):
+        rate = 0
+        for index in range(len(median)):
+            probExceedance = 1 - norm.cdf(np.log(imThreshold), np.log(median[index]), totalSigma[index])
+            rate = rate + probExceedance * magnitudePMFs[index] * distancePMFs[index] * mfd.sourceRate
+        rateExceedance.append(rate)
+
+    return np.array(rateExceedance)
@@ -0,0 +1,234 @@
+### PSHA Benchmarks ###
+
+"""
+Offline benchmark suite of the PSHA pipeline stages.
+
+    Each stage is timed on a fixed fault scenario while one parameter at a time is swept from a base
+    case: mesh spacing, magnitude bin width, number of IM thresholds and number of sites. With
+    --reference, the pre-vectorization implementations of benchmarks/referenceImplementations.py are
+    timed on the same inputs. Results can be written to JSON and compared against an earlier run:
+
+        python -m benchmarks.runBenchmarks --output benchmarks/baseline.json
+        python -m benchmarks.runBenchmarks --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+import numpy as np
+from ruptureUtils.magnitudeFreqDist import *
+from ruptureUtils.earthquakeSourceCharacteristics import *
+from ruptureUtils.magnitudeAreaScalingRelation import *
+from ruptureUtils.sourceModeling import *
+from gmmFile.gmmMain import *
+from visualizations.hazardCurve import *
+from siteUtils.siteCollection import *
+from benchmarks.referenceImplementations import *
+
+# Fault scenario of main.py.
+SCENARIO = dict(coordinates=[[28.0, 40.8], [29.5, 40.7]], seismicDepth=[0, 20], minMag=5.0, maxMag=8.0, aGR=4.0,
+                bGR=1.0, dip=90, rake=180, siteCoordinate=[29.2, 41.0], soilConditionVs30=300, imts='pga',
+                GMM='ASB14')
+
+BASE_CASE = dict(meshSpace=5.0, magnitudeBin=0.1, thresholdCount=100, siteCount=1)
+SWEEPS = dict(meshSpace=[10.0, 5.0, 2.0, 1.0], magnitudeBin=[0.25, 0.1, 0.05, 0.01],
+              thresholdCount=[20, 100, 500], siteCount=[1, 100, 1000])
+QUICK_SWEEPS = dict(meshSpace=[10.0, 5.0], magnitudeBin=[0.25, 0.1], thresholdCount=[20, 100], siteCount=[1, 100])
+
+def sweepCases(sweeps):
+    """
+    Base case followed by the cases varying one parameter of it, without duplicates.
+    """
+    cases = [dict(BASE_CASE)]
+    for name, values in sweeps.items():
+        for value in values:
+            case = dict(BASE_CASE, **{name: value})
+            if case not in cases:
+                cases.append(case)
+
+    return cases
+
+def timeCall(function, repeat):
+    # Best wall time of repeated calls, in seconds, and the result of the last call.
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+def runCase(case, repeat=5, reference=False, referenceLimit=200_000):
+    """
+    Time every stage for one case.
+    :param reference: Also time the reference implementations (single-site cases only).
+    :param referenceLimit: Largest (ruptures x thresholds) size for which the reference hazard loop runs.
+    :return: List of result records.
+    """
+    s = SCENARIO
+    imThresholds = np.logspace(-2, 0.5, case["thresholdCount"])
+    if case["siteCount"] == 1:
+        sites = siteCollection([s["siteCoordinate"]], s["soilConditionVs30"])
+    else:
+        # Square grid of about siteCount sites around the fault.
+        gridSpace = 2.0 / np.sqrt(case["siteCount"])
+        sites = siteCollection.fromGrid([28.0, 30.0 - gridSpace / 2], [40.0, 42.0 - gridSpace / 2], gridSpace,
+                                        s["soilConditionVs30"])
+
+    eqSource = earthquakeSources(s["coordinates"], s["seismicDepth"], s["dip"], s["rake"])
+    eqSource.sourceCharacteristics()
+    mfd = DoublyBoundedGRModel(s["minMag"], s["maxMag"], s["aGR"], s["bGR"], case["magnitudeBin"])
+    magnScaling = magnitudeScaling(eqSource.faultingMechanism, eqSource.faultLength, eqSource.faultWidth,
+                                   eqSource.seismicDepth[0])
+    eqSourceModeling = earthquakeSourcesModeling(eqSource, mfd, magnScaling, case["meshSpace"])
+
+    timings = {}
+    timings["mfd"], _ = timeCall(mfd.db_gr_mfd_model, repeat)
+    timings["scaling"], _ = timeCall(lambda: magnScaling.magnScalingLeonard2014(mfd, eqSource), repeat)
+    timings["ruptureProps"], _ = timeCall(eqSourceModeling.ruptureProps, repeat)
+    ruptures = eqSourceModeling.ruptureSet
+
+    if len(sites) == 1:
+        timings["closestDistance"], _ = timeCall(lambda: eqSourceModeling.calculateClosestDistance(s["siteCoordinate"]),
+                                                 repeat)
+        timings["getGMIM"], _ = timeCall(
+            lambda: gmmCalculations(eqSourceModeling, s["rake"], s["soilConditionVs30"], s["imts"]).getGMIM(s["GMM"]),
+            repeat)
+        timings["hazardCurve"], _ = timeCall(lambda: hazardCurveCalculator(ruptures, mfd, imThresholds), repeat)
+    else:
+        timings["closestDistance"], distanceMatrix = timeCall(
+            lambda: eqSourceModeling.closestDistanceMatrix(sites.siteCoordinates), repeat)
+        timings["getGMIM"], (median, tau, phi, sig) = timeCall(
+            lambda: gmmCalculations(eqSourceModeling, s["rake"], sites.soilConditionVs30,
+                                    s["imts"]).getGMIMMatrix(s["GMM"], distanceMatrix), repeat)
+        ruptureRates = ruptures.ruptureRates(mfd.sourceRate)
+        timings["hazardCurve"], _ = timeCall(lambda: hazardIntegral(median, sig, ruptureRates, imThresholds), repeat)
+
+    records = [dict(case=case, stage=stage, implementation="current", seconds=seconds, ruptures=len(ruptures),
+                    sites=len(sites)) for stage, seconds in timings.items()]
+
+    if reference and len(sites) == 1:
+        referenceTimings = {}
+        referenceTimings["ruptureProps"], ruptureDataframe = timeCall(lambda: referenceRuptureProps(eqSourceModeling),
+                                                                      1)
+        referenceTimings["closestDistance"], _ = timeCall(
+            lambda: referenceClosestDistance(ruptureDataframe, s["siteCoordinate"]), 1)
+        referenceTimings["getGMIM"], _ = timeCall(
+            lambda: referenceGetGMIM(ruptureDataframe, s["rake"], s["soilConditionVs30"], s["imts"]), 1)
+        if len(ruptureDataframe) * len(imThresholds) <= referenceLimit:
+            referenceTimings["hazardCurve"], _ = timeCall(
+                lambda: referenceHazardCurve(ruptureDataframe, mfd, imThresholds), 1)
+
+        records += [dict(case=case, stage=stage, implementation="reference", seconds=seconds,
+                         ruptures=len(ruptureDataframe), sites=1) for stage, seconds in referenceTimings.items()]
+
+    return records
+
+def runSuite(sweeps=SWEEPS, repeat=5, reference=False, referenceLimit=200_000):
+    """
+    Run every case of the sweeps.
+    :return: Dictionary with the run metadata and the result records.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    results = []
+    for case in sweepCases(sweeps):
+        results += runCase(case, repeat, reference, referenceLimit)
+        print("Finished " + ", ".join(f"{name}={value}" for name, value in case.items()), file=sys.stderr)
+
+    return {
+        "metadata": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": commit,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+def _recordKey(record):
+    return (json.dumps(record["case"], sort_keys=True), record["stage"], record["implementation"])
+
+def compareResults(run, baseline, tolerance=1.2, minSeconds=1e-3):
+    """
+    Match the records of a run with those of a baseline run.
+    :param tolerance: Time ratio above which a record is reported as a regression.
+    :param minSeconds: Timings below this are too noisy to be reported as regressions.
+    :return: List of (record, baseline seconds, ratio) and the list of regressed records.
+    """
+    baselineSeconds = {_recordKey(record): record["seconds"] for record in baseline["results"]}
+
+    rows, regressions = [], []
+    for record in run["results"]:
+        if _recordKey(record) not in baselineSeconds:
+            continue
+        previous = baselineSeconds[_recordKey(record)]
+        ratio = record["seconds"] / previous if previous > 0 else np.inf
+        rows.append((record, previous, ratio))
+        if ratio > tolerance and record["seconds"] >= minSeconds:
+            regressions.append(record)
+
+    return rows, regressions
+
+def formatCase(case):
+    return "mesh={meshSpace:g} mBin={magnitudeBin:g} thr={thresholdCount} sites={siteCount}".format(**case)
+
+def printResults(run):
+    # Current timings, with the speedup over the reference implementation where it was timed.
+    referenceSeconds = {(json.dumps(r["case"], sort_keys=True), r["stage"]): r["seconds"]
+                        for r in run["results"] if r["implementation"] == "reference"}
+
+    print(f"{'case':<42}{'stage':<17}{'ruptures':>9}{'seconds':>12}{'speedup':>10}")
+    for record in run["results"]:
+        if record["implementation"] != "current":
+            continue
+        reference = referenceSeconds.get((json.dumps(record["case"], sort_keys=True), record["stage"]))
+        speedup = f"{reference / record['seconds']:.1f}x" if reference else ""
+        print(f"{formatCase(record['case']):<42}{record['stage']:<17}{record['ruptures']:>9}"
+              f"{record['seconds']:>12.6f}{speedup:>10}")
+
+def printComparison(rows, regressions):
+    print(f"{'case':<42}{'stage':<17}{'impl':<10}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for record, previous, ratio in rows:
+        flag = "  slower" if record in regressions else ""
+        print(f"{formatCase(record['case']):<42}{record['stage']:<17}{record['implementation']:<10}"
+              f"{previous:>12.6f}{record['seconds']:>12.6f}{ratio:>8.2f}{flag}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the PSHA pipeline stages over parameter sweeps.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare the results with this JSON file of an earlier run.")
+    parser.add_argument("--repeat", type=int, default=5, help="Calls per stage; the best time is kept.")
+    parser.add_argument("--quick", action="store_true", help="Run the short sweeps.")
+    parser.add_argument("--reference", action="store_true", help="Also time the reference implementations.")
+    parser.add_argument("--tolerance", type=float, default=1.2,
+                        help="Time ratio to the baseline above which a stage is reported as slower.")
+    parser.add_argument("--min-seconds", type=float, default=1e-3,
+                        help="Stages faster than this are not reported as slower.")
+    args = parser.parse_args()
+
+    run = runSuite(QUICK_SWEEPS if args.quick else SWEEPS, args.repeat, args.reference)
+    printResults(run)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(run, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        rows, regressions = compareResults(run, baseline, args.tolerance, args.min_seconds)
+        print()
+        printComparison(rows, regressions)
+        if regressions:
+            sys.exit(f"{len(regressions)} stage timings are more than {args.tolerance:g}x slower than the baseline.")
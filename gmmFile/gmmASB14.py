@@ -1,6 +1,33 @@
 import numpy as np
-import pandas as pd
-from io import StringIO
+
+def _imt_key(imt):
+    """
+    Return the coefficient table key of an IMT: 'pga', 'pgv' or the spectral
+    period in seconds, given as 'SA(0.2)', '0.200' or 0.2.
+    """
+    if isinstance(imt, str):
+        imt = imt.strip().lower()
+        if imt in ('pga', 'pgv'):
+            return imt
+        if imt.startswith('sa(') and imt.endswith(')'):
+            imt = imt[3:-1]
+        try:
+            imt = float(imt)
+        except ValueError:
+            raise Exception(imt + " is not a valid IMT.")
+    return round(float(imt), 3)
+
+def _compile_coeffs_table(coeffs):
+    """
+    Parse the coefficient table string once into a float array with
+    row indices keyed by IMT and column indices keyed by coefficient name.
+    """
+    rows = [line.split() for line in coeffs.strip().splitlines()]
+    names = {name: j for j, name in enumerate(rows[0][1:])}
+    imts = {_imt_key(row[0]): i for i, row in enumerate(rows[1:])}
+    table = np.array([[float(value) for value in row[1:]] for row in rows[1:]])
+
+    return imts, names, table
 
 def _compute_faulting_style_term(C, rake):
     """
@@ -43,22 +70,26 @@ def _compute_mean(kind, C, c1, mag, rjb, rake):
 def _compute_non_linear_term(C, pga_only, vs30):
     """
     Compute non-linear term, equation (3a) to (3c), page 20.
+
+    vs30 may be a scalar or an array broadcasting against pga_only; the
+    equations are selected element-wise.
     """
     Vref = 750.0
     Vcon = 1000.0
-    lnS = np.zeros_like(vs30)
+    vs30 = np.asarray(vs30, dtype=float)
 
     # equation (3a)
-    if vs30 < Vref:
-        lnS = (C['b1'] * np.log(vs30 / Vref) + C['b2'] * np.log(
-            (pga_only + C['c'] * (vs30 / Vref) ** C['n']) /
-            ((pga_only + C['c']) * (vs30 / Vref) ** C['n'])))
+    lnS_a = (C['b1'] * np.log(vs30 / Vref) + C['b2'] * np.log(
+        (pga_only + C['c'] * (vs30 / Vref) ** C['n']) /
+        ((pga_only + C['c']) * (vs30 / Vref) ** C['n'])))
     # equation (3b)
-    elif (vs30 >= Vref) & (vs30 <= Vcon):
-        lnS = C['b1'] * np.log(vs30 / Vref)
+    lnS_b = C['b1'] * np.log(vs30 / Vref)
     # equation (3c)
-    elif vs30 > Vcon:
-        lnS = C['b1'] * np.log(Vcon / Vref)
+    lnS_c = C['b1'] * np.log(Vcon / Vref)
+
+    lnS = np.where(vs30 < Vref, lnS_a, np.where(vs30 <= Vcon, lnS_b, lnS_c))
+    if lnS.ndim == 0:
+        lnS = lnS[()]
 
     return lnS
 
@@ -162,39 +193,76 @@ class AkkarEtAlRjb2014():
         pgv         5.61201      0.0029      -0.09980      -0.98388      0.2529      7.5      -0.5096      -0.0616      0.0630      6.75      1000      750      2.5      3.2      -0.72057      -0.19688      0.6014      0.3311
         """
 
+    #: Coefficient table compiled once at import, see :func:`_compile_coeffs_table`.
+    COEFFS_IMTS, COEFFS_NAMES, COEFFS_TABLE = _compile_coeffs_table(COEFFS)
 
     def __init__(self, adjustment_factor=1.0):
         [self.kind] = self.REQUIRES_DISTANCES
         self.adjustment_factor = np.log(adjustment_factor)
 
-    def compute(self, mag, rjb, rake, vs30, imts):
+    @classmethod
+    def supported_imts(cls):
+        """
+        Return the keys of every IMT in the coefficient table.
+        """
+        return list(cls.COEFFS_IMTS)
+
+    def get_coeffs(self, imts, ndim=0):
+        """
+        Return the coefficients of one IMT as scalars, or of a list of IMTs as
+        arrays of shape (nIMTs, 1, ...) broadcasting against ndim-dimensional inputs.
+        """
+        if isinstance(imts, (list, tuple, np.ndarray)):
+            rows = [self.COEFFS_IMTS[_imt_key(imt)] for imt in imts]
+            values = self.COEFFS_TABLE[rows].reshape((len(rows),) + (1,) * ndim + (-1,))
+        else:
+            values = self.COEFFS_TABLE[self.COEFFS_IMTS[_imt_key(imts)]]
+
+        return {name: values[..., j] for name, j in self.COEFFS_NAMES.items()}
+
+    def compute_rock_pga(self, mag, rjb, rake):
+        """
+        Return median PGA on rock for a rupture/site context. It does not
+        depend on the IMT or Vs30, so it can be passed to :meth:`compute` of
+        Vs30 sweeps on the same context.
+        """
+        C_pga = self.get_coeffs("pga")
+
+        return np.exp(_compute_mean(self.kind, C_pga, self.c1, mag, rjb, rake))
+
+    def compute(self, mag, rjb, rake, vs30, imts, rock_pga=None):
         """
         See :meth:`superclass method
         <.base.GroundShakingIntensityModel.compute>`
         for spec of input and result values.
 
         Implement equation 1, page 20.
+
+        imts is a single IMT, or a list of IMTs evaluated in one pass; for a
+        list, mean has shape (nIMTs, ...) and tau, phi and sig have shape (nIMTs,).
+        vs30 is a scalar or an array broadcasting against mag and rjb.
+        rock_pga is the result of :meth:`compute_rock_pga` for the same mag,
+        rjb and rake; it is computed once per call if not given.
         """
+        mag = np.asarray(mag, dtype=float)
+        rjb = np.asarray(rjb, dtype=float)
+        ndim = np.broadcast(mag, rjb).ndim
+
         # compute median PGA on rock, needed to compute non-linear site
         # amplification
-
-        # Use StringIO to read the string as a CSV
-        df_coeffs = pd.read_csv(StringIO(self.COEFFS), delim_whitespace=True)
-        df_coeffs.set_index('IMT', inplace=True)
-
-        C_pga = df_coeffs.loc["pga"]
-        median_pga = np.exp(_compute_mean(self.kind, C_pga, self.c1, mag, rjb, rake))
+        if rock_pga is None:
+            rock_pga = self.compute_rock_pga(mag, rjb, rake)
 
         # compute mean value by adding nonlinear site amplification terms
-        C = df_coeffs.loc[imts]
-        mean = _compute_mean(self.kind, C, self.c1, mag, rjb, rake) + _compute_non_linear_term(C, median_pga, vs30)
+        C = self.get_coeffs(imts, ndim)
+        mean = _compute_mean(self.kind, C, self.c1, mag, rjb, rake) + _compute_non_linear_term(C, rock_pga, vs30)
 
         mean += self.adjustment_factor
         sig = np.sqrt(C['sigma'] ** 2 + C['tau'] ** 2)
         tau = C['tau']
         phi = C['sigma']
 
-        return mean, tau, phi, sig
-
-
+        if np.ndim(tau) > 0:
+            sig, tau, phi = sig.ravel(), tau.ravel(), phi.ravel()
 
+        return mean, tau, phi, sig
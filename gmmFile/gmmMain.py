@@ -8,18 +8,65 @@ class gmmCalculations():
         self.soilConditionVs30 = soilConditionVs30
         self.imts = imts
 
-    def getGMIM(self, GMM):
+    def getModel(self, GMM):
         if GMM == 'ASB14':
             gmm = AkkarEtAlRjb2014()
         else:
             raise Exception(GMM + " is not a valid.")
 
-        mean, tau, phi, sig = gmm.compute(self.eqSourceModeling.ruptureDataframe['Magnitude'],
-                                          self.eqSourceModeling.ruptureDataframe['Closest Distance'],
+        return gmm
+
+    def getGMIM(self, GMM):
+        gmm = self.getModel(GMM)
+
+        ruptures = self.eqSourceModeling.ruptureSet
+        mean, tau, phi, sig = gmm.compute(ruptures.magnitude, ruptures.closestDistance,
                                           self.rake, self.soilConditionVs30, self.imts)
 
-        self.eqSourceModeling.ruptureDataframe["IM median"] = np.exp(mean)
-        self.eqSourceModeling.ruptureDataframe["Between-event (tau) Residual"] = [tau] * len(mean)
-        self.eqSourceModeling.ruptureDataframe["Within-event (phi) Residual"] = [phi] * len(mean)
-        self.eqSourceModeling.ruptureDataframe["Total Residual"] = [sig] * len(mean)
+        ruptures.imMedian = np.exp(mean)
+        ruptures.tau = tau
+        ruptures.phi = phi
+        ruptures.totalSigma = sig
+
+    def getGMIMMatrix(self, GMM, distanceMatrix, soilConditionVs30=None, ruptureIndex=slice(None)):
+        """
+        Evaluate the GMM for every site and rupture pair.
+        :param GMM: Ground motion model name.
+        :param distanceMatrix: Closest distances in km, shape (nSites, nRuptures).
+        :param soilConditionVs30: Vs30 of the sites, scalar or shape (nSites,). Defaults to the
+        Vs30 given at construction.
+        :param ruptureIndex: Index of the ruptures of the distance matrix columns, all by default.
+        :return: IM medians of shape (nSites, nRuptures), tau, phi and total sigma.
+        """
+        gmm = self.getModel(GMM)
+
+        if soilConditionVs30 is None:
+            soilConditionVs30 = self.soilConditionVs30
+        soilConditionVs30 = np.asarray(soilConditionVs30, dtype=float)
+        if soilConditionVs30.ndim == 1:
+            soilConditionVs30 = soilConditionVs30[:, None]
+
+        magnitudes = self.eqSourceModeling.ruptureSet.magnitude[ruptureIndex]
+        mean, tau, phi, sig = gmm.compute(magnitudes[None, :], distanceMatrix, self.rake,
+                                          soilConditionVs30, self.imts)
+
+        return np.exp(mean), tau, phi, sig
+
+def magnitudeExceedance(GMM, imThresholds, distances, rake, soilConditionVs30, imts):
+    """
+    P(IM > im | m) at reference distances, the error measure of DoublyBoundedGRModel.adaptive.
+    :param distances: Reference distances in km; the error is controlled at each of them.
+    :return: Callable of magnitudes, shape (n,), returning shape (n, nDistances * nThresholds).
+    """
+    from scipy.special import ndtr
+
+    gmm = gmmCalculations(None, rake, soilConditionVs30, imts).getModel(GMM)
+    distances = np.asarray(distances, dtype=float)
+    lnThresholds = np.log(np.asarray(imThresholds, dtype=float))
+
+    def exceedance(magnitude):
+        magnitude = np.asarray(magnitude, dtype=float)
+        mean, tau, phi, sig = gmm.compute(magnitude[:, None], distances[None, :], rake, soilConditionVs30, imts)
+        return ndtr((mean[..., None] - lnThresholds) / sig).reshape(len(magnitude), -1)
 
+    return exceedance
@@ -32,11 +32,11 @@ from visualizations.hazardCurve import *
 # INPUTS
 #      Source characteristics
 coordinates = [[28.0, 40.8], [29.5, 40.7]]
-seismicDepth = [0, 20]  # latitude, longitude
+seismicDepth = [0, 20]  # km
 minMag, maxMag, aGR, bGR = 5, 8, 4, 1
 dip, strike, rake = 90, [0, 60, 120, 180, 240, 300], 180
 #      Site characteristics
-site_coordinate = [29.2, 41.0]  # latitude, longitude
+site_coordinate = [29.2, 41.0]  # longitude, latitude
 soilConditionVs30 = 300  # m/s
 #      Rupture mesh spacing distance
 meshSpace = 5    # km
@@ -73,7 +73,8 @@ gmmCalc = gmmCalculations(eqSourceModeling, rake, soilConditionVs30, imts)
 gmmCalc.getGMIM(GMM)
 
 # Hazard Curve
-fig = hazardCurveCalculator(eqSourceModeling.ruptureDataframe, mfd, IMthresholds, imts)
+rateExceedance = hazardCurveCalculator(eqSourceModeling.ruptureSet, mfd, IMthresholds)
+fig = plotHazardCurve(IMthresholds, rateExceedance, imts)
 fig.show()
 
-print("Stop here.")
\ No newline at end of file
+print("Stop here.")
@@ -1,26 +1,43 @@
 import numpy as np
 import math
 
+# Source types modeled as ruptures centred on grid nodes, see griddedSourcesModeling.
+GRIDDED_SOURCE_TYPES = ["Point", "Area"]
+# Strikes (degrees) of gridded sources without given strikes. A rupture centred on its node has the
+# same surface projection at strikes 180 degrees apart, so these cover every direction.
+DEFAULT_STRIKES = [0.0, 30.0, 60.0, 90.0, 120.0, 150.0]
+
 class earthquakeSources():
 
-    def __init__(self, coordinates, seismicDepth, dip, rake):
+    def __init__(self, coordinates, seismicDepth, dip, rake, strikes=None):
+        """
+        :param coordinates: One point for a point source, the fault trace for a fault, or a closed polygon
+        (first point repeated at the end) for an area source.
+        :param strikes: Strikes (degrees) of the ruptures of a point or area source, equally likely.
+        """
         self.coordinates = coordinates
         self.dip = dip
         self.strike = None
+        self.strikes = strikes
         self.rake = rake
         self.seismicDepth = seismicDepth
         self.sourceType = None
         self.segmentLengths = None
+        # Distances (km) along the fault trace from its first point to each of its points, and the strike
+        # of each trace segment; strike is the strike of the first segment.
+        self.cumulativeLengths = None
+        self.segmentStrikes = None
         self.faultLength = None
         self.faultWidth = None
         self.faultingMechanism = None
 
     def haversineDistance(self, coord1, coord2):
+        # Great-circle distance in km between two points (longitude, latitude).
         # Radius of the Earth in kilometers
         R = 6371.0
 
-        lat1, lon1 = np.radians(coord1)
-        lat2, lon2 = np.radians(coord2)
+        lon1, lat1 = np.radians(coord1)
+        lon2, lat2 = np.radians(coord2)
 
         dlat = lat2 - lat1
         dlon = lon2 - lon1
@@ -41,6 +58,7 @@ class earthquakeSources():
             total_length += segment_length
 
         self.segmentLengths = lengths
+        self.cumulativeLengths = np.concatenate([[0.0], np.cumsum(lengths)])
         self.faultLength = total_length
         self.faultWidth = (self.seismicDepth[1] - self.seismicDepth[0]) / np.sin(np.pi * self.dip / 180)
 
@@ -49,6 +67,8 @@ class earthquakeSources():
                 isinstance(coord, list) and len(coord) == 2 for coord in self.coordinates):
             if len(self.coordinates) == 1:
                 self.sourceType = "Point"
+            elif len(self.coordinates) >= 4 and self.coordinates[0] == self.coordinates[-1]:
+                self.sourceType = "Area"
             else:
                 self.sourceType = "Fault"
         else:
@@ -60,6 +80,11 @@ class earthquakeSources():
             self.getFaultDimensions()
             self.strike = None
             self.getStrikeAngle()
+        elif self.sourceType in GRIDDED_SOURCE_TYPES:
+            # Ruptures of gridded sources are centred on their nodes and not limited by a fault length.
+            self.faultLength = np.inf
+            self.faultWidth = (self.seismicDepth[1] - self.seismicDepth[0]) / np.sin(np.pi * self.dip / 180)
+            self.strikes = DEFAULT_STRIKES if self.strikes is None else [float(strike) for strike in self.strikes]
 
         if self.rake < 0:
             self.rake =+ 360
@@ -79,8 +104,8 @@ class earthquakeSources():
             :param p2: Tuple of the second point (longitude, latitude).
             :return: Azimuth in degrees.
             """
-            lat1, lon1 = p1
-            lat2, lon2 = p2
+            lon1, lat1 = p1
+            lon2, lat2 = p2
 
             # Convert from degrees to radians
             lon1, lat1, lon2, lat2 = map(math.radians, [lon1, lat1, lon2, lat2])
@@ -101,6 +126,7 @@ class earthquakeSources():
             azimuth = calculate_azimuth(self.coordinates[i], self.coordinates[i + 1])
             azimuth_angles.append(round(azimuth, 3))
 
+        self.segmentStrikes = azimuth_angles
         self.strike = azimuth_angles[0]
 
 
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Part of every key; bump it when the scaling or meshing results change for the same inputs.
+GEOMETRY_VERSION = 3
+
+def geometryKey(*parts):
+    """
+    Content hash of the inputs of a geometry stage. Arrays are hashed by dtype, shape and bytes, other
+    parts by their JSON form.
+    """
+    digest = hashlib.sha256(str(GEOMETRY_VERSION).encode())
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            part = np.ascontiguousarray(part)
+            digest.update(f"{part.dtype.str}{part.shape}".encode())
+            digest.update(part.tobytes())
+        else:
+            digest.update(json.dumps(part, sort_keys=True, default=float).encode())
+        digest.update(b"|")
+
+    return digest.hexdigest()
+
+def sourceKeyParts(eqSource):
+    # Inputs of an earthquakeSources object the rupture geometry depends on.
+    return [np.asarray(eqSource.coordinates, dtype=float), np.asarray(eqSource.seismicDepth, dtype=float),
+            float(eqSource.dip), float(eqSource.rake)]
+
+class geometryCache():
+
+    def __init__(self, maxEntries=32, cacheDir=None, maxDiskEntries=256):
+        """
+        LRU cache of rupture geometry arrays, keyed by content hash.
+        :param maxEntries: Largest number of entries kept in memory.
+        :param cacheDir: Directory of the .npz copies of the entries; no disk copies if None.
+        :param maxDiskEntries: Largest number of files kept in cacheDir, the least recently used are removed.
+        """
+        self.maxEntries = maxEntries
+        self.cacheDir = cacheDir
+        self.maxDiskEntries = maxDiskEntries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _path(self, key):
+        return os.path.join(self.cacheDir, key + ".npz")
+
+    def get(self, key):
+        """
+        :return: Dictionary of read-only arrays, or None on a miss.
+        """
+        with self._lock:
+            arrays = self.entries.get(key)
+            if arrays is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        if arrays is not None:
+            self._touch(key)
+            return arrays
+
+        if self.cacheDir is not None and os.path.exists(self._path(key)):
+            try:
+                with np.load(self._path(key), allow_pickle=False) as file:
+                    arrays = {name: file[name] for name in file.files}
+            except (OSError, ValueError):
+                arrays = None
+            if arrays is not None:
+                self._touch(key)
+                self.hits += 1
+                return self._store(key, arrays)
+
+        self.misses += 1
+        return None
+
+    def put(self, key, arrays):
+        """
+        Store the arrays of a key; they are copied and made read-only, since entries are shared.
+        :return: The stored arrays.
+        """
+        arrays = self._store(key, {name: np.array(value) for name, value in arrays.items()})
+
+        if self.cacheDir is not None:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            # Written under a temporary name, so that concurrent readers never see a partial file.
+            temporaryPath = self._path(key) + f".{os.getpid()}.{threading.get_ident()}.tmp.npz"
+            np.savez(temporaryPath, **arrays)
+            os.replace(temporaryPath, self._path(key))
+            self._pruneDisk()
+
+        return arrays
+
+    def _touch(self, key):
+        # The modification time of the disk copy orders the disk entries by last use.
+        if self.cacheDir is not None:
+            try:
+                os.utime(self._path(key))
+            except OSError:
+                pass
+
+    def _store(self, key, arrays):
+        for value in arrays.values():
+            value.setflags(write=False)
+        with self._lock:
+            self.entries[key] = arrays
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+
+        return arrays
+
+    def _pruneDisk(self):
+        files = [os.path.join(self.cacheDir, name) for name in os.listdir(self.cacheDir) if name.endswith(".npz")
+                 and not name.endswith(".tmp.npz")]
+        if len(files) <= self.maxDiskEntries:
+            return
+        files.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+        for path in files[:len(files) - self.maxDiskEntries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        # Empty the memory entries; disk copies are kept.
+        with self._lock:
+            self.entries.clear()
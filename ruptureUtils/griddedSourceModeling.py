@@ -0,0 +1,268 @@
+import numpy as np
+from ruptureUtils.ruptureSet import ruptureSet
+from ruptureUtils.integrationDistance import integrationDistance, KM_PER_DEGREE
+
+# Epicentral and Joyner-Boore distances (km) of the distance tables. Nodes farther than the last distance
+# from a site are left out of its hazard, so it should exceed the integration distance plus half of the
+# longest rupture.
+DISTANCE_TABLE_GRID = np.concatenate([[0.0], np.geomspace(1.0, 500.0, 61)])
+
+def pointInPolygon(points, polygon):
+    """
+    Even-odd test of points against a polygon, in the plane of the coordinates.
+    :param points: Array of points (longitude, latitude), shape (nPoints, 2).
+    :param polygon: Array of polygon vertices, shape (nVertices, 2), closed or not.
+    :return: Mask of the points inside the polygon, shape (nPoints,).
+    """
+    x, y = points[:, 0, None], points[:, 1, None]
+    x1, y1 = polygon[:, 0], polygon[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+
+    # Count the polygon edges crossed by a ray from each point towards +x.
+    crosses = (y1 > y) != (y2 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xCross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+
+    return (crosses & (x < xCross)).sum(axis=1) % 2 == 1
+
+def areaSourceGrid(polygon, meshSpace):
+    """
+    Nodes of a regular grid inside a polygon, the centres of cells about meshSpace km wide.
+    :param polygon: Array of polygon vertices (longitude, latitude), shape (nVertices, 2).
+    :param meshSpace: Grid spacing in km.
+    :return: Node coordinates, shape (nNodes, 2), and the share of the source rate of each node,
+    proportional to the area of its cell, shape (nNodes,).
+    """
+    polygon = np.asarray(polygon, dtype=float)
+    yStep = meshSpace / KM_PER_DEGREE
+    xStep = yStep / np.cos(np.radians(polygon[:, 1].mean()))
+    xValues = np.arange(polygon[:, 0].min() + xStep / 2, polygon[:, 0].max(), xStep)
+    yValues = np.arange(polygon[:, 1].min() + yStep / 2, polygon[:, 1].max(), yStep)
+    xGrid, yGrid = np.meshgrid(xValues, yValues)
+
+    nodes = np.column_stack([xGrid.ravel(), yGrid.ravel()])
+    nodes = nodes[pointInPolygon(nodes, polygon)]
+    if len(nodes) == 0:
+        raise Exception(str(polygon.tolist()) + " is not a valid area source; it holds no node at a " +
+                        str(meshSpace) + " km spacing.")
+    weights = np.cos(np.radians(nodes[:, 1]))
+
+    return nodes, weights / weights.sum()
+
+def epicentralDistances(siteCoordinates, nodeCoordinates):
+    """
+    Great-circle distance and azimuth from each node to each site.
+    :param siteCoordinates: Array of sites (longitude, latitude), shape (nSites, 2).
+    :param nodeCoordinates: Array of nodes (longitude, latitude), shape (nNodes, 2).
+    :return: Distances in km and azimuths in degrees clockwise from north, each shape (nSites, nNodes).
+    """
+    # Earth radius in kilometers (mean radius)
+    R = 6371.0
+
+    site = np.radians(np.atleast_2d(siteCoordinates))[:, None, :]
+    node = np.radians(np.atleast_2d(nodeCoordinates))[None, :, :]
+    siteLat, nodeLat = site[..., 1], node[..., 1]
+    deltaLon = site[..., 0] - node[..., 0]
+
+    a = np.sin((siteLat - nodeLat) / 2) ** 2 + np.cos(nodeLat) * np.cos(siteLat) * np.sin(deltaLon / 2) ** 2
+    distance = 2 * R * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    azimuth = np.degrees(np.arctan2(np.sin(deltaLon) * np.cos(siteLat), np.cos(nodeLat) * np.sin(siteLat) -
+                                    np.sin(nodeLat) * np.cos(siteLat) * np.cos(deltaLon)))
+
+    return distance, azimuth % 360
+
+def distanceGridWeights(distances, distanceGrid):
+    """
+    Share of each distance given to its neighbouring grid distances, by linear interpolation in distance
+    up to 1 km and in log-distance beyond, so that a sum over the grid is exact to second order.
+    :param distances: Distances in km, any shape.
+    :param distanceGrid: Increasing grid distances in km, from 0.
+    :return: Index of the lower grid distance, the share of the upper one, and the mask of the distances
+    within the grid, each of the shape of distances.
+    """
+    # Piecewise linear, then logarithmic, distance axis.
+    scale = lambda values: np.where(values <= 1, values, 1 + np.log(np.maximum(values, 1)))
+    gridScale = scale(np.asarray(distanceGrid, dtype=float))
+    distanceScale = scale(np.asarray(distances, dtype=float))
+
+    lower = np.clip(np.searchsorted(gridScale, distanceScale, side='right') - 1, 0, len(gridScale) - 2)
+    upperShare = np.clip((distanceScale - gridScale[lower]) / (gridScale[lower + 1] - gridScale[lower]), 0, 1)
+
+    return lower, upperShare, distanceScale <= gridScale[-1]
+
+def rjbDistanceTable(ruptureLength, ruptureWidth, dip, distanceGrid=DISTANCE_TABLE_GRID, azimuthBins=18, samples=8):
+    """
+    P(Rjb | m, Repi, azimuth) of ruptures centred on a node: the weight of each grid Joyner-Boore distance
+    for a site at each grid epicentral distance and in each azimuth bin. The azimuth is the angle between
+    the strike and the direction from the node to the site, folded to 0-90 degrees since the surface
+    projection of a centred rupture is symmetric about both of its axes; each bin is sampled by samples
+    azimuths. Joyner-Boore distances are shared between grid distances by distanceGridWeights.
+    :param ruptureLength: Rupture length of each magnitude in km, shape (nMagnitudes,).
+    :param ruptureWidth: Down-dip rupture width of each magnitude in km, shape (nMagnitudes,).
+    :param dip: Dip angle in degrees.
+    :param distanceGrid: Grid distances in km, shape (nDistances,).
+    :return: Probabilities, shape (nMagnitudes, nDistances, azimuthBins, nDistances).
+    """
+    distanceGrid = np.asarray(distanceGrid, dtype=float)
+    distanceCount = len(distanceGrid)
+    azimuth = np.radians((np.arange(azimuthBins)[:, None] + (np.arange(samples) + 0.5) / samples) * 90 / azimuthBins)
+    alongStrike = distanceGrid[:, None, None] * np.cos(azimuth)
+    strikeNormal = distanceGrid[:, None, None] * np.sin(azimuth)
+    # Offset of each (distance, azimuth) cell of the table for np.bincount.
+    cellOffset = (np.arange(distanceCount * azimuthBins) * distanceCount).reshape(distanceCount, azimuthBins, 1)
+
+    table = np.zeros((len(ruptureLength), distanceCount, azimuthBins, distanceCount), dtype=np.float32)
+    halfWidths = np.asarray(ruptureWidth, dtype=float) * np.cos(np.radians(dip)) / 2
+    for index, (length, halfWidth) in enumerate(zip(np.asarray(ruptureLength, dtype=float), halfWidths)):
+        rjb = np.hypot(np.maximum(alongStrike - length / 2, 0), np.maximum(strikeNormal - halfWidth, 0))
+        lower, upperShare, _ = distanceGridWeights(rjb, distanceGrid)
+        counts = (np.bincount((cellOffset + lower).ravel(), (1 - upperShare).ravel(),
+                              minlength=distanceCount ** 2 * azimuthBins) +
+                  np.bincount((cellOffset + lower + 1).ravel(), upperShare.ravel(),
+                              minlength=distanceCount ** 2 * azimuthBins))
+        table[index] = counts.reshape(distanceCount, azimuthBins, distanceCount) / samples
+
+    return table
+
+class griddedSourcesModeling():
+    """
+    Point and area sources as ruptures centred on grid nodes, at every strike of the source. Ruptures are
+    not enumerated per node: the rupture set holds one row per magnitude and grid Joyner-Boore distance,
+    and the P(R=r|m) of a site is read from a distance table, computed once per magnitude scaling and
+    shared by every node, site and source.
+    """
+
+    def __init__(self, eqSource, mfd, magnScaling, meshSpace, distanceGrid=DISTANCE_TABLE_GRID, azimuthBins=18):
+        """
+        :param meshSpace: Node spacing of an area source in km.
+        :param distanceGrid: Grid distances in km, see rjbDistanceTable.
+        :param azimuthBins: Number of azimuth bins from 0 to 90 degrees, see rjbDistanceTable.
+        """
+        self.eqSource = eqSource
+        self.mfd = mfd
+        self.magnScaling = magnScaling
+        self.meshSpace = meshSpace
+        self.distanceGrid = np.asarray(distanceGrid, dtype=float)
+        self.azimuthBins = azimuthBins
+        self.nodes = None
+        self.nodeWeights = None
+        self.distanceTable = None
+        self.ruptureSet = None
+        self._tableMatrix = None
+
+    @property
+    def ruptureDataframe(self):
+        # Display-only table; calculations use the columnar rupture set.
+        return self.ruptureSet.toDataframe()
+
+    def meshAreaSource(self):
+        """
+        Nodes of the source and the share of the source rate of each.
+        """
+        if self.eqSource.sourceType == "Point":
+            return np.asarray(self.eqSource.coordinates, dtype=float).reshape(1, 2), np.ones(1)
+        return areaSourceGrid(self.eqSource.coordinates, self.meshSpace)
+
+    def getDistanceTable(self):
+        return rjbDistanceTable(self.magnScaling.ruptureLength, self.magnScaling.ruptureWidth, self.eqSource.dip,
+                                self.distanceGrid, self.azimuthBins)
+
+    def ruptureProps(self, distanceTable=None):
+        """
+        Build the nodes and the rupture set.
+        :param distanceTable: Result of getDistanceTable, e.g. from a geometry cache; computed if None.
+        """
+        self.nodes, self.nodeWeights = self.meshAreaSource()
+        self.distanceTable = self.getDistanceTable() if distanceTable is None else distanceTable
+        magnitudeCount, distanceCount = len(self.mfd.magRange), len(self.distanceGrid)
+        # (epicentral distance, azimuth) x (magnitude, Joyner-Boore distance), the row order of the rupture set.
+        self._tableMatrix = np.moveaxis(self.distanceTable, 0, 2).reshape(distanceCount * self.azimuthBins, -1)
+
+        # One row per magnitude and grid distance. P(R=r|m) depends on the site, see siteRuptureDistances;
+        # ruptures have no single location, so their coordinates are NaN.
+        rowCount = magnitudeCount * distanceCount
+        self.ruptureSet = ruptureSet(
+            magnitude=np.repeat(self.mfd.magRange, distanceCount),
+            magnitudePMF=np.repeat(self.mfd.pmfMFD, distanceCount),
+            distancePMF=np.ones(rowCount),
+            startingCoordinates=np.full((rowCount, 2), np.nan),
+            endingCoordinates=np.full((rowCount, 2), np.nan),
+            magnitudeOffsets=np.arange(magnitudeCount + 1) * distanceCount,
+            ruptureWidth=np.repeat(self.magnScaling.ruptureWidth, distanceCount),
+            ruptureTopDepth=np.repeat(self.magnScaling.ruptureTopDepth, distanceCount),
+        )
+        self.ruptureSet.closestDistance = np.tile(self.distanceGrid, magnitudeCount)
+
+    def siteDistancePMF(self, siteCoordinates, maxChunkElements=2_000_000):
+        """
+        P(R=r|m) of every row of the rupture set at each site: the nodes and strikes are shared between
+        grid epicentral distances and binned by azimuth to the site, weighted by their share of the source
+        rate, and the histogram is multiplied by the distance table.
+        :param siteCoordinates: Array of sites (longitude, latitude), shape (nSites, 2).
+        :param maxChunkElements: Upper bound of the (sites x nodes x strikes) block held in memory.
+        :return: Probabilities, shape (nSites, nRows).
+        """
+        siteCoordinates = np.atleast_2d(np.asarray(siteCoordinates, dtype=float))
+        strikes = np.asarray(self.eqSource.strikes, dtype=float)
+        distanceCount = len(self.distanceGrid)
+        binCount = distanceCount * self.azimuthBins
+        weights = np.broadcast_to(self.nodeWeights[:, None] / len(strikes), (len(self.nodes), len(strikes)))
+
+        histogram = np.zeros((len(siteCoordinates), binCount))
+        sitesPerChunk = max(1, maxChunkElements // (len(self.nodes) * len(strikes)))
+        for start in range(0, len(siteCoordinates), sitesPerChunk):
+            stop = min(start + sitesPerChunk, len(siteCoordinates))
+            distance, azimuth = epicentralDistances(siteCoordinates[start:stop], self.nodes)
+            lower, upperShare, inGrid = distanceGridWeights(distance, self.distanceGrid)
+            relativeAzimuth = (azimuth[..., None] - strikes) % 180
+            azimuthBin = np.minimum(np.minimum(relativeAzimuth, 180 - relativeAzimuth) * self.azimuthBins // 90,
+                                    self.azimuthBins - 1).astype(int)
+
+            # Nodes beyond the last grid distance get no weight.
+            index = (((np.arange(stop - start)[:, None, None] * distanceCount + lower[..., None]) *
+                      self.azimuthBins + azimuthBin).ravel())
+            lowerWeights = weights * inGrid[..., None]
+            upperWeights = lowerWeights * upperShare[..., None]
+            lowerWeights = lowerWeights - upperWeights
+            cellCount = (stop - start) * binCount
+            histogram[start:stop] = (np.bincount(index, lowerWeights.ravel(), minlength=cellCount) +
+                                     np.bincount(index + self.azimuthBins, upperWeights.ravel(),
+                                                 minlength=cellCount)).reshape(-1, binCount)
+
+        return histogram @ self._tableMatrix
+
+    def siteRuptureDistances(self, siteCoordinates, maxDistance=None):
+        """
+        Rows of the rupture set reached from the sites, their distances and their P(R=r|m) at each site.
+        :param siteCoordinates: Array of sites (longitude, latitude), shape (nSites, 2).
+        :param maxDistance: Integration distance in km, or an integrationDistance. None keeps all rows.
+        :return: Indices of the kept rows, shape (nKept,), their Rjb, Rrup, Rx and P(R=r|m), each shape
+        (nSites, nKept), and the mask of the site/row pairs with a probability within the integration
+        distance. Rrup and Rx depend on the node and strike, so they are not tabulated and are NaN.
+        """
+        distancePMF = self.siteDistancePMF(siteCoordinates)
+        inRange = distancePMF > 0
+        if maxDistance is not None:
+            if not isinstance(maxDistance, integrationDistance):
+                maxDistance = integrationDistance(maxDistance)
+            inRange &= self.ruptureSet.closestDistance <= maxDistance(self.ruptureSet.magnitude)
+        ruptureIndex = np.flatnonzero(inRange.any(axis=0))
+
+        rjb = np.broadcast_to(self.ruptureSet.closestDistance[ruptureIndex], (len(distancePMF), len(ruptureIndex)))
+        undefined = np.full(rjb.shape, np.nan)
+
+        return ruptureIndex, (rjb, undefined, undefined, distancePMF[:, ruptureIndex]), inRange[:, ruptureIndex]
+
+    def siteRuptureSet(self, ruptureIndex, distances):
+        """
+        Rupture set of one site from its kept rows and distances, see siteRuptureDistances.
+        """
+        rjb, rrup, rx, distancePMF = distances
+        return self.ruptureSet.subset(ruptureIndex).replace(closestDistance=rjb, ruptureDistance=rrup,
+                                                            strikeNormalDistance=rx, distancePMF=distancePMF)
+
+    def siteRuptureRates(self, sourceRate, ruptureIndex, distances):
+        """
+        Annual rate of each kept row at each site, shape (nSites, nKept).
+        """
+        return self.ruptureSet.ruptureRates(sourceRate)[ruptureIndex] * distances[3]
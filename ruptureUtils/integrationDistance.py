@@ -0,0 +1,75 @@
+import numpy as np
+
+# Kilometres per degree of latitude on the mean-radius sphere.
+KM_PER_DEGREE = 6371.0 * np.pi / 180
+
+class integrationDistance():
+    """
+    Maximum Joyner-Boore distance (km) beyond which ruptures are left out of the hazard integral.
+    """
+
+    def __init__(self, maxDistance=300.0):
+        """
+        :param maxDistance: A distance for all magnitudes, or (magnitude, distance) pairs interpolated
+        linearly in magnitude and held constant outside them.
+        """
+        if np.ndim(maxDistance) == 0:
+            maxDistance = [(0.0, float(maxDistance))]
+        maxDistance = np.asarray(maxDistance, dtype=float).reshape(-1, 2)
+        if np.any(np.diff(maxDistance[:, 0]) <= 0):
+            raise Exception(str(maxDistance[:, 0].tolist()) + " is not a valid increasing magnitude list.")
+        self.magnitudes = maxDistance[:, 0]
+        self.distances = maxDistance[:, 1]
+
+    def __call__(self, magnitude):
+        return np.interp(magnitude, self.magnitudes, self.distances)
+
+    def __eq__(self, other):
+        return (isinstance(other, integrationDistance) and np.array_equal(self.magnitudes, other.magnitudes) and
+                np.array_equal(self.distances, other.distances))
+
+    def __hash__(self):
+        return hash((self.magnitudes.tobytes(), self.distances.tobytes()))
+
+class ruptureBoundingBoxIndex():
+    """
+    STR-tree over rupture bounding boxes, each enlarged by the integration distance of its magnitude,
+    so that the ruptures that may be within range of a site are found without computing distances.
+    """
+
+    def __init__(self, boundingBoxes, magnitude, maxDistance):
+        """
+        :param boundingBoxes: [x min, x max, y min, y max] of the surface projection of each rupture,
+        shape (nRuptures, 4), in degrees of longitude and latitude.
+        :param magnitude: Rupture magnitudes, shape (nRuptures,).
+        :param maxDistance: integrationDistance of the ruptures.
+        """
+        import shapely
+
+        boundingBoxes = np.asarray(boundingBoxes, dtype=float)
+        yMargin = maxDistance(magnitude) / KM_PER_DEGREE
+
+        # Degrees of longitude shrink towards the poles; use the latitude of the box farthest from the equator.
+        farthestLatitude = np.minimum(np.maximum(np.abs(boundingBoxes[:, 2]), np.abs(boundingBoxes[:, 3])) + yMargin,
+                                      89.9)
+        xMargin = np.minimum(yMargin / np.cos(np.radians(farthestLatitude)), 180.0)
+
+        self.tree = shapely.STRtree(shapely.box(boundingBoxes[:, 0] - xMargin, boundingBoxes[:, 2] - yMargin,
+                                                boundingBoxes[:, 1] + xMargin, boundingBoxes[:, 3] + yMargin))
+        self.ruptureCount = len(boundingBoxes)
+
+    def query(self, siteCoordinates):
+        """
+        Site/rupture pairs whose enlarged bounding box holds the site.
+        :param siteCoordinates: Array of sites (longitude, latitude), shape (nSites, 2).
+        :return: Boolean mask of candidate pairs, shape (nSites, nRuptures).
+        """
+        import shapely
+
+        siteCoordinates = np.atleast_2d(np.asarray(siteCoordinates, dtype=float))
+        siteIndex, ruptureIndex = self.tree.query(shapely.points(siteCoordinates), predicate='intersects')
+
+        candidates = np.zeros((len(siteCoordinates), self.ruptureCount), dtype=bool)
+        candidates[siteIndex, ruptureIndex] = True
+
+        return candidates
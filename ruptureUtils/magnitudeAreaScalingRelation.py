@@ -7,6 +7,8 @@ class magnitudeScaling():
         self.faultWidth = faultWidth
         self.depthTopFault = depthTopFault
         self.ruptureLength = None
+        self.ruptureWidth = None
+        self.ruptureTopDepth = None
 
     def magnScalingLeonard2014(self, mfd, eqSource, aspectRatio=2):
         # Leonard 2010 coefficients are updated with Leonard 2014.
@@ -15,6 +17,8 @@ class magnitudeScaling():
 
         earthquake_magnitude_array = mfd.magRange
         ruptureLenghtList = []
+        ruptureWidthList = []
+        ruptureTopDepthList = []
         for earthquake_magnitude in earthquake_magnitude_array:
 
             if self.faultMechanism == "Normal" or self.faultMechanism == "Strike Slip":  # strike-slip and normal faulting
@@ -52,6 +56,13 @@ class magnitudeScaling():
             if ruptureLength > self.faultLength:
                 ruptureLength = self.faultLength
             
+            # Rupture width follows from the area, limited to the fault width below the top of rupture.
+            ruptureWidth = min(ruptureArea / ruptureLength, avaliable_rupture_width_in_fault)
+
             ruptureLenghtList.append(round(ruptureLength, 3))
+            ruptureWidthList.append(round(float(ruptureWidth), 3))
+            ruptureTopDepthList.append(round(float(max(z_tor, self.depthTopFault)), 3))
 
         self.ruptureLength = ruptureLenghtList
+        self.ruptureWidth = ruptureWidthList
+        self.ruptureTopDepth = ruptureTopDepthList
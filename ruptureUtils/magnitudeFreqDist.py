@@ -2,23 +2,108 @@ import numpy as np
 
 class DoublyBoundedGRModel():
 
-    def __init__(self, minMag, maxMag, aGR, bGR, mBin = 0.25):
+    def __init__(self, minMag, maxMag, aGR, bGR, mBin = 0.25, magBinEdges=None):
+        """
+        :param mBin: Width of the uniform magnitude bins.
+        :param magBinEdges: Edges of non-uniform magnitude bins from minMag to maxMag, e.g. from adaptive();
+        each bin is then represented by its rate-weighted mean magnitude instead of its lower edge.
+        """
         self.minMag = minMag
         self.maxMag = maxMag
         self.aGR = aGR
         self.bGR = bGR
-        self.magRange = np.arange(self.minMag,self.maxMag + mBin, mBin)
+        self.magBinEdges = None
+        if magBinEdges is None:
+            self.magRange = np.arange(self.minMag,self.maxMag + mBin, mBin)
+        else:
+            magBinEdges = np.asarray(magBinEdges, dtype=float)
+            if (not np.isclose(magBinEdges[0], minMag) or not np.isclose(magBinEdges[-1], maxMag)
+                    or np.any(np.diff(magBinEdges) <= 0)):
+                raise Exception(str(magBinEdges.tolist()) + " is not a valid increasing list of bin edges from "
+                                "minMag to maxMag.")
+            self.magBinEdges = magBinEdges
+            self.magRange = self.binMeanMagnitude(magBinEdges[:-1], magBinEdges[1:])
         self.cdfMFD = None
         self.pmfMFD = None
         self.sourceRate = None
 
+    def cdf(self, magnitude):
+        # Truncated Gutenberg-Richter CDF.
+        return ((1 - 10**(-self.bGR * (np.asarray(magnitude) - self.minMag))) /
+                (1 - 10**(-self.bGR * (self.maxMag - self.minMag))))
+
+    def pdf(self, magnitude):
+        beta = self.bGR * np.log(10)
+        return (beta * np.exp(-beta * (np.asarray(magnitude) - self.minMag)) /
+                (1 - np.exp(-beta * (self.maxMag - self.minMag))))
+
+    def binMeanMagnitude(self, lower, upper):
+        # Mean magnitude of the truncated exponential distribution within each bin.
+        beta = self.bGR * np.log(10)
+        width = np.asarray(upper, dtype=float) - lower
+        return lower + 1 / beta - width * np.exp(-beta * width) / -np.expm1(-beta * width)
+
     def db_gr_mfd_model(self):
-        self.cdfMFD = ((1 - 10**(-self.bGR * (self.magRange - self.minMag))) /
-                        (1 - 10**(-self.bGR * (self.maxMag - self.minMag))))
+        if self.magBinEdges is not None:
+            self.cdfMFD = self.cdf(self.magBinEdges[:-1])
+            self.pmfMFD = np.diff(self.cdf(self.magBinEdges))
+            self.sourceRate = 10 ** (self.aGR - self.bGR * self.minMag)
+            return
+
+        self.cdfMFD = self.cdf(self.magRange)
         cdf_1 = np.append(self.cdfMFD[1:], 1)
         cdf_2 = self.cdfMFD[0:]
         self.pmfMFD = cdf_1 - cdf_2
         self.sourceRate = 10 ** (self.aGR - self.bGR * self.minMag)
 
+    @classmethod
+    def adaptive(cls, minMag, maxMag, aGR, bGR, exceedance, tolerance=0.01, minRate=1e-7, minBin=0.01,
+                 maxBins=200, quadratureOrder=6):
+        """
+        MFD with the fewest non-uniform magnitude bins, split one at a time, for which the estimated
+        discretization error of the hazard stays under a tolerance. The error is that of the given
+        exceedance measure, e.g. the GMM at fixed distances; the change of the rupture geometry with
+        magnitude within a bin is not controlled.
+        :param exceedance: Callable of magnitudes, shape (n,), returning P(IM > im | m) at the controlled
+        IM thresholds, shape (n, nThresholds), e.g. gmmMain.magnitudeExceedance.
+        :param tolerance: Largest relative error of the exceedance rate at any controlled threshold.
+        :param minRate: Thresholds exceeded less often than this (per year) are not controlled.
+        :param minBin: Bins are not split below this width.
+        :param maxBins: Largest number of bins; the tolerance may not be met when it is reached.
+        :param quadratureOrder: Gauss-Legendre points per bin of the reference integral.
+        """
+        mfd = cls(minMag, maxMag, aGR, bGR)
+        sourceRate = 10 ** (aGR - bGR * minMag)
+        nodes, weights = np.polynomial.legendre.leggauss(quadratureOrder)
+
+        def binRates(lower, upper):
+            # Exceedance rates of bins by quadrature, and their absolute error with one magnitude per bin.
+            halfWidth = (upper - lower) / 2
+            magnitudes = (lower + upper)[:, None] / 2 + halfWidth[:, None] * nodes
+            integrand = exceedance(magnitudes.ravel()).reshape(magnitudes.shape + (-1,))
+            exact = np.einsum('bn,bnt->bt', mfd.pdf(magnitudes) * weights * halfWidth[:, None], integrand)
+            discrete = (mfd.cdf(upper) - mfd.cdf(lower))[:, None] * exceedance(mfd.binMeanMagnitude(lower, upper))
+            return sourceRate * exact, sourceRate * np.abs(exact - discrete)
+
+        edges = [float(minMag), float(maxMag)]
+        exact, error = binRates(np.array(edges[:1]), np.array(edges[1:]))
+        while len(edges) - 1 < maxBins:
+            hazard = exact.sum(axis=0)
+            controlled = hazard >= minRate
+            relativeError = error[:, controlled] / hazard[controlled]
+            if not controlled.any() or relativeError.sum(axis=0).max() <= tolerance:
+                break
 
+            # Split the widest-enough bin contributing most to the worst controlled threshold.
+            worst = relativeError[:, np.argmax(relativeError.sum(axis=0))]
+            worst[np.diff(edges) < 2 * minBin] = -1
+            index = int(np.argmax(worst))
+            if worst[index] < 0:
+                break
+            middle = (edges[index] + edges[index + 1]) / 2
+            splitExact, splitError = binRates(np.array([edges[index], middle]), np.array([middle, edges[index + 1]]))
+            edges.insert(index + 1, middle)
+            exact = np.concatenate([exact[:index], splitExact, exact[index + 1:]])
+            error = np.concatenate([error[:index], splitError, error[index + 1:]])
 
+        return cls(minMag, maxMag, aGR, bGR, magBinEdges=edges)
@@ -0,0 +1,117 @@
+import copy
+import numpy as np
+
+class ruptureSet():
+    """
+    Struct-of-arrays container for the simulated ruptures of a source.
+
+    Per-rupture values are contiguous float arrays, shape (nRuptures,) or (nRuptures, 2) for
+    coordinates (longitude, latitude). GMM residuals are per-IMT scalars stored once. Ruptures are
+    planar surfaces below the segment between their starting and ending coordinates, from the depth
+    to top of rupture down-dip over the rupture width. Ruptures crossing a bend of the fault trace are
+    made of one such piece per trace segment, kept by the source modeling; their starting and ending
+    coordinates are those of the first and last piece.
+    """
+
+    def __init__(self, magnitude, magnitudePMF, distancePMF, startingCoordinates, endingCoordinates,
+                 magnitudeOffsets=None, ruptureWidth=None, ruptureTopDepth=None):
+        self.magnitude = np.ascontiguousarray(magnitude, dtype=float)
+        self.magnitudePMF = np.ascontiguousarray(magnitudePMF, dtype=float)
+        self.distancePMF = np.ascontiguousarray(distancePMF, dtype=float)
+        self.startingCoordinates = np.ascontiguousarray(startingCoordinates, dtype=float).reshape(-1, 2)
+        self.endingCoordinates = np.ascontiguousarray(endingCoordinates, dtype=float).reshape(-1, 2)
+        # Ruptures of magnitude bin i are rows magnitudeOffsets[i]:magnitudeOffsets[i + 1].
+        self.magnitudeOffsets = magnitudeOffsets
+        self.ruptureWidth = None if ruptureWidth is None else np.ascontiguousarray(ruptureWidth, dtype=float)
+        self.ruptureTopDepth = None if ruptureTopDepth is None else np.ascontiguousarray(ruptureTopDepth, dtype=float)
+        # Site distances: closestDistance is the Joyner-Boore distance (Rjb) used by the GMMs.
+        self.closestDistance = None
+        self.ruptureDistance = None
+        self.strikeNormalDistance = None
+        self.imMedian = None
+        self.tau = None
+        self.phi = None
+        self.totalSigma = None
+
+    def __len__(self):
+        return len(self.magnitude)
+
+    def magnitudeSlice(self, index):
+        """
+        Row slice of the ruptures of a magnitude bin; indexing arrays with it returns views.
+        """
+        return slice(self.magnitudeOffsets[index], self.magnitudeOffsets[index + 1])
+
+    def ruptureRates(self, sourceRate):
+        """
+        Annual occurrence rate of each rupture, P(M=m) * P(R=r|m) * source rate.
+        """
+        return self.magnitudePMF * self.distancePMF * sourceRate
+
+    def replace(self, **arrays):
+        """
+        Shallow copy sharing every array except the given ones.
+        """
+        newSet = copy.copy(self)
+        for name, values in arrays.items():
+            if not hasattr(newSet, name):
+                raise Exception(name + " is not a rupture set attribute.")
+            setattr(newSet, name, values)
+
+        return newSet
+
+    def subset(self, ruptureIndex):
+        """
+        New rupture set holding the given ruptures, in their order in this set.
+        :param ruptureIndex: Increasing rupture indices or a boolean mask.
+        """
+        ruptureIndex = np.arange(len(self))[ruptureIndex]
+        kept = np.zeros(len(self) + 1, dtype=int)
+        kept[ruptureIndex + 1] = 1
+        take = lambda values: None if values is None else values[..., ruptureIndex]
+
+        newSet = self.replace(
+            magnitude=self.magnitude[ruptureIndex],
+            magnitudePMF=self.magnitudePMF[ruptureIndex],
+            distancePMF=self.distancePMF[ruptureIndex],
+            startingCoordinates=self.startingCoordinates[ruptureIndex],
+            endingCoordinates=self.endingCoordinates[ruptureIndex],
+            magnitudeOffsets=None if self.magnitudeOffsets is None else np.cumsum(kept)[self.magnitudeOffsets],
+            ruptureWidth=take(self.ruptureWidth),
+            ruptureTopDepth=take(self.ruptureTopDepth),
+            closestDistance=take(self.closestDistance),
+            ruptureDistance=take(self.ruptureDistance),
+            strikeNormalDistance=take(self.strikeNormalDistance),
+            imMedian=take(self.imMedian),
+        )
+
+        return newSet
+
+    def toDataframe(self):
+        """
+        Rupture table for display, one row per rupture.
+        """
+        import pandas as pd
+
+        data = {
+            "Magnitude": self.magnitude,
+            "Starting coordinate": self.startingCoordinates.tolist(),
+            "Ending coordinate": self.endingCoordinates.tolist(),
+            "P(M=m)": self.magnitudePMF,
+            "P(R=r|m)": self.distancePMF,
+        }
+        if self.ruptureWidth is not None:
+            data["Rupture Width"] = self.ruptureWidth
+            data["Depth to Top of Rupture"] = self.ruptureTopDepth
+        if self.closestDistance is not None:
+            data["Closest Distance"] = self.closestDistance
+        if self.ruptureDistance is not None:
+            data["Rupture Distance"] = self.ruptureDistance
+            data["Rx"] = self.strikeNormalDistance
+        if self.imMedian is not None:
+            data["IM median"] = self.imMedian
+            data["Between-event (tau) Residual"] = np.full(len(self), self.tau)
+            data["Within-event (phi) Residual"] = np.full(len(self), self.phi)
+            data["Total Residual"] = np.full(len(self), self.totalSigma)
+
+        return pd.DataFrame(data, index=np.arange(1, len(self) + 1))
@@ -1,128 +1,324 @@
 import numpy as np
-import math
-import pandas as pd
-from shapely.geometry import LineString, Point
-from geopy.distance import geodesic
+from ruptureUtils.ruptureSet import ruptureSet
+from ruptureUtils.integrationDistance import integrationDistance, ruptureBoundingBoxIndex
 
-class earthquakeSourcesModeling():
-    def __init__(self, eqSource, mfd, magnScaling, meshSpace):
-        self.eqSource = eqSource
-        self.mfd = mfd
-        self.magnScaling = magnScaling
-        self.meshSpace = meshSpace
-        self.ruptureDataframe = pd.DataFrame(columns=["Magnitude", "Starting coordinate", "Ending coordinate"])
+def unitVectors(coordinates):
+    """
+    Convert coordinates to unit vectors on the sphere.
+    :param coordinates: Array of points (longitude, latitude), shape (..., 2).
+    :return: Array of unit vectors, shape (..., 3).
+    """
+    coordinates = np.radians(np.asarray(coordinates, dtype=float))
+    lon, lat = coordinates[..., 0], coordinates[..., 1]
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
 
-    def meshFaultSource(self):
-        faultMeshDistancesList = []
-        for i, magnitudes in enumerate(self.mfd.magRange):
-            if self.magnScaling.ruptureLength[i] >= self.eqSource.faultLength:
-                ruptureLength = self.eqSource.faultLength
-            else:
-                ruptureLength = self.magnScaling.ruptureLength[i]
-            number = int(ruptureLength / self.meshSpace)
-            meshSpaceChanged = number * self.meshSpace
-            faultMeshDistances = np.arange(0, self.eqSource.faultLength - meshSpaceChanged, self.meshSpace)
-            lastUnrupturedPart = (self.eqSource.faultLength - (faultMeshDistances[-1] +
-                                  self.magnScaling.ruptureLength[i]))
-            faultMeshDistancesShifted = faultMeshDistances + lastUnrupturedPart / 2
-            faultMeshDistancesList.append(faultMeshDistancesShifted)
-
-        return faultMeshDistancesList
+def destinationPoint(coordinates, distances, azimuth):
+    """
+    Points reached by travelling the given distances from the given points along an azimuth.
+    :param coordinates: Starting points (longitude, latitude), shape (2,) or (n, 2).
+    :param distances: Distances in km, shape (n,).
+    :param azimuth: Azimuth in degrees clockwise from north, scalar or shape (n,).
+    :return: Array of new points (longitude, latitude), shape (n, 2).
+    """
+    # Convert longitude, latitude, and azimuth to radians
+    coordinates = np.radians(np.asarray(coordinates, dtype=float))
+    lon, lat = coordinates[..., 0], coordinates[..., 1]
+    azimuth = np.radians(azimuth)
 
-    def getRuptureCoordinate(self):
+    # Earth radius in kilometers (mean radius)
+    R = 6371.0
+    angularDistance = np.asarray(distances, dtype=float) / R
+
+    # Calculate the new latitude and longitude
+    newLat = np.arcsin(np.sin(lat) * np.cos(angularDistance) +
+                       np.cos(lat) * np.sin(angularDistance) * np.cos(azimuth))
+    newLon = lon + np.arctan2(np.sin(azimuth) * np.sin(angularDistance) * np.cos(lat),
+                              np.cos(angularDistance) - np.sin(lat) * np.sin(newLat))
+
+    return np.column_stack([np.degrees(newLon), np.degrees(newLat)])
+
+def greatCircleSegmentDistance(siteCoordinates, startingCoordinates, endingCoordinates):
+    """
+    Closest great-circle distance between each site and each rupture segment.
+    :param siteCoordinates: Array of sites (longitude, latitude), shape (nSites, 2).
+    :param startingCoordinates: Array of segment starting points, shape (nRuptures, 2).
+    :param endingCoordinates: Array of segment ending points, shape (nRuptures, 2).
+    :return: Distances in km, shape (nSites, nRuptures).
+    """
+    # Earth radius in kilometers (mean radius)
+    R = 6371.0
+
+    P = unitVectors(np.atleast_2d(siteCoordinates))
+    A = unitVectors(startingCoordinates)
+    B = unitVectors(endingCoordinates)
+
+    # Pole of the great circle through A and B.
+    n = np.cross(A, B)
+    nNorm = np.linalg.norm(n, axis=-1)
+    degenerate = nNorm < 1e-12
+    n = n / np.where(degenerate, 1.0, nNorm)[:, None]
+
+    # Angular distance to the segment ends from the chord length.
+    angleA = 2 * np.arcsin(np.clip(np.sqrt(np.maximum(2 - 2 * (P @ A.T), 0)) / 2, 0, 1))
+    angleB = 2 * np.arcsin(np.clip(np.sqrt(np.maximum(2 - 2 * (P @ B.T), 0)) / 2, 0, 1))
+    angle = np.minimum(angleA, angleB)
+
+    # The foot of the perpendicular lies on the minor arc AB when the site is between the
+    # great circles through A and B that are perpendicular to the segment.
+    onSegment = (((P @ np.cross(n, A).T) >= 0) & ((P @ np.cross(B, n).T) >= 0)) & ~degenerate
+    crossTrack = np.arcsin(np.clip(np.abs(P @ n.T), 0, 1))
+    angle = np.where(onSegment, crossTrack, angle)
+
+    return R * angle
+
+def _planarSurfaceFrames(startingCoordinates, endingCoordinates, ruptureTopDepth, dip, traceDepth):
+    # Earth-centred (km) frame of each rupture plane: origin at the start of the top edge, unit vectors
+    # along strike, in the horizontal dip direction and up at the rupture midpoint, and rupture length.
+    R = 6371.0
+
+    A = unitVectors(np.atleast_2d(startingCoordinates))
+    B = unitVectors(np.atleast_2d(endingCoordinates))
+    up = A + B
+    up = up / np.linalg.norm(up, axis=-1)[:, None]
+
+    # Horizontal strike direction at the midpoint; dip direction is 90 degrees clockwise from it.
+    chord = B - A
+    strike = chord - np.sum(chord * up, axis=-1)[:, None] * up
+    strike = strike / np.maximum(np.linalg.norm(strike, axis=-1), 1e-15)[:, None]
+    dipDirection = np.cross(strike, up)
+    length = R * 2 * np.arcsin(np.clip(np.linalg.norm(chord, axis=-1) / 2, 0, 1))
+
+    # The fault trace is at traceDepth; deeper ruptures start further in the dip direction.
+    dipRad = np.radians(dip)
+    offset = (np.asarray(ruptureTopDepth, dtype=float) - traceDepth) * np.cos(dipRad) / np.sin(dipRad)
+    origin = ((R - np.asarray(ruptureTopDepth, dtype=float))[:, None] * up - (length / 2)[:, None] * strike +
+              offset[:, None] * dipDirection)
 
-        def getNewCoordinate(lat, lon, distanceList, azimuth):
-            # Convert latitude, longitude, and azimuth to radians
-            lat = math.radians(lat)
-            lon = math.radians(lon)
-            azimuth = math.radians(azimuth)
+    return origin, strike, dipDirection, up, length
 
-            # Earth radius in kilometers (mean radius)
-            R = 6371.0
+def planarSurfaceDistances(siteCoordinates, startingCoordinates, endingCoordinates, ruptureTopDepth,
+                           ruptureWidth, dip, traceDepth=0.0):
+    """
+    Joyner-Boore, rupture and strike-normal distances between each site and each planar rupture surface.
+    The closest point of a rupture is found by clamping the site's position in the plane to the
+    rupture, which is the limit of the closest node of an ever finer strike x dip mesh.
+    :param siteCoordinates: Array of sites (longitude, latitude), shape (nSites, 2).
+    :param startingCoordinates: Array of rupture starting points on the fault trace, shape (nRuptures, 2).
+    :param endingCoordinates: Array of rupture ending points on the fault trace, shape (nRuptures, 2).
+    :param ruptureTopDepth: Depth to top of rupture in km, shape (nRuptures,).
+    :param ruptureWidth: Down-dip rupture width in km, shape (nRuptures,).
+    :param dip: Dip angle in degrees, dipping to the right of the strike direction.
+    :param traceDepth: Depth of the fault trace in km.
+    :return: Rjb, Rrup and Rx in km, each shape (nSites, nRuptures). Rx is positive on the hanging wall.
+    """
+    # Earth radius in kilometers (mean radius)
+    R = 6371.0
 
-            newLatList, newLonList = [], []
-            for distance in distanceList:
-                # Calculate the new latitude
-                newLat = math.asin(math.sin(lat) * math.cos(distance / R) +
-                                    math.cos(lat) * math.sin(distance / R) * math.cos(azimuth))
+    origin, strike, dipDirection, up, length = _planarSurfaceFrames(startingCoordinates, endingCoordinates,
+                                                                    ruptureTopDepth, dip, traceDepth)
+    dipRad = np.radians(dip)
+    downDip = np.cos(dipRad) * dipDirection - np.sin(dipRad) * up
+    normal = np.cross(strike, downDip)
+    ruptureWidth = np.asarray(ruptureWidth, dtype=float)
 
-                # Calculate the new longitude
-                newLon = lon + math.atan2(math.sin(azimuth) * math.sin(distance / R) * math.cos(lat),
-                                           math.cos(distance / R) - math.sin(lat) * math.sin(newLat))
+    # Site coordinates in each rupture frame, shape (nSites, nRuptures).
+    S = R * unitVectors(np.atleast_2d(siteCoordinates))
+    project = lambda axis: S @ axis.T - np.sum(origin * axis, axis=-1)
+    alongStrike = project(strike)
+    strikeNormal = project(dipDirection)
+    alongDip = project(downDip)
 
-                # Convert the new coordinates from radians to degrees
-                newLat = math.degrees(newLat)
-                newLon = math.degrees(newLon)
+    alongStrikeExcess = alongStrike - np.clip(alongStrike, 0, length)
+    rjb = np.hypot(alongStrikeExcess, strikeNormal - np.clip(strikeNormal, 0, ruptureWidth * np.cos(dipRad)))
+    rrup = np.sqrt(alongStrikeExcess ** 2 + (alongDip - np.clip(alongDip, 0, ruptureWidth)) ** 2 +
+                   project(normal) ** 2)
 
-                newLatList.append(np.round(newLat,4))
-                newLonList.append(np.round(newLon,4))
-                newCoordinates = [[a, b] for a, b in zip(newLatList, newLonList)]
+    return rjb, rrup, strikeNormal
+
+def planarSurfaceMesh(startingCoordinate, endingCoordinate, ruptureTopDepth, ruptureWidth, dip, meshSpace,
+                      traceDepth=0.0):
+    """
+    Strike x dip grid of nodes on a planar rupture surface.
+    :param meshSpace: Approximate node spacing in km.
+    :return: Node coordinates (longitude, latitude), shape (nDip, nStrike, 2), and depths in km,
+    shape (nDip, nStrike).
+    """
+    origin, strike, dipDirection, up, length = _planarSurfaceFrames(startingCoordinate, endingCoordinate,
+                                                                    [ruptureTopDepth], dip, traceDepth)
+    dipRad = np.radians(dip)
+    downDip = np.cos(dipRad) * dipDirection[0] - np.sin(dipRad) * up[0]
+
+    alongStrike = np.linspace(0, length[0], max(int(round(length[0] / meshSpace)), 1) + 1)
+    alongDip = np.linspace(0, ruptureWidth, max(int(round(ruptureWidth / meshSpace)), 1) + 1)
+    nodes = origin[0] + alongStrike[None, :, None] * strike[0] + alongDip[:, None, None] * downDip
+
+    return _surfaceCoordinates(nodes)
+
+def _surfaceCoordinates(points):
+    # Earth-centred points (km) to (longitude, latitude) and depth.
+    R = 6371.0
+    radius = np.linalg.norm(points, axis=-1)
+    coordinates = np.stack([np.degrees(np.arctan2(points[..., 1], points[..., 0])),
+                            np.degrees(np.arcsin(points[..., 2] / radius))], axis=-1)
+
+    return coordinates, R - radius
+
+def planarSurfaceCorners(startingCoordinates, endingCoordinates, ruptureTopDepth, ruptureWidth, dip,
+                         traceDepth=0.0):
+    """
+    Corners of each planar rupture surface: top start, top end, bottom end and bottom start.
+    :return: Corner coordinates (longitude, latitude), shape (nRuptures, 4, 2), and depths in km,
+    shape (nRuptures, 4).
+    """
+    origin, strike, dipDirection, up, length = _planarSurfaceFrames(startingCoordinates, endingCoordinates,
+                                                                    ruptureTopDepth, dip, traceDepth)
+    dipRad = np.radians(dip)
+    downDip = (np.cos(dipRad) * dipDirection - np.sin(dipRad) * up) * np.asarray(ruptureWidth, dtype=float)[:, None]
+    topEnd = origin + length[:, None] * strike
+
+    return _surfaceCoordinates(np.stack([origin, topEnd, topEnd + downDip, origin + downDip], axis=1))
+
+class earthquakeSourcesModeling():
+    def __init__(self, eqSource, mfd, magnScaling, meshSpace):
+        self.eqSource = eqSource
+        self.mfd = mfd
+        self.magnScaling = magnScaling
+        self.meshSpace = meshSpace
+        self.ruptureSet = None
+        # Planar pieces of every rupture, one per fault trace segment it crosses, shape (nRuptures, nPieces, 2);
+        # ruptures crossing fewer segments repeat their last piece.
+        self.pieceStartingCoordinates = None
+        self.pieceEndingCoordinates = None
+        self.boundingBoxIndexes = {}
+
+    @property
+    def ruptureDataframe(self):
+        # Display-only table; calculations use the columnar rupture set.
+        return self.ruptureSet.toDataframe()
+
+    def meshFaultSource(self):
+        """
+        Distances along the fault from its first point to the starting point of every rupture.
+        :return: Flat array of distances of all magnitudes, and the rupture counts per magnitude.
+        """
+        ruptureLengths = np.asarray(self.magnScaling.ruptureLength, dtype=float)
+        faultLength = self.eqSource.faultLength
 
-            return newCoordinates
+        # Ruptures start every meshSpace km, leaving room for the rupture length rounded down to the mesh.
+        number = (np.minimum(ruptureLengths, faultLength) / self.meshSpace).astype(int)
+        meshSpaceChanged = number * self.meshSpace
+        ruptureCounts = np.ceil((faultLength - meshSpaceChanged) / self.meshSpace).astype(int)
 
-        faultMeshDistancesList = self.meshFaultSource()
+        # Center the meshed ruptures by sharing the last unruptured part between both fault ends.
+        lastUnrupturedPart = faultLength - ((ruptureCounts - 1) * self.meshSpace + ruptureLengths)
 
-        startingCoordinatesList = []
-        endingCoordinatesList = []
-        for index, distanceList in enumerate(faultMeshDistancesList):
-            startingCoordinates = getNewCoordinate(self.eqSource.coordinates[0][0], self.eqSource.coordinates[0][1],
-                                                   distanceList, self.eqSource.strike)
-            startingCoordinatesList.append(startingCoordinates)
+        magnitudeOffsets = np.concatenate([[0], np.cumsum(ruptureCounts)])
+        meshIndex = np.arange(magnitudeOffsets[-1]) - np.repeat(magnitudeOffsets[:-1], ruptureCounts)
+        faultMeshDistances = meshIndex * self.meshSpace + np.repeat(lastUnrupturedPart / 2, ruptureCounts)
 
-            endingCoordinatesListTemp = []
-            for strCords in startingCoordinates:
-                endingCoordinates = getNewCoordinate(strCords[0], strCords[1],
-                                                     [self.magnScaling.ruptureLength[index]],
-                                                     self.eqSource.strike)
-                endingCoordinatesListTemp.append(endingCoordinates)
+        return faultMeshDistances, ruptureCounts
 
-            endingCoordinatesList.append(endingCoordinatesListTemp)
+    def tracePieces(self, startDistances, ruptureLengths):
+        """
+        Pieces of the fault trace covered by ruptures, one per trace segment they cross.
+        :param startDistances: Distances along the trace from its first point to the rupture starts, shape (nRuptures,).
+        :param ruptureLengths: Rupture lengths in km, shape (nRuptures,).
+        :return: Starting and ending coordinates of the pieces, each shape (nRuptures, nPieces, 2). Ruptures crossing
+        fewer segments repeat their last piece.
+        """
+        vertices = np.asarray(self.eqSource.coordinates, dtype=float)
+        strikes = np.asarray(self.eqSource.segmentStrikes, dtype=float)
+        cumulativeLengths = np.asarray(self.eqSource.cumulativeLengths, dtype=float)
+        lastSegment = len(strikes) - 1
 
-        return startingCoordinatesList, endingCoordinatesList
+        # Segments holding the rupture ends; ruptures running past the trace ends extend its end segments.
+        firstSegments = np.clip(np.searchsorted(cumulativeLengths, startDistances, side='right') - 1, 0, lastSegment)
+        lastSegments = np.clip(np.searchsorted(cumulativeLengths, startDistances + ruptureLengths, side='left') - 1,
+                               firstSegments, lastSegment)
+        pieceCount = int(np.max(lastSegments - firstSegments, initial=0)) + 1
 
-    def ruptureProps(self):
+        startingPieces, endingPieces = [], []
+        for piece in range(pieceCount):
+            segment = np.minimum(firstSegments + piece, lastSegments)
+            first = segment == firstSegments
+            last = segment == lastSegments
 
-        startingCoordinatesList, endingCoordinatesList = self.getRuptureCoordinate()
+            # Inner pieces run between trace points; the rupture ends are found from the first point of their
+            # segment along its strike, so that they stay on the trace.
+            startingCoordinates = np.where(first[:, None], np.round(destinationPoint(
+                vertices[segment], startDistances - cumulativeLengths[segment], strikes[segment]), 4),
+                vertices[segment])
+            endingCoordinates = np.where(last[:, None], np.round(destinationPoint(
+                vertices[segment], startDistances + ruptureLengths - cumulativeLengths[segment], strikes[segment]), 4),
+                vertices[segment + 1])
 
-        dictMagPMF = {'magRange': self.mfd.magRange, 'pmfMFD': self.mfd.pmfMFD}
+            startingPieces.append(startingCoordinates)
+            endingPieces.append(endingCoordinates)
 
-        def get_pmf_for_mag(mag):
-            try:
-                j = np.where(dictMagPMF['magRange'] == mag)[0]
-                return dictMagPMF['pmfMFD'][j][0]
-            except ValueError:
-                return None
+        return np.stack(startingPieces, axis=1), np.stack(endingPieces, axis=1)
 
-        for index, magnitude in enumerate(self.mfd.magRange):
+    def getRuptureCoordinate(self):
+        """
+        Rupture pieces of all magnitude bins, meshed along the fault trace, see tracePieces.
+        :return: (nRuptures, nPieces, 2) arrays of the starting and ending coordinates of the pieces, and the
+        offsets of each magnitude bin in them, shape (nMagnitudes + 1,).
+        """
+        faultMeshDistances, ruptureCounts = self.meshFaultSource()
+        magnitudeOffsets = np.concatenate([[0], np.cumsum(ruptureCounts)])
 
-            # Flatten ending points
-            ending_points_flat = [item[0] for item in endingCoordinatesList[index]]
+        ruptureLengths = np.repeat(np.asarray(self.magnScaling.ruptureLength, dtype=float), ruptureCounts)
+        pieceStartingCoordinates, pieceEndingCoordinates = self.tracePieces(faultMeshDistances, ruptureLengths)
 
-            # Create the DataFrame
-            data = {
-                "Magnitude": [magnitude] * len(startingCoordinatesList[index]),
-                "P(M=m)": [get_pmf_for_mag(magnitude)] * len(startingCoordinatesList[index]),
-                "P(R=r|m)": [1 / len(startingCoordinatesList[index])] * len(startingCoordinatesList[index]),
-                "Starting coordinate": startingCoordinatesList[index],
-                "Ending coordinate": ending_points_flat
-            }
+        return pieceStartingCoordinates, pieceEndingCoordinates, magnitudeOffsets
 
-            df = pd.DataFrame(data)
+    def ruptureProps(self, ruptureCoordinates=None):
+        """
+        Build the rupture set.
+        :param ruptureCoordinates: Result of getRuptureCoordinate, e.g. from a geometry cache; computed if None.
+        """
+        if ruptureCoordinates is None:
+            ruptureCoordinates = self.getRuptureCoordinate()
+        self.pieceStartingCoordinates, self.pieceEndingCoordinates, magnitudeOffsets = ruptureCoordinates
+        ruptureCounts = np.diff(magnitudeOffsets)
 
-            self.ruptureDataframe = pd.concat([self.ruptureDataframe, df], ignore_index=True)
-            self.ruptureDataframe.index = self.ruptureDataframe.index + 1
+        self.ruptureSet = ruptureSet(
+            magnitude=np.repeat(self.mfd.magRange, ruptureCounts),
+            magnitudePMF=np.repeat(self.mfd.pmfMFD, ruptureCounts),
+            distancePMF=np.repeat(1 / ruptureCounts, ruptureCounts),
+            startingCoordinates=self.pieceStartingCoordinates[:, 0],
+            endingCoordinates=self.pieceEndingCoordinates[:, -1],
+            magnitudeOffsets=magnitudeOffsets,
+            ruptureWidth=np.repeat(self.magnScaling.ruptureWidth, ruptureCounts),
+            ruptureTopDepth=np.repeat(self.magnScaling.ruptureTopDepth, ruptureCounts),
+        )
 
-    def calculateClosestDistance(self, siteCoordinate):
+    def calculateClosestDistance(self, siteCoordinate, method="spherical"):
         """
         Calculate the closest distance between the given point and each line in the DataFrame.
-        :param point: A tuple representing the point (longitude, latitude).
-        :return: A DataFrame with the closest distances.
+        :param siteCoordinate: A tuple representing the point (longitude, latitude).
+        :param method: "spherical" for the vectorized distances to the rupture surfaces, or "geodesic" for
+        the shapely/geopy distance to the rupture traces, kept for accuracy checks.
         """
+        if method == "spherical":
+            rjb, rrup, rx = self.siteDistanceMatrices([siteCoordinate])
+            self.ruptureSet.closestDistance = rjb[0]
+            self.ruptureSet.ruptureDistance = rrup[0]
+            self.ruptureSet.strikeNormalDistance = rx[0]
+        elif method == "geodesic":
+            self.ruptureSet.closestDistance = np.asarray(self.geodesicClosestDistance(siteCoordinate), dtype=float)
+        else:
+            raise Exception(method + " is not a valid distance method.")
+
+    def geodesicClosestDistance(self, siteCoordinate):
+        from shapely.geometry import LineString, Point
+        from geopy.distance import geodesic
+
         distances = []
         point_geom = Point(siteCoordinate)
 
-        for _, row in self.ruptureDataframe.iterrows():
-            line = LineString([row["Starting coordinate"], row["Ending coordinate"]])
+        for startingCoordinate, endingCoordinate in zip(self.ruptureSet.startingCoordinates,
+                                                        self.ruptureSet.endingCoordinates):
+            line = LineString([startingCoordinate, endingCoordinate])
             # degree
             # distance = point_geom.distance(line)
             # km
@@ -131,5 +327,121 @@ class earthquakeSourcesModeling():
 
             distances.append(distance)
 
-        self.ruptureDataframe["Closest Distance"] = distances
+        return distances
+
+    def _pieceArrays(self, ruptureIndex=slice(None)):
+        # Starting and ending coordinates, depths to top and widths of the pieces of the given ruptures,
+        # flattened to one row per piece, and the piece count of a rupture.
+        ruptures = self.ruptureSet
+        startingCoordinates = self.pieceStartingCoordinates[ruptureIndex]
+        pieceCount = startingCoordinates.shape[1]
+
+        return (startingCoordinates.reshape(-1, 2), self.pieceEndingCoordinates[ruptureIndex].reshape(-1, 2),
+                np.repeat(ruptures.ruptureTopDepth[ruptureIndex], pieceCount),
+                np.repeat(ruptures.ruptureWidth[ruptureIndex], pieceCount), pieceCount)
+
+    def siteDistanceMatrices(self, siteCoordinates, ruptureIndex=slice(None)):
+        """
+        Calculate Rjb, Rrup and Rx between each site and each rupture surface. The distances of a rupture of
+        several pieces are those of its closest piece.
+        :param siteCoordinates: Array of sites (longitude, latitude), shape (nSites, 2).
+        :param ruptureIndex: Index or mask of the ruptures to use, all by default.
+        :return: Distances in km, each shape (nSites, nRuptures).
+        """
+        siteCoordinates = np.atleast_2d(siteCoordinates)
+        *pieces, pieceCount = self._pieceArrays(ruptureIndex)
+        distances = planarSurfaceDistances(siteCoordinates, *pieces, self.eqSource.dip, self.eqSource.seismicDepth[0])
+        if pieceCount == 1:
+            return distances
+
+        rjb, rrup, rx = (values.reshape(len(siteCoordinates), -1, pieceCount) for values in distances)
+        closestPiece = np.argmin(rrup, axis=-1)[..., None]
+        return (rjb.min(axis=-1), np.take_along_axis(rrup, closestPiece, axis=-1)[..., 0],
+                np.take_along_axis(rx, closestPiece, axis=-1)[..., 0])
+
+    def ruptureBoundingBoxes(self):
+        """
+        Bounding boxes of the surface projections of the ruptures.
+        :return: [x min, x max, y min, y max] of each rupture in degrees, shape (nRuptures, 4).
+        """
+        *pieces, pieceCount = self._pieceArrays()
+        corners, _ = planarSurfaceCorners(*pieces, self.eqSource.dip, self.eqSource.seismicDepth[0])
+        corners = corners.reshape(len(self.ruptureSet), 4 * pieceCount, 2)
+
+        return np.column_stack([corners[..., 0].min(axis=1), corners[..., 0].max(axis=1),
+                                corners[..., 1].min(axis=1), corners[..., 1].max(axis=1)])
+
+    def boundingBoxIndex(self, maxDistance):
+        # Indexes are built once per integration distance and reused for every site.
+        if maxDistance not in self.boundingBoxIndexes:
+            self.boundingBoxIndexes[maxDistance] = ruptureBoundingBoxIndex(self.ruptureBoundingBoxes(),
+                                                                           self.ruptureSet.magnitude, maxDistance)
+        return self.boundingBoxIndexes[maxDistance]
+
+    def siteRuptureDistances(self, siteCoordinates, maxDistance=None):
+        """
+        Calculate Rjb, Rrup and Rx between the sites and the ruptures within the integration distance of
+        any of them. Candidates come from the bounding-box index; distances are only computed for those.
+        :param siteCoordinates: Array of sites (longitude, latitude), shape (nSites, 2).
+        :param maxDistance: Integration distance in km, or an integrationDistance. None keeps all ruptures.
+        :return: Indices of the kept ruptures, shape (nKept,), their Rjb, Rrup and Rx, each shape
+        (nSites, nKept), and the mask of the site/rupture pairs within the integration distance.
+        """
+        siteCoordinates = np.atleast_2d(np.asarray(siteCoordinates, dtype=float))
+        if maxDistance is None:
+            distances = self.siteDistanceMatrices(siteCoordinates)
+            return np.arange(len(self.ruptureSet)), distances, np.ones(distances[0].shape, dtype=bool)
+
+        if not isinstance(maxDistance, integrationDistance):
+            maxDistance = integrationDistance(maxDistance)
+        candidates = self.boundingBoxIndex(maxDistance).query(siteCoordinates)
+        ruptureIndex = np.flatnonzero(candidates.any(axis=0))
+
+        distances = self.siteDistanceMatrices(siteCoordinates, ruptureIndex)
+        inRange = candidates[:, ruptureIndex] & (distances[0] <= maxDistance(self.ruptureSet.magnitude[ruptureIndex]))
+
+        return ruptureIndex, distances, inRange
+
+    def siteRuptureSet(self, ruptureIndex, distances):
+        """
+        Rupture set of one site from its kept ruptures and distances, see siteRuptureDistances.
+        """
+        rjb, rrup, rx = distances
+        return self.ruptureSet.subset(ruptureIndex).replace(closestDistance=rjb, ruptureDistance=rrup,
+                                                            strikeNormalDistance=rx)
+
+    def siteRuptureRates(self, sourceRate, ruptureIndex, distances):
+        """
+        Annual rate of each kept rupture, shape (nKept,); the same at every site.
+        """
+        return self.ruptureSet.ruptureRates(sourceRate)[ruptureIndex]
+
+    def closestDistanceMatrix(self, siteCoordinates):
+        """
+        Calculate the closest (Joyner-Boore) distance between each site and each rupture.
+        :param siteCoordinates: Array of sites (longitude, latitude), shape (nSites, 2).
+        :return: Distances in km, shape (nSites, nRuptures).
+        """
+        if self.ruptureSet.ruptureWidth is None:
+            return greatCircleSegmentDistance(siteCoordinates, self.ruptureSet.startingCoordinates,
+                                              self.ruptureSet.endingCoordinates)
+        return self.siteDistanceMatrices(siteCoordinates)[0]
+
+    def ruptureSurfaceMesh(self, index):
+        """
+        Strike x dip mesh of a rupture surface with the mesh spacing of the source, see planarSurfaceMesh. The
+        meshes of the pieces of a rupture are joined along strike.
+        """
+        ruptures = self.ruptureSet
+        startingCoordinates = self.pieceStartingCoordinates[index]
+        endingCoordinates = self.pieceEndingCoordinates[index]
+        # Repeated last pieces are left out.
+        pieces = [0] + [piece for piece in range(1, len(startingCoordinates))
+                        if not np.array_equal(startingCoordinates[piece], startingCoordinates[piece - 1])]
+        meshes = [planarSurfaceMesh(startingCoordinates[piece], endingCoordinates[piece],
+                                    ruptures.ruptureTopDepth[index], ruptures.ruptureWidth[index], self.eqSource.dip,
+                                    self.meshSpace, self.eqSource.seismicDepth[0]) for piece in pieces]
+
+        return (np.concatenate([coordinates for coordinates, _ in meshes], axis=1),
+                np.concatenate([depths for _, depths in meshes], axis=1))
 
@@ -0,0 +1,42 @@
+import numpy as np
+
+class siteCollection():
+
+    def __init__(self, siteCoordinates, soilConditionVs30):
+        self.siteCoordinates = np.atleast_2d(np.asarray(siteCoordinates, dtype=float))
+        # Vs30 of every site; a scalar is shared by all sites.
+        self.soilConditionVs30 = np.broadcast_to(np.asarray(soilConditionVs30, dtype=float),
+                                                 (len(self.siteCoordinates),))
+        self.gridShape = None
+
+    @classmethod
+    def fromGrid(cls, xLimits, yLimits, gridSpace, soilConditionVs30):
+        """
+        Build a regular site grid.
+        :param xLimits: (minimum, maximum) of the first coordinate (longitude).
+        :param yLimits: (minimum, maximum) of the second coordinate (latitude).
+        :param gridSpace: Grid spacing in degrees.
+        :param soilConditionVs30: Vs30 (m/s) of the sites, scalar or one value per site.
+        :return: siteCollection whose sites are ordered row by row.
+        """
+        xValues = np.arange(xLimits[0], xLimits[1] + gridSpace / 2, gridSpace)
+        yValues = np.arange(yLimits[0], yLimits[1] + gridSpace / 2, gridSpace)
+        xGrid, yGrid = np.meshgrid(xValues, yValues)
+
+        sites = cls(np.column_stack([xGrid.ravel(), yGrid.ravel()]), soilConditionVs30)
+        sites.gridShape = xGrid.shape
+
+        return sites
+
+    def __len__(self):
+        return len(self.siteCoordinates)
+
+    def reshapeToGrid(self, values):
+        """
+        Reshape per-site values, shape (nSites, ...), to the grid, shape (nY, nX, ...).
+        """
+        if self.gridShape is None:
+            raise Exception("Site collection is not a grid.")
+
+        values = np.asarray(values)
+        return values.reshape(self.gridShape + values.shape[1:])
@@ -0,0 +1,36 @@
+import json
+import pytest
+from PSHAbatch import *
+
+SCENARIO = {"coordinates": [[28.0, 40.8], [29.5, 40.7]], "seismicDepth": [0, 20], "minMag": 5, "maxMag": 8, "aGR": 4,
+            "bGR": 1, "dip": 90, "rake": 180, "siteCoordinate": [29.2, 41.0], "soilConditionVs30": 300,
+            "IMthresholds": {"start": 0.01, "stop": 2.0, "num": 100}}
+
+@pytest.mark.parametrize("name", ["../outside", "nested/name", "nested\\name", "..", ""])
+def test_scenarioNamesWithPaths(tmp_path, name):
+    path = tmp_path / "scenarios.json"
+    path.write_text(json.dumps([SCENARIO | {"name": "valid-1.0"}, SCENARIO | {"name": name}]))
+
+    with pytest.raises(Exception, match="is not a valid scenario name"):
+        readScenarios(str(path))
+
+def test_defaultScenarioNames(tmp_path):
+    path = tmp_path / "scenarios.jsonl"
+    path.write_text("\n".join(json.dumps(SCENARIO) for _ in range(2)))
+
+    assert [scenario["name"] for scenario in readScenarios(str(path))] == ["scenario_00000", "scenario_00001"]
+
+def test_adaptiveMagnitudeBins(tmp_path):
+    path = tmp_path / "scenarios.json"
+    thresholds = {"start": 0.01, "stop": 1.0, "num": 10}
+    path.write_text(json.dumps([SCENARIO | {"IMthresholds": thresholds, "magnitudeTolerance": tolerance,
+                                            "soilConditionVs30": vs30}
+                                for tolerance in [None, 0.01] for vs30 in [300, 760]]))
+    scenarios = readScenarios(str(path))
+
+    # Uniform bins share the rupture mesh across site conditions; adaptive bins depend on them.
+    assert sourceGroupKey(scenarios[0]) == sourceGroupKey(scenarios[1])
+    assert len({sourceGroupKey(scenario) for scenario in scenarios}) == 3
+
+    summary = runBatch(scenarios[2:3], str(tmp_path / "results"), nWorkers=1)
+    assert [scenario["status"] for scenario in summary] == ["done"]
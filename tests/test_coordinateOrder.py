@@ -0,0 +1,29 @@
+import numpy as np
+from PSHAmainChannel import *
+
+# At latitude 60, one degree of longitude is half as long as one degree of latitude, so points given as
+# (latitude, longitude) would give distances off by a factor of about two.
+KM_PER_DEGREE_LATITUDE = 6371.0 * np.pi / 180
+
+def test_destinationPoint():
+    north = destinationPoint([10.0, 60.0], [KM_PER_DEGREE_LATITUDE], 0.0)
+    east = destinationPoint([10.0, 60.0], [KM_PER_DEGREE_LATITUDE / 2], 90.0)
+
+    assert np.allclose(north, [[10.0, 61.0]], atol=1e-9)
+    assert np.isclose(east[0, 0], 11.0, atol=5e-3) and 59.99 < east[0, 1] < 60.0
+
+def test_greatCircleSegmentDistance():
+    distances = greatCircleSegmentDistance([[11.0, 60.0], [10.0, 62.0]], [[10.0, 59.0]], [[10.0, 61.0]])
+
+    assert np.allclose(distances[:, 0], [KM_PER_DEGREE_LATITUDE / 2, KM_PER_DEGREE_LATITUDE], rtol=2e-3)
+
+def test_hazardMapSiteOrder():
+    # North-south fault at longitude 10; the grid rows run east from it.
+    sites = siteCollection.fromGrid([10.2, 11.0], [59.9, 60.1], 0.2, 760)
+    ruptures, hazardCurves = mainHazardMap_def([[10.0, 59.5], [10.0, 60.5]], [0, 15], 5.0, 7.0, 4.0, 1.0, 90, 180,
+                                               sites, 5.0, 'pga', 'ASB14', np.logspace(-2, 0, 10))
+
+    rowCurves = sites.reshapeToGrid(hazardCurves)[:, :, 3]
+    assert sites.gridShape == (2, 5)
+    assert np.all(np.diff(rowCurves, axis=1) < 0)
+    assert np.allclose(sites.siteCoordinates[0], [10.2, 59.9])
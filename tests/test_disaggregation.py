@@ -0,0 +1,23 @@
+import numpy as np
+from visualizations.disaggregation import *
+
+def test_contributionsOutsideBins():
+    magnitude = np.array([5.0, 6.0, 7.0, 7.0])
+    distance = np.array([[5.0, 250.0, 15.0, 15.0], [5.0, 5.0, 5.0, 5.0]])
+    epsilon = np.array([[0.2, 0.2, 4.0, -0.2], [0.2, 0.2, 0.2, 0.2]])
+    contributions = np.array([[1.0, 5.0, 3.0, 1.0], [0.0, 0.0, 0.0, 0.0]])
+
+    result = disaggregateContributions(magnitude, distance, epsilon, contributions,
+                                       magnitudeBinEdges([5.0, 6.0, 7.0]), DEFAULT_DISTANCE_BINS)
+
+    # The 250 km and epsilon 4 ruptures stay out of the histogram and the modal bin.
+    assert np.allclose(result["histogram"].sum(axis=(1, 2, 3)), [2.0, 0.0])
+    assert np.allclose(result["distanceOutsideShare"][0], 0.5)
+    assert np.allclose(result["epsilonOutsideShare"][0], 0.3)
+    assert result["magnitudeOutsideShare"][0] == 0
+    # The in-range ruptures tie; the first bin is the mode.
+    assert (result["modalMagnitude"][0], result["modalDistance"][0], result["modalEpsilon"][0]) == (5.0, 5.0, 0.25)
+    assert np.isclose(result["meanDistance"][0], (5 + 1250 + 45 + 15) / 10)
+    # No exceedance rate at the second site.
+    assert np.all(np.isnan([result[key][1] for key in ["modalMagnitude", "modalDistance", "modalEpsilon",
+                                                        "meanDistance"]]))
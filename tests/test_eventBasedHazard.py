@@ -0,0 +1,18 @@
+import numpy as np
+from visualizations.eventBasedHazard import eventBasedHazardIntegral
+from visualizations.hazardCurve import hazardIntegral
+
+def test_workersMatchSerialCatalog():
+    rng = np.random.default_rng(3)
+    median = np.exp(rng.normal(-2.5, 0.8, (3, 200)))
+    ruptureRates = rng.uniform(1e-4, 1e-3, 200)
+    imThresholds = np.logspace(-2, 0, 10)
+
+    serial = eventBasedHazardIntegral(median, 0.35, 0.55, ruptureRates, imThresholds, 200_000, seed=7,
+                                      maxChunkElements=20_000)
+    parallel = eventBasedHazardIntegral(median, 0.35, 0.55, ruptureRates, imThresholds, 200_000, seed=7,
+                                        maxChunkElements=20_000, nWorkers=2)
+
+    assert np.array_equal(serial, parallel)
+    classical = hazardIntegral(median, np.hypot(0.35, 0.55), ruptureRates, imThresholds)
+    assert np.allclose(serial[classical > 1e-3], classical[classical > 1e-3], rtol=0.1)
@@ -0,0 +1,21 @@
+import numpy as np
+from gmmFile.gmmASB14 import AkkarEtAlRjb2014
+
+def test_rockPGAPerCall():
+    rng = np.random.default_rng(5)
+    mag = rng.uniform(5, 7.5, (1, 300))
+    rjb = rng.uniform(0, 200, (4, 300))
+    gmm = AkkarEtAlRjb2014()
+
+    # Distances changed in place between calls give the results of a new array.
+    gmm.compute(mag, rjb, 0.0, 300.0, 'pga')
+    rjb[:] = 200.0
+    assert np.array_equal(gmm.compute(mag, rjb, 0.0, 300.0, 'pga')[0],
+                          AkkarEtAlRjb2014().compute(mag, rjb.copy(), 0.0, 300.0, 'pga')[0])
+
+    # A Vs30 sweep with a given rock PGA, and an IMT list, give the results of separate calls.
+    rockPGA = gmm.compute_rock_pga(mag, rjb, 0.0)
+    for vs30 in [200.0, 760.0, np.array([[200.0], [400.0], [760.0], [1200.0]])]:
+        mean = gmm.compute(mag, rjb, 0.0, vs30, ['pga', 1.0], rock_pga=rockPGA)[0]
+        assert np.array_equal(mean[0], gmm.compute(mag, rjb, 0.0, vs30, 'pga')[0])
+        assert np.array_equal(mean[1], gmm.compute(mag, rjb, 0.0, vs30, 1.0)[0])
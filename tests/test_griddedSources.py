@@ -0,0 +1,92 @@
+import numpy as np
+from scipy.special import ndtr
+from PSHAmainChannel import *
+
+AREA_POLYGON = [[29.0, 40.6], [29.4, 40.6], [29.4, 40.9], [29.0, 40.9], [29.0, 40.6]]
+SITES = [[29.2, 40.75], [29.5, 40.8], [29.9, 41.2]]
+
+def bruteForceHazard(eqSourceModeling, mfd, sites, rake, vs30, imts, IMthresholds):
+    # Every rupture centred on every node at every strike, with its Rjb from planarSurfaceDistances.
+    eqSource = eqSourceModeling.eqSource
+    magnScaling = eqSourceModeling.magnScaling
+    nodes, nodeWeights = eqSourceModeling.nodes, eqSourceModeling.nodeWeights
+    gmm = gmmCalculations(None, rake, vs30, imts).getModel('ASB14')
+    lnThresholds = np.log(IMthresholds)
+
+    hazardCurves = np.zeros((len(sites), len(IMthresholds)))
+    for magnitude, pmf, length, width, topDepth in zip(mfd.magRange, mfd.pmfMFD, magnScaling.ruptureLength,
+                                                       magnScaling.ruptureWidth, magnScaling.ruptureTopDepth):
+        for strike in eqSource.strikes:
+            # The trace is moved against the dip direction so that the surface projection is centred.
+            centres = destinationPoint(nodes, np.full(len(nodes), width * np.cos(np.radians(eqSource.dip)) / 2),
+                                       strike - 90)
+            starts = destinationPoint(centres, np.full(len(nodes), length / 2), strike + 180)
+            ends = destinationPoint(centres, np.full(len(nodes), length / 2), strike)
+            # The trace is the top edge of the rupture, so the surface projection starts on it.
+            rjb, _, _ = planarSurfaceDistances(sites, starts, ends, np.full(len(nodes), topDepth),
+                                               np.full(len(nodes), width), eqSource.dip, topDepth)
+
+            mean, tau, phi, sig = gmm.compute(np.full(rjb.shape, magnitude), rjb, rake, vs30, imts)
+            exceedance = ndtr((mean[..., None] - lnThresholds) / sig)
+            hazardCurves += (mfd.sourceRate * pmf / len(eqSource.strikes) *
+                             np.tensordot(nodeWeights, exceedance, axes=([0], [1])))
+
+    return hazardCurves
+
+def test_areaSourceHazardAgainstBruteForce():
+    rake, vs30, imts = 90, 400, 'pga'
+    IMthresholds = np.logspace(-2, 0, 15)
+    sites = siteCollection(SITES, vs30)
+
+    ruptures, hazardCurves = mainHazardMap_def(AREA_POLYGON, [0, 20], 5.0, 7.0, 4.0, 1.0, 60, rake, sites, 5.0,
+                                               imts, 'ASB14', IMthresholds)
+
+    eqSource = sourceStage(AREA_POLYGON, [0, 20], 60, rake)
+    mfd = mfdStage(5.0, 7.0, 4.0, 1.0)
+    eqSourceModeling = meshStage(eqSource, mfd, scalingStage(eqSource, mfd, cache=None), 5.0, cache=None)
+    expected = bruteForceHazard(eqSourceModeling, mfd, np.asarray(SITES), rake, vs30, imts, IMthresholds)
+
+    # Epicentral and Joyner-Boore distances are both shared between the grid distances of the table, which
+    # overestimates the tails of distant sites; about 3% at 1e-4 and 12% at 1e-5 for the last site.
+    significant = expected > 1e-4
+    assert significant.sum() > 20
+    assert np.allclose(hazardCurves[significant], expected[significant], rtol=4e-2)
+
+def test_fineDistanceTableAgainstBruteForce():
+    rake, vs30, imts = 90, 400, 'pga'
+    IMthresholds = np.logspace(-2, 0, 15)
+    eqSource = sourceStage(AREA_POLYGON, [0, 20], 60, rake)
+    mfd = mfdStage(5.0, 7.0, 4.0, 1.0)
+    magnScaling = scalingStage(eqSource, mfd, cache=None)
+
+    eqSourceModeling = griddedSourcesModeling(eqSource, mfd, magnScaling, 5.0,
+                                              np.concatenate([[0.0], np.geomspace(1.0, 500.0, 301)]))
+    eqSourceModeling.ruptureProps()
+    ruptureIndex, distances, inRange = eqSourceModeling.siteRuptureDistances(SITES)
+    gmmCalc = gmmCalculations(eqSourceModeling, rake, vs30, imts)
+    median, tau, phi, sig = gmmCalc.getGMIMMatrix('ASB14', distances[0], ruptureIndex=ruptureIndex)
+    ruptureRates = eqSourceModeling.siteRuptureRates(mfd.sourceRate, ruptureIndex, distances)
+    hazardCurves = hazardIntegral(median, sig, ruptureRates, IMthresholds, siteRates=True)
+
+    expected = bruteForceHazard(eqSourceModeling, mfd, np.asarray(SITES), rake, vs30, imts, IMthresholds)
+    significant = expected > 1e-7
+    assert np.allclose(hazardCurves[significant], expected[significant], rtol=1e-2)
+
+def test_pointSourceHazardAgainstBruteForce():
+    rake, vs30, imts = -90, 760, 'pga'
+    IMthresholds = np.logspace(-2, 0, 15)
+    point, sites = [[29.2, 40.75]], [[29.25, 40.75], [29.2, 40.85], [29.5, 40.9]]
+
+    ruptures, hazardCurves = mainHazardMap_def(point, [0, 15], 5.0, 7.0, 3.5, 1.0, 50, rake,
+                                               siteCollection(sites, vs30), 5.0, imts, 'ASB14', IMthresholds,
+                                               strikes=[45.0])
+
+    eqSource = sourceStage(point, [0, 15], 50, rake, [45.0])
+    mfd = mfdStage(5.0, 7.0, 3.5, 1.0)
+    eqSourceModeling = meshStage(eqSource, mfd, scalingStage(eqSource, mfd, cache=None), 5.0, cache=None)
+    expected = bruteForceHazard(eqSourceModeling, mfd, np.asarray(sites), rake, vs30, imts, IMthresholds)
+
+    # A single strike; the error of the distance table is that of test_areaSourceHazardAgainstBruteForce.
+    significant = expected > 1e-4
+    assert significant.sum() > 20
+    assert np.allclose(hazardCurves[significant], expected[significant], rtol=4e-2)
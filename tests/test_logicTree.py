@@ -0,0 +1,41 @@
+import numpy as np
+from PSHAlogicTree import *
+
+def test_hazardCurveStatistics():
+    rng = np.random.default_rng(1)
+    curves = 10 ** rng.uniform(-14, 0, (37, 6, 4))
+    # Zero rates of most branches at the first site.
+    curves[:25, 0] = 0
+    weights = rng.uniform(0.1, 1, 37)
+
+    statistics = hazardCurveStatistics((6, 4), 37, maxChunkElements=50)
+    for start in range(0, 37, 5):
+        statistics.add(curves[start:start + 5], weights[start:start + 5])
+    fractiles = statistics.fractiles([0.16, 0.5, 0.84])
+
+    assert np.allclose(statistics.mean(), np.tensordot(weights, curves, 1) / weights.sum())
+    for quantile, values in fractiles.items():
+        order = np.argsort(curves, axis=0)
+        cumulative = np.cumsum(weights[order], axis=0)
+        rank = (cumulative < quantile * weights.sum() * (1 - 1e-12)).sum(axis=0)
+        expected = np.take_along_axis(np.take_along_axis(curves, order, axis=0), rank[None], axis=0)[0]
+        assert np.array_equal(values, expected)
+    assert np.all(fractiles[0.5][0] == 0)
+    statistics.close()
+
+def test_adaptiveMagnitudeBins():
+    tree = logicTree([((4.0, 1.0), 0.5), ((3.6, 0.9), 0.5)], [(7.5, 1.0)])
+    sites = siteCollection([[29.2, 40.75], [29.6, 40.9]], [300.0, 760.0])
+    IMthresholds = np.logspace(-2, 0, 10)
+    run = lambda tolerance: runLogicTree(tree, [[28.8, 40.7], [29.6, 40.75]], [0, 20], 5.0, 90, 180, sites, 5.0,
+                                         'pga', IMthresholds, nWorkers=1, magnitudeTolerance=tolerance)[0]
+
+    # The shared bins hold those of every rate branch and site Vs30.
+    edges = adaptiveMagnitudeEdges(tree, 5.0, 7.5, 180, sites, 'pga', IMthresholds, 0.01)
+    exceedance = magnitudeExceedance('ASB14', IMthresholds, REFERENCE_DISTANCES, 180, 300.0, 'pga')
+    assert np.all(np.isin(DoublyBoundedGRModel.adaptive(5.0, 7.5, 3.6, 0.9, exceedance, 0.01).magBinEdges, edges))
+
+    # Against much finer bins; the rupture geometry of a bin adds to the error controlled by the tolerance.
+    reference, meanCurves = run(0.001), run(0.01)
+    significant = reference > 1e-6
+    assert np.allclose(meanCurves[significant], reference[significant], rtol=3e-2)
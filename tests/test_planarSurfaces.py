@@ -0,0 +1,31 @@
+import numpy as np
+from PSHAmainChannel import *
+
+def greatCircleLength(start, end):
+    # Independent haversine length in km of the great circle between points (longitude, latitude).
+    start, end = np.radians(start), np.radians(end)
+    a = (np.sin((end[..., 1] - start[..., 1]) / 2) ** 2 +
+         np.cos(start[..., 1]) * np.cos(end[..., 1]) * np.sin((end[..., 0] - start[..., 0]) / 2) ** 2)
+    return 2 * 6371.0 * np.arcsin(np.sqrt(a))
+
+def test_planarDistancesAgainstSurfaceMesh():
+    eqSource = sourceStage([[29.0, 40.7], [29.6, 40.75]], [2, 20], 45, 90)
+    mfd = mfdStage(6.0, 6.5, 4, 1)
+    eqSourceModeling = meshStage(eqSource, mfd, scalingStage(eqSource, mfd, cache=None), 0.25, cache=None)
+    # Footwall, hanging wall, above the surface and beyond the ends of the ruptures.
+    sites = np.array([[29.3, 40.6], [29.3, 40.8], [29.3, 40.73], [28.8, 40.7], [29.9, 40.9]])
+    rjb, rrup, rx = eqSourceModeling.siteDistanceMatrices(sites)
+    # The fault dips south, to the right of its strike, so the southern site is on the hanging wall.
+    assert np.all(rx[0] > 0) and np.all(rx[1] < 0)
+
+    R = 6371.0
+    siteVectors = R * unitVectors(sites)
+    for index in np.linspace(0, len(eqSourceModeling.ruptureSet) - 1, 12).astype(int):
+        coordinates, depths = eqSourceModeling.ruptureSurfaceMesh(index)
+        nodes = ((R - depths)[..., None] * unitVectors(coordinates)).reshape(-1, 3)
+        nodeRrup = np.linalg.norm(siteVectors[:, None] - nodes, axis=-1).min(axis=1)
+        nodeRjb = greatCircleLength(sites[:, None], coordinates.reshape(1, -1, 2)).min(axis=1)
+
+        # Nodes are at most half a diagonal of a 0.25 km mesh cell away from the closest point.
+        assert np.all(nodeRrup >= rrup[:, index] - 1e-6) and np.allclose(nodeRrup, rrup[:, index], atol=0.2)
+        assert np.allclose(nodeRjb, rjb[:, index], atol=0.2)
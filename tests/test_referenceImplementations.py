@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from PSHAmainChannel import *
+
+# The reference implementations need pandas, scipy, shapely and geopy.
+reference = pytest.importorskip("benchmarks.referenceImplementations")
+
+# Fault scenario of main.py and the benchmarks, with a smaller magnitude range.
+SCENARIO = dict(coordinates=[[28.0, 40.8], [29.5, 40.7]], seismicDepth=[0, 20], minMag=5.0, maxMag=7.5, aGR=4.0,
+                bGR=1.0, dip=90, rake=180, siteCoordinate=[29.2, 41.0], soilConditionVs30=300, imts='pga')
+
+@pytest.fixture(scope="module")
+def scenarioRuptures():
+    s = SCENARIO
+    eqSource = sourceStage(s["coordinates"], s["seismicDepth"], s["dip"], s["rake"])
+    mfd = mfdStage(s["minMag"], s["maxMag"], s["aGR"], s["bGR"])
+    eqSourceModeling = meshStage(eqSource, mfd, scalingStage(eqSource, mfd, cache=None), 5.0, cache=None)
+    eqSourceModeling.calculateClosestDistance(s["siteCoordinate"])
+
+    return eqSourceModeling, mfd, reference.referenceRuptureProps(eqSourceModeling)
+
+def test_ruptureProps(scenarioRuptures):
+    eqSourceModeling, mfd, ruptureDataframe = scenarioRuptures
+    ruptures = eqSourceModeling.ruptureSet
+
+    assert len(ruptureDataframe) == len(ruptures)
+    assert np.allclose(ruptureDataframe["Magnitude"].astype(float), ruptures.magnitude)
+    assert np.allclose(ruptureDataframe["P(M=m)"].astype(float), ruptures.magnitudePMF)
+    assert np.allclose(ruptureDataframe["P(R=r|m)"].astype(float), ruptures.distancePMF)
+    assert np.array_equal(np.array(ruptureDataframe["Starting coordinate"].tolist()), ruptures.startingCoordinates)
+    # The reference steps to the rupture end from its start at the initial strike of the trace, which drifts
+    # off the trace great circle by a few 1e-3 degrees; the current mesh steps from the trace point.
+    assert np.allclose(np.array(ruptureDataframe["Ending coordinate"].tolist()), ruptures.endingCoordinates,
+                       atol=5e-3)
+
+def test_closestDistance(scenarioRuptures):
+    eqSourceModeling, mfd, ruptureDataframe = scenarioRuptures
+    frame = ruptureDataframe.copy()
+    reference.referenceClosestDistance(frame, SCENARIO["siteCoordinate"])
+
+    # The reference projects the site on the trace in degrees and measures the geodesic (ellipsoid) distance to
+    # that point, which is about 1% off the closest point; the current Rjb is that of the vertical surfaces.
+    assert np.allclose(frame["Closest Distance"], eqSourceModeling.ruptureSet.closestDistance, rtol=1.5e-2)
+
+def test_getGMIMAndHazardCurve(scenarioRuptures):
+    eqSourceModeling, mfd, ruptureDataframe = scenarioRuptures
+    s = SCENARIO
+    # The reference evaluates the thresholds rounded to 4 decimals.
+    imThresholds = np.round(np.logspace(-2, 0.3, 20), 4)
+
+    gmmCalc = gmmCalculations(eqSourceModeling, s["rake"], s["soilConditionVs30"], s["imts"])
+    gmmCalc.getGMIM('ASB14')
+    ruptures = eqSourceModeling.ruptureSet
+
+    # The reference GMM and hazard loop run on the current distances.
+    frame = ruptureDataframe.copy()
+    frame["Closest Distance"] = ruptures.closestDistance
+    reference.referenceGetGMIM(frame, s["rake"], s["soilConditionVs30"], s["imts"])
+    assert np.allclose(frame["IM median"], ruptures.imMedian, rtol=1e-10)
+    assert np.allclose(frame["Total Residual"], ruptures.totalSigma, rtol=1e-10)
+
+    assert np.allclose(reference.referenceHazardCurve(frame, mfd, imThresholds),
+                       hazardCurveCalculator(ruptures, mfd, imThresholds), rtol=1e-8, atol=1e-15)
@@ -0,0 +1,12 @@
+import numpy as np
+from PSHAresultStore import saveResult, resultStore
+
+def test_thresholdsAtFullPrecision(tmp_path):
+    # Thresholds from the lowest lower limit of the app.
+    imThresholds = np.logspace(-4, 0.3, 100)
+    hazardCurves = np.exp(-np.outer([1.0, 2.0], imThresholds))
+    saveResult(str(tmp_path / "result"), imThresholds, hazardCurves, [[29.2, 41.0], [29.3, 41.0]], 400)
+
+    store = resultStore(str(tmp_path / "result"))
+    assert np.array_equal(store.imThresholds, imThresholds)
+    assert np.array_equal(store.siteCurve(1), hazardCurves[1])
@@ -0,0 +1,56 @@
+import numpy as np
+from PSHAmainChannel import *
+
+# Bent trace of the PSHAsourceModel example, points (longitude, latitude).
+BENT_TRACE = [[29.0, 40.72], [29.9, 40.75], [30.6, 40.70]]
+
+def greatCircleLength(start, end):
+    # Independent haversine length in km of the great circle between points (longitude, latitude).
+    start, end = np.radians(start), np.radians(end)
+    lon1, lat1, lon2, lat2 = start[..., 0], start[..., 1], end[..., 0], end[..., 1]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * np.arcsin(np.sqrt(a))
+
+def test_faultLengthAndStrikes():
+    eqSource = sourceStage(BENT_TRACE, [0, 20], 90, 180)
+    vertices = np.asarray(BENT_TRACE)
+
+    assert np.isclose(eqSource.faultLength, greatCircleLength(vertices[:-1], vertices[1:]).sum())
+    assert np.isclose(eqSource.faultLength, 135.15, atol=0.01)
+    # Both segments run roughly east.
+    assert 85 < eqSource.segmentStrikes[0] < 90 and 90 < eqSource.segmentStrikes[1] < 100
+
+def test_bentRuptureLengths():
+    eqSource = sourceStage(BENT_TRACE, [0, 20], 60, 90)
+    mfd = mfdStage(5, 7.5, 4, 1)
+    eqSourceModeling = meshStage(eqSource, mfd, scalingStage(eqSource, mfd, cache=None), 5.0, cache=None)
+    ruptures = eqSourceModeling.ruptureSet
+
+    # Repeated last pieces have no length of their own.
+    pieceLengths = greatCircleLength(eqSourceModeling.pieceStartingCoordinates, eqSourceModeling.pieceEndingCoordinates)
+    repeated = np.zeros(pieceLengths.shape, dtype=bool)
+    repeated[:, 1:] = np.all(eqSourceModeling.pieceStartingCoordinates[:, 1:] ==
+                             eqSourceModeling.pieceStartingCoordinates[:, :-1], axis=-1)
+    ruptureLengths = np.where(repeated, 0.0, pieceLengths).sum(axis=1)
+
+    expected = np.repeat(eqSourceModeling.magnScaling.ruptureLength, np.diff(ruptures.magnitudeOffsets))
+    # Rupture ends are rounded to 1e-4 degrees.
+    assert np.allclose(ruptureLengths, expected, atol=0.03)
+    assert (~repeated).sum(axis=1).max() == 2
+
+def test_bentRuptureEndsOnTrace():
+    eqSource = sourceStage(BENT_TRACE, [0, 20], 90, 180)
+    mfd = mfdStage(5, 7.0, 4, 1)
+    eqSourceModeling = meshStage(eqSource, mfd, scalingStage(eqSource, mfd, cache=None), 5.0, cache=None)
+    vertices = np.asarray(BENT_TRACE)
+
+    # Ruptures shorter than the mesh spacing overhang the trace ends, see meshFaultSource.
+    ruptures = eqSourceModeling.ruptureSet
+    startDistances, _ = eqSourceModeling.meshFaultSource()
+    ruptureLengths = np.repeat(eqSourceModeling.magnScaling.ruptureLength, np.diff(ruptures.magnitudeOffsets))
+    inside = (startDistances >= 0) & (startDistances + ruptureLengths <= eqSource.faultLength)
+
+    ends = np.concatenate([ruptures.startingCoordinates[inside], ruptures.endingCoordinates[inside]])
+    distances = greatCircleSegmentDistance(ends, vertices[:-1], vertices[1:]).min(axis=1)
+    # Rupture ends are rounded to 1e-4 degrees.
+    assert distances.max() < 0.02
@@ -0,0 +1,152 @@
+import numpy as np
+from visualizations.hazardCurve import hazardMapValues
+
+DEFAULT_EPSILON_BINS = np.arange(-3.0, 3.5, 0.5)
+DEFAULT_DISTANCE_BINS = np.arange(0.0, 210.0, 10.0)
+
+def magnitudeBinEdges(magRange):
+    # Bin edges centred on the magnitudes of the MFD.
+    magRange = np.asarray(magRange, dtype=float)
+    midPoints = (magRange[1:] + magRange[:-1]) / 2
+    return np.concatenate([[magRange[0] - (midPoints[0] - magRange[0])], midPoints,
+                           [magRange[-1] + (magRange[-1] - midPoints[-1])]])
+
+def _binIndex(values, bins):
+    # Index of the bin holding each value, and the mask of the values within the bins. The last edge
+    # belongs to the last bin.
+    index = np.searchsorted(bins, values, side='right') - 1
+    inside = (values >= bins[0]) & (values <= bins[-1])
+    return np.clip(index, 0, len(bins) - 2), inside
+
+def disaggregateContributions(magnitude, distance, epsilon, contributions, magnitudeBins, distanceBins,
+                              epsilonBins=DEFAULT_EPSILON_BINS):
+    """
+    Bin the exceedance rate contributed by each rupture into magnitude, distance and epsilon.
+    :param magnitude: Rupture magnitudes, shape (nRuptures,).
+    :param distance: Rupture distances in km, shape (nRuptures,) or (nSites, nRuptures).
+    :param epsilon: Epsilon of the target IM level, same shape as distance.
+    :param contributions: Exceedance rate contributed by each rupture, same shape as distance.
+    :return: Dictionary with the joint histogram, shape (..., nM, nR, nE), the mean and modal magnitude,
+    distance and epsilon of each site, and the share of the exceedance rate of each site outside the
+    magnitude, distance and epsilon bins. That share is left out of the histogram and the modal values;
+    the mean values include it. Sites without exceedance rate have NaN mean and modal values.
+    """
+    contributions = np.asarray(contributions, dtype=float)
+    siteShape = contributions.shape[:-1]
+    nSites = int(np.prod(siteShape, dtype=int))
+    nM, nR, nE = len(magnitudeBins) - 1, len(distanceBins) - 1, len(epsilonBins) - 1
+
+    magnitude = np.broadcast_to(magnitude, contributions.shape)
+    distance = np.broadcast_to(distance, contributions.shape)
+    epsilon = np.broadcast_to(epsilon, contributions.shape)
+
+    magnitudeIndex, magnitudeInside = _binIndex(magnitude, magnitudeBins)
+    distanceIndex, distanceInside = _binIndex(distance, distanceBins)
+    epsilonIndex, epsilonInside = _binIndex(epsilon, epsilonBins)
+    inside = magnitudeInside & distanceInside & epsilonInside
+
+    # Joint histogram of all sites with a single bincount over the flat (site, M, R, eps) bin index.
+    siteIndex = np.arange(nSites).reshape(siteShape + (1,))
+    flatIndex = ((siteIndex * nM + magnitudeIndex) * nR + distanceIndex) * nE + epsilonIndex
+    histogram = np.bincount(flatIndex.ravel(), weights=np.where(inside, contributions, 0).ravel(),
+                            minlength=nSites * nM * nR * nE).reshape(siteShape + (nM, nR, nE))
+
+    total = contributions.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        meanMagnitude = (contributions * magnitude).sum(axis=-1) / total
+        meanDistance = (contributions * distance).sum(axis=-1) / total
+        meanEpsilon = (contributions * epsilon).sum(axis=-1) / total
+        outsideShares = [np.where(binInside, 0, contributions).sum(axis=-1) / total
+                         for binInside in (magnitudeInside, distanceInside, epsilonInside)]
+
+    # Sites whose contributions all fall outside the bins have no modal values either.
+    hasModal = histogram.reshape(siteShape + (-1,)).max(axis=-1, initial=0) > 0
+    modalIndex = np.unravel_index(histogram.reshape(siteShape + (-1,)).argmax(axis=-1), (nM, nR, nE))
+    binCenter = lambda bins, index: np.where(hasModal, (np.asarray(bins)[index] + np.asarray(bins)[index + 1]) / 2,
+                                             np.nan)
+
+    return {
+        "histogram": histogram,
+        "totalRate": total,
+        "meanMagnitude": meanMagnitude,
+        "meanDistance": meanDistance,
+        "meanEpsilon": meanEpsilon,
+        "modalMagnitude": binCenter(magnitudeBins, modalIndex[0]),
+        "modalDistance": binCenter(distanceBins, modalIndex[1]),
+        "modalEpsilon": binCenter(epsilonBins, modalIndex[2]),
+        "magnitudeOutsideShare": outsideShares[0],
+        "distanceOutsideShare": outsideShares[1],
+        "epsilonOutsideShare": outsideShares[2],
+        "magnitudeBins": np.asarray(magnitudeBins),
+        "distanceBins": np.asarray(distanceBins),
+        "epsilonBins": np.asarray(epsilonBins),
+    }
+
+def disaggregationCalculator(ruptures, imThresholds, rateExceedance, contributions, targetRate,
+                             magnitudeBins, distanceBins, epsilonBins=DEFAULT_EPSILON_BINS):
+    """
+    Disaggregate a site's hazard at a target annual rate of exceedance, reusing the per-rupture
+    contributions returned by hazardCurveCalculator(..., returnContributions=True).
+    """
+    imThresholdList = np.asarray(imThresholds, dtype=float)
+    imLevel = hazardMapValues(imThresholdList, rateExceedance, [targetRate])[0]
+    if np.isnan(imLevel):
+        raise Exception("Target rate is outside the computed hazard curve.")
+
+    # Interpolate the contributions between the thresholds bracketing the IM level.
+    lnThresholds = np.log(imThresholdList)
+    upper = np.clip(np.searchsorted(lnThresholds, np.log(imLevel)), 1, len(lnThresholds) - 1)
+    fraction = (np.log(imLevel) - lnThresholds[upper - 1]) / (lnThresholds[upper] - lnThresholds[upper - 1])
+    contributionsAtLevel = ((1 - fraction) * contributions[..., upper - 1] +
+                            fraction * contributions[..., upper])
+
+    epsilon = (np.log(imLevel) - np.log(ruptures.imMedian)) / ruptures.totalSigma
+    result = disaggregateContributions(ruptures.magnitude, ruptures.closestDistance, epsilon,
+                                       contributionsAtLevel, magnitudeBins, distanceBins, epsilonBins)
+    result["imLevel"] = imLevel
+
+    return result
+
+def disaggregationAtIMLevel(magnitude, distance, median, totalSigma, ruptureRates, imLevel,
+                            magnitudeBins, distanceBins, epsilonBins=DEFAULT_EPSILON_BINS):
+    """
+    Disaggregate many sites at once at given IM levels, e.g. the hazard-map values of a target rate.
+    :param distance: Distances, shape (nSites, nRuptures).
+    :param median: IM medians, shape (nSites, nRuptures).
+    :param imLevel: IM level of each site, shape (nSites,).
+    """
+    from scipy.special import ndtr
+
+    lnLevel = np.log(np.asarray(imLevel, dtype=float))[..., None]
+    with np.errstate(divide='ignore'):
+        epsilon = (lnLevel - np.log(median)) / totalSigma
+    contributions = ruptureRates * ndtr(-epsilon)
+    # Sites whose curve does not reach the target rate and pairs with a zero median (beyond the
+    # integration distance) have no disaggregation.
+    contributions[np.isnan(contributions)] = 0
+    epsilon[~np.isfinite(epsilon)] = 0
+
+    result = disaggregateContributions(magnitude, distance, epsilon, contributions, magnitudeBins,
+                                       distanceBins, epsilonBins)
+    result["imLevel"] = np.asarray(imLevel, dtype=float)
+
+    return result
+
+def plotDisaggregation(result):
+    import matplotlib.pyplot as plt
+
+    # Shares of the whole exceedance rate; the part outside the bins is given in the title.
+    histogram = result["histogram"].sum(axis=-1) / result["totalRate"]
+
+    # Create the plot
+    fig, ax = plt.subplots(figsize=(6, 6), dpi=300)
+    mesh = ax.pcolormesh(result["distanceBins"], result["magnitudeBins"], histogram, cmap='Reds')
+    ax.scatter(result["meanDistance"], result["meanMagnitude"], marker='x', color='k', label='Mean')
+    fig.colorbar(mesh, ax=ax, label='Contribution to hazard')
+    ax.set_title('Disaggregation (IM = {:.4g}, {:.1%} outside the bins)'.format(result["imLevel"],
+                                                                                1 - histogram.sum()))
+    ax.set_xlabel('Distance (km)')
+    ax.set_ylabel('Magnitude')
+    ax.legend()
+
+    return fig
@@ -0,0 +1,107 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+def _chunkPlan(ruptureRates, nSites, investigationYears, maxChunkElements):
+    # Years per chunk so that the expected (sites x events) block stays under maxChunkElements.
+    eventsPerYear = max(float(np.sum(ruptureRates)), 1e-300)
+    chunkYears = max(1.0, np.floor(maxChunkElements / (eventsPerYear * nSites)))
+    nChunks = int(np.ceil(investigationYears / chunkYears))
+    years = np.full(nChunks, chunkYears)
+    years[-1] = investigationYears - chunkYears * (nChunks - 1)
+
+    return years
+
+def simulateCatalogChunk(lnMedian, tau, phi, ruptureRates, years, seed):
+    """
+    Sample the events of one catalog chunk and their ground motions.
+    :param lnMedian: ln of IM medians, shape (nSites, nRuptures).
+    :param tau: Between-event standard deviation, a scalar or one value per row of lnMedian.
+    :param phi: Within-event standard deviation, a scalar or one value per row of lnMedian.
+    :param years: Length of the chunk in years.
+    :param seed: Seed (or SeedSequence) of the chunk.
+    :return: Rupture index of each event, shape (nEvents,), and ln(IM), shape (nSites, nEvents).
+    """
+    rng = np.random.default_rng(seed)
+    tau, phi = np.reshape(tau, (-1, 1)), np.reshape(phi, (-1, 1))
+
+    # Poissonian number of occurrences of each rupture in the chunk.
+    eventRuptures = np.repeat(np.arange(len(ruptureRates)), rng.poisson(ruptureRates * years))
+
+    # Between-event residual is shared by all sites of an event, within-event residual is per site.
+    betweenEvent = tau * rng.standard_normal(len(eventRuptures))
+    withinEvent = phi * rng.standard_normal((lnMedian.shape[0], len(eventRuptures)))
+
+    return eventRuptures, lnMedian[:, eventRuptures] + betweenEvent + withinEvent
+
+# Arrays of the catalog being simulated in a worker process, set once by _initCatalogWorker.
+_WORKER_CATALOG = None
+
+def _initCatalogWorker(*catalog):
+    # Initializer of the worker processes, so that the arrays are not sent with every chunk.
+    global _WORKER_CATALOG
+    _WORKER_CATALOG = catalog
+
+def _countExceedances(catalog, years, seed):
+    # Number of events exceeding each threshold at each site in one chunk.
+    lnMedian, tau, phi, ruptureRates, lnThresholds = catalog
+    eventRuptures, lnIM = simulateCatalogChunk(lnMedian, tau, phi, ruptureRates, years, seed)
+
+    # An event exceeds the thresholds below its IM; count events per (site, number of thresholds exceeded).
+    nSites, nThresholds = lnMedian.shape[0], len(lnThresholds)
+    exceeded = np.searchsorted(lnThresholds, lnIM, side='left')
+    flatIndex = np.arange(nSites)[:, None] * (nThresholds + 1) + exceeded
+    counts = np.bincount(flatIndex.ravel(), minlength=nSites * (nThresholds + 1)).reshape(nSites, nThresholds + 1)
+
+    return np.cumsum(counts[:, ::-1], axis=1)[:, ::-1][:, 1:]
+
+def _countWorkerExceedances(task):
+    # _countExceedances of a (years, seed) task on the catalog of the worker; top-level for worker processes.
+    return _countExceedances(_WORKER_CATALOG, *task)
+
+def eventBasedHazardIntegral(median, tau, phi, ruptureRates, imThresholds, investigationYears=1_000_000,
+                             seed=42, maxChunkElements=2_000_000, nWorkers=1):
+    """
+    Empirical annual rate of exceeding each IM threshold from a stochastic event catalog.
+    :param median: IM medians, shape (nRuptures,) or (nSites, nRuptures); rows may also be IMTs.
+    :param tau: Between-event standard deviation, a scalar or one value per row of median.
+    :param phi: Within-event standard deviation, a scalar or one value per row of median.
+    :param ruptureRates: Annual rate of each rupture, shape (nRuptures,).
+    :param imThresholds: IM threshold values, shape (nThresholds,).
+    :param investigationYears: Length of the synthetic catalog in years.
+    :param seed: Seed of the catalog; chunk seeds are spawned from it, so results do not depend on nWorkers.
+    :param maxChunkElements: Upper bound of the expected (sites x events) block of a chunk.
+    :param nWorkers: Number of worker processes for the chunks.
+    :return: Annual rate of exceedance, shape (nThresholds,) or (nSites, nThresholds).
+    """
+    lnMedian = np.log(np.asarray(median, dtype=float))
+    singleSite = lnMedian.ndim == 1
+    lnMedian = np.atleast_2d(lnMedian)
+    ruptureRates = np.asarray(ruptureRates, dtype=float)
+    lnThresholds = np.log(np.asarray(imThresholds, dtype=float))
+
+    years = _chunkPlan(ruptureRates, lnMedian.shape[0], investigationYears, maxChunkElements)
+    seeds = np.random.SeedSequence(seed).spawn(len(years))
+    catalog = (lnMedian, tau, phi, ruptureRates, lnThresholds)
+
+    # Chunks are reduced as they are produced, so memory does not grow with the catalog length. Workers
+    # receive the catalog arrays once, and each task only holds its length and seed.
+    exceedanceCounts = np.zeros((lnMedian.shape[0], len(lnThresholds)), dtype=np.int64)
+    if nWorkers == 1:
+        for chunkYears, chunkSeed in zip(years, seeds):
+            exceedanceCounts += _countExceedances(catalog, chunkYears, chunkSeed)
+    else:
+        with ProcessPoolExecutor(max_workers=nWorkers, initializer=_initCatalogWorker, initargs=catalog) as executor:
+            for counts in executor.map(_countWorkerExceedances, zip(years, seeds)):
+                exceedanceCounts += counts
+
+    rateExceedance = exceedanceCounts / investigationYears
+    return rateExceedance[0] if singleSite else rateExceedance
+
+def eventBasedHazardCalculator(ruptures, mfd, imThresholds, investigationYears=1_000_000, seed=42,
+                               maxChunkElements=2_000_000, nWorkers=1):
+
+    imThresholdList = np.asarray(imThresholds, dtype=float)
+    ruptureRates = ruptures.ruptureRates(mfd.sourceRate)
+
+    return eventBasedHazardIntegral(ruptures.imMedian, ruptures.tau, ruptures.phi, ruptureRates, imThresholdList,
+                                    investigationYears, seed, maxChunkElements, nWorkers)
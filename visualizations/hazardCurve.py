@@ -1,28 +1,284 @@
 import numpy as np
-from scipy.stats import norm
-import matplotlib.pyplot as plt
 
-def hazardCurveCalculator(ruptureDataframe, mfd, imThresholds, imts):
+def hazardIntegral(median, totalSigma, ruptureRates, imThresholds, maxChunkElements=2_000_000,
+                   returnContributions=False, siteRates=False):
+    """
+    Annual rate of exceeding each IM threshold, summed over ruptures.
+    :param median: IM medians, shape (nRuptures,) or (nSites, nRuptures).
+    :param totalSigma: Total residual, scalar or broadcastable to median.
+    :param ruptureRates: Annual rate of each rupture, shape (nRuptures,), or (nBranches, nRuptures) to
+    integrate several rate models at once; the curves then get a (nBranches,) axis before the thresholds.
+    :param imThresholds: IM threshold values, shape (nThresholds,).
+    :param maxChunkElements: Upper bound of the (sites x ruptures x thresholds) block held in memory.
+    :param returnContributions: Also return the exceedance rate of each rupture, e.g. for disaggregation.
+    :param siteRates: ruptureRates has the shape of median, a rate per site and rupture, e.g. of gridded sources.
+    :return: Annual rate of exceedance, shape (nThresholds,) or (nSites, nThresholds), and with
+    returnContributions the per-rupture rates, shape (nRuptures, nThresholds) or (nSites, nRuptures, nThresholds).
+    """
+    from scipy.special import ndtr
 
-    median = ruptureDataframe['IM median'].values
-    totalSigma = ruptureDataframe['Total Residual'].values
-    magnitudePMFs = ruptureDataframe["P(M=m)"].values
-    distancePMFs = ruptureDataframe["P(R=r|m)"].values
+    # Zero medians, e.g. of ruptures beyond the integration distance, do not contribute.
+    with np.errstate(divide='ignore'):
+        lnMedian = np.log(np.asarray(median, dtype=float))
+    totalSigma = np.broadcast_to(np.asarray(totalSigma, dtype=float), lnMedian.shape)
+    ruptureRates = np.asarray(ruptureRates, dtype=float)
+    lnThresholds = np.log(np.asarray(imThresholds, dtype=float))
 
-    imThresholdList = np.round(imThresholds, 4)
+    nRuptures = lnMedian.shape[-1]
+    blockSize = int(np.prod(lnMedian.shape[:-1], dtype=int)) * len(lnThresholds)
+    chunkSize = max(1, maxChunkElements // max(blockSize, 1))
 
-    probExceedanceList = []
-    for imThreshold in imThresholdList:
+    rateExceedance = np.zeros(lnMedian.shape[:-1] + (() if siteRates else ruptureRates.shape[:-1]) +
+                              lnThresholds.shape)
+    contributions = np.empty(lnMedian.shape + lnThresholds.shape) if returnContributions else None
+    for start in range(0, nRuptures, chunkSize):
+        stop = min(start + chunkSize, nRuptures)
+        # P(IM > im | m, r) = 1 - Phi((ln(im) - ln(median)) / sigma), evaluated in place.
+        z = lnMedian[..., start:stop, None] - lnThresholds
+        z /= totalSigma[..., start:stop, None]
+        ndtr(z, out=z)
+        if siteRates:
+            rateExceedance += (ruptureRates[..., None, start:stop] @ z)[..., 0, :]
+        else:
+            rateExceedance += ruptureRates[..., start:stop] @ z
+        if returnContributions:
+            np.multiply(z, ruptureRates[..., start:stop, None], out=contributions[..., start:stop, :])
 
-        probExceedanceArray = 0
-        for index in range(len(median)):
-            probExceedance = 1 - norm.cdf(np.log(imThreshold), np.log(median[index]), totalSigma[index])
-            probExceedanceArray = probExceedanceArray + probExceedance * magnitudePMFs[index] * distancePMFs[index] * mfd.sourceRate
+    if returnContributions:
+        return rateExceedance, contributions
+    return rateExceedance
 
-        probExceedanceList.append(probExceedanceArray)
-    rateExceedance = np.array(probExceedanceList)
+def hazardCurveCalculator(ruptures, mfd, imThresholds, maxChunkElements=2_000_000, returnContributions=False):
+
+    imThresholdList = np.asarray(imThresholds, dtype=float)
+    ruptureRates = ruptures.ruptureRates(mfd.sourceRate)
+
+    return hazardIntegral(ruptures.imMedian, ruptures.totalSigma, ruptureRates, imThresholdList,
+                          maxChunkElements, returnContributions)
+
+def poeToAnnualRate(poe, investigationTime):
+    """
+    Annual rate equivalent to a probability of exceedance in the investigation time (Poisson).
+    """
+    return -np.log(1 - np.asarray(poe, dtype=float)) / investigationTime
+
+def annualRateToPoe(rateExceedance, investigationTime):
+    """
+    Probability of exceedance in the investigation time for an annual rate (Poisson).
+    """
+    return 1 - np.exp(-np.asarray(rateExceedance, dtype=float) * investigationTime)
+
+def hazardMapValues(imThresholds, rateExceedance, targetRates):
+    """
+    IM levels at the target annual rates, interpolated in log-log space.
+    :param imThresholds: IM threshold values, shape (nThresholds,).
+    :param rateExceedance: Hazard curves, shape (nThresholds,) or (nSites, nThresholds).
+    :param targetRates: Annual rates of exceedance, shape (nTargets,).
+    :return: IM levels, shape (nTargets,) or (nSites, nTargets). NaN where the target is
+    outside the computed curve.
+    """
+    lnThresholds = np.log(np.asarray(imThresholds, dtype=float))
+    singleSite = np.ndim(rateExceedance) == 1
+    rateExceedance = np.atleast_2d(np.asarray(rateExceedance, dtype=float))
+    targetRates = np.atleast_1d(np.asarray(targetRates, dtype=float))
+    with np.errstate(divide='ignore'):
+        lnRates = np.log(rateExceedance)
+    lnTargets = np.log(targetRates)
+
+    # Hazard curves decrease with IM, so the crossing is after the last threshold still above target.
+    above = (lnRates[:, :, None] >= lnTargets).sum(axis=1)
+    upper = np.clip(above, 1, len(lnThresholds) - 1)
+    lower = upper - 1
+
+    rateLower = np.take_along_axis(lnRates, lower, axis=1)
+    rateUpper = np.take_along_axis(lnRates, upper, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = (lnTargets - rateLower) / (rateUpper - rateLower)
+    lnIM = lnThresholds[lower] + fraction * (lnThresholds[upper] - lnThresholds[lower])
+
+    imLevels = np.where((above > 0) & (above < len(lnThresholds)), np.exp(lnIM), np.nan)
+
+    return imLevels[0] if singleSite else imLevels
+
+def _exceedanceRates(lnMedian, totalSigma, ruptureRates, lnLevels, maxChunkElements=2_000_000):
+    # Annual rate of exceeding a separate IM level for each site and target, lnLevels of shape (nSites, nTargets).
+    from scipy.special import ndtr
+
+    nRuptures = lnMedian.shape[-1]
+    chunkSize = max(1, maxChunkElements // max(lnLevels.size, 1))
+    rates = np.zeros(lnLevels.shape)
+    for start in range(0, nRuptures, chunkSize):
+        stop = min(start + chunkSize, nRuptures)
+        z = lnMedian[:, None, start:stop] - lnLevels[..., None]
+        z /= totalSigma[:, None, start:stop]
+        ndtr(z, out=z)
+        rates += (z @ ruptureRates[..., start:stop, None])[..., 0]
+
+    return rates
+
+def inverseHazard(median, totalSigma, ruptureRates, targetRates, imBounds=(1e-4, 10.0), rateTolerance=1e-4,
+                  maxIterations=50, maxChunkElements=2_000_000, returnEvaluations=False, maxWidenings=30):
+    """
+    IM levels at target annual rates of exceedance, solved for every site and target at once by
+    bracketed false position (Illinois) on ln(IM) and ln(rate), without a threshold grid.
+    :param median: IM medians, shape (nRuptures,) or (nSites, nRuptures).
+    :param totalSigma: Total residual, scalar or broadcastable to median.
+    :param ruptureRates: Annual rate of each rupture, shape (nRuptures,), or (nSites, nRuptures) for rates
+    that differ by site, e.g. of gridded sources.
+    :param targetRates: Annual rates of exceedance, shape (nTargets,), e.g. poeToAnnualRate(0.1, 50).
+    :param imBounds: First IM bracket searched for the levels, e.g. the range of the IM thresholds. It is
+    widened by a decade at a time where a target lies outside it.
+    :param rateTolerance: Largest difference of ln(rate) from ln(target) of a solved level.
+    :param returnEvaluations: Also return the number of exceedance evaluations of each site.
+    :param maxWidenings: Largest number of decades the bracket is widened by.
+    :return: IM levels, shape (nTargets,) or (nSites, nTargets). NaN where the target rate is above the
+    total rate of the ruptures, or not bracketed after maxWidenings.
+    """
+    singleSite = np.ndim(median) == 1
+    with np.errstate(divide='ignore'):
+        lnMedian = np.log(np.atleast_2d(np.asarray(median, dtype=float)))
+    totalSigma = np.broadcast_to(np.asarray(totalSigma, dtype=float), lnMedian.shape)
+    ruptureRates = np.asarray(ruptureRates, dtype=float)
+    lnTargets = np.log(np.atleast_1d(np.asarray(targetRates, dtype=float)))
+    shape = (len(lnMedian), len(lnTargets))
+    evaluations = np.zeros(len(lnMedian), dtype=int)
+
+    def residual(rows, lnLevels):
+        # ln(rate) - ln(target); a zero rate is floored so that the residual stays finite.
+        evaluations[rows] += 1
+        rates = _exceedanceRates(lnMedian[rows], totalSigma[rows], ruptureRates[rows] if ruptureRates.ndim == 2
+                                 else ruptureRates, lnLevels, maxChunkElements)
+        return np.log(np.maximum(rates, 1e-300)) - lnTargets
+
+    allRows = np.ones(len(lnMedian), dtype=bool)
+    lower = np.full(shape, np.log(imBounds[0]))
+    upper = np.full(shape, np.log(imBounds[1]))
+    fLower = residual(allRows, lower)
+    fUpper = residual(allRows, upper)
+
+    # The rate of exceedance tends to the total rate of the ruptures with a median as the IM level goes to zero,
+    # so targets above it are never bracketed.
+    withMedian = np.isfinite(lnMedian)
+    totalRates = (np.where(withMedian, ruptureRates, 0.0).sum(axis=1) if ruptureRates.ndim == 2
+                  else withMedian @ ruptureRates)
+    with np.errstate(divide='ignore'):
+        reachable = np.log(totalRates)[:, None] >= lnTargets
+
+    # A target outside the bracket moves it by a decade, and the old end becomes the other end.
+    for _ in range(maxWidenings):
+        widenLower = reachable & (fLower < 0)
+        widenUpper = fUpper > 0
+        rows = (widenLower | widenUpper).any(axis=1)
+        if not rows.any():
+            break
+        candidate = np.where(widenLower, lower - np.log(10), np.where(widenUpper, upper + np.log(10), lower))
+        f = np.zeros(shape)
+        f[rows] = residual(rows, candidate[rows])
+        lower, fLower, upper, fUpper = (np.where(widenLower, candidate, np.where(widenUpper, upper, lower)),
+                                        np.where(widenLower, f, np.where(widenUpper, fUpper, fLower)),
+                                        np.where(widenUpper, candidate, np.where(widenLower, lower, upper)),
+                                        np.where(widenUpper, f, np.where(widenLower, fLower, fUpper)))
+
+    # Exceedance rates decrease with IM, so a level is bracketed where fLower >= 0 >= fUpper.
+    levels = np.full(shape, np.nan)
+    bracketed = (fLower >= 0) & (fUpper <= 0)
+    levels = np.where(bracketed & (np.abs(fLower) <= rateTolerance), lower, levels)
+    levels = np.where(bracketed & (np.abs(fUpper) <= rateTolerance), upper, levels)
+    active = bracketed & np.isnan(levels)
+    lastMove = np.zeros(shape, dtype=int)
+
+    for _ in range(maxIterations):
+        rows = active.any(axis=1)
+        if not rows.any():
+            break
+        with np.errstate(divide='ignore', invalid='ignore'):
+            candidate = lower - fLower * (upper - lower) / (fUpper - fLower)
+        # Bisect where the interpolation leaves the bracket.
+        candidate = np.where(np.isfinite(candidate) & (candidate > lower) & (candidate < upper), candidate,
+                             (lower + upper) / 2)
+        f = np.zeros(shape)
+        f[rows] = residual(rows, candidate[rows])
+
+        solved = active & ((np.abs(f) <= rateTolerance) | (upper - lower <= 1e-9))
+        levels[solved] = candidate[solved]
+        active &= ~solved
+
+        # Illinois step: halve the residual of an end point kept twice in a row, so that it moves too.
+        moveLower = active & (f > 0)
+        moveUpper = active & (f < 0)
+        fUpper = np.where(moveLower & (lastMove == 1), fUpper / 2, fUpper)
+        fLower = np.where(moveUpper & (lastMove == -1), fLower / 2, fLower)
+        lower, fLower = np.where(moveLower, candidate, lower), np.where(moveLower, f, fLower)
+        upper, fUpper = np.where(moveUpper, candidate, upper), np.where(moveUpper, f, fUpper)
+        lastMove = np.where(moveLower, 1, np.where(moveUpper, -1, lastMove))
+
+    # Levels still unsolved after maxIterations keep the last interpolation.
+    levels[active] = candidate[active]
+    levels = np.exp(levels)
+
+    if singleSite:
+        levels, evaluations = levels[0], evaluations[0]
+    if returnEvaluations:
+        return levels, evaluations
+    return levels
+
+def inverseHazardCalculator(ruptures, mfd, targetRates, **kwargs):
+    # IM levels of one site at the target annual rates, see inverseHazard.
+    return inverseHazard(ruptures.imMedian, ruptures.totalSigma, ruptures.ruptureRates(mfd.sourceRate), targetRates,
+                         **kwargs)
+
+def adaptiveHazardCurve(median, totalSigma, ruptureRates, imBounds=(1e-3, 10.0), tolerance=0.01,
+                        initialThresholds=9, maxThresholds=200, minRate=1e-10, maxChunkElements=2_000_000,
+                        maxWidenings=10):
+    """
+    Hazard curve on thresholds refined where it bends: an interval is halved in ln(IM) until the
+    log-log interpolation at its midpoint is within tolerance of the computed rate, at every site.
+    :param median: IM medians, shape (nRuptures,) or (nSites, nRuptures).
+    :param tolerance: Largest difference of ln(rate) between the interpolated and computed midpoint.
+    :param initialThresholds: Number of log-spaced thresholds of the first pass.
+    :param maxThresholds: Largest number of thresholds; refinement stops there.
+    :param minRate: Intervals whose rates are all below this are not refined. The upper IM bound is raised by a
+    decade at a time, at most maxWidenings times, until the rates of every site are below it there.
+    :return: IM thresholds, shape (nThresholds,), and rates, shape (nThresholds,) or (nSites, nThresholds).
+    """
+    lnThresholds = np.linspace(np.log(imBounds[0]), np.log(imBounds[1]), initialThresholds)
+    rates = hazardIntegral(median, totalSigma, ruptureRates, np.exp(lnThresholds), maxChunkElements)
+    for _ in range(maxWidenings):
+        if np.max(rates[..., -1]) < minRate:
+            break
+        lnThresholds = np.append(lnThresholds, lnThresholds[-1] + np.log(10))
+        rates = np.concatenate([rates, hazardIntegral(median, totalSigma, ruptureRates, np.exp(lnThresholds[-1:]),
+                                                      maxChunkElements)], axis=-1)
+    refine = np.ones(len(lnThresholds) - 1, dtype=bool)
+
+    while refine.any() and len(lnThresholds) < maxThresholds:
+        # Midpoints of the intervals to check, at most as many as thresholds are left.
+        index = np.flatnonzero(refine)[:maxThresholds - len(lnThresholds)]
+        lnMiddle = (lnThresholds[index] + lnThresholds[index + 1]) / 2
+        middleRates = hazardIntegral(median, totalSigma, ruptureRates, np.exp(lnMiddle), maxChunkElements)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            interpolated = (np.log(rates[..., index]) + np.log(rates[..., index + 1])) / 2
+            error = np.abs(np.log(middleRates) - interpolated)
+        error[~np.isfinite(error)] = np.inf
+        error[np.maximum(rates[..., index], middleRates) < minRate] = 0
+        split = (error > tolerance).reshape(-1, len(index)).any(axis=0)
+
+        # Converged intervals are kept; a split interval is replaced by its two halves.
+        refine[index[~split]] = False
+        lnThresholds = np.insert(lnThresholds, index[split] + 1, lnMiddle[split])
+        rates = np.insert(rates, index[split] + 1, middleRates[..., split], axis=-1)
+        refine = np.insert(refine, index[split] + 1, True)
+
+    return np.exp(lnThresholds), rates
+
+def plotHazardCurve(imThresholds, rateExceedance, imts):
+
+    imThresholdList = np.asarray(imThresholds, dtype=float)
 
     # Create the plot
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots(figsize=(6, 6), dpi=300)
     ax.loglog(imThresholdList, rateExceedance, linestyle='-', color='r')
     ax.grid(which='both', linestyle='--', linewidth=0.5)
@@ -36,4 +292,4 @@ def hazardCurveCalculator(ruptureDataframe, mfd, imThresholds, imts):
     ax.set_xlabel(imt)
     ax.set_ylabel('Annual Rate of Exceedance')
 
-    return fig
\ No newline at end of file
+    return fig
@@ -1,38 +1,201 @@
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-from cartopy.io.img_tiles import GoogleTiles
-import streamlit as st
-
-def generateRuptureMap(coordinates, site_coordinate, ruptureDataframe):
+import argparse
+import io
+import os
+from urllib.request import HTTPError, Request, URLError, urlopen
+
+import numpy as np
+
+# Matplotlib, cartopy and streamlit are imported by the functions that draw, so that importing this
+# module, e.g. from the app or the prefetch command, stays cheap until a map is actually rendered.
+
+# Tiles, Natural Earth shapefiles and rendered basemaps are kept here, so maps can be drawn offline
+# once the area has been prefetched.
+BASEMAP_CACHE_DIR = os.environ.get("PSHA_BASEMAP_CACHE",
+                                   os.path.join(os.path.expanduser("~"), ".cache", "psha_streamlit"))
+
+_naturalEarthLayers = []
+_tileSourceClass = []
+
+def naturalEarthLayers():
+    # Natural Earth features drawn on the basemap, with their drawing options; built on first use.
+    if not _naturalEarthLayers:
+        import cartopy.feature as cfeature
+
+        _naturalEarthLayers.extend([
+            (cfeature.NaturalEarthFeature('physical', 'ocean', '10m', edgecolor='face',
+                                          facecolor=cfeature.COLORS['water']), dict(zorder=5)),
+            (cfeature.LAND, dict(linewidth=0.5)),  # Adjust line width for better visibility
+            (cfeature.COASTLINE, dict(linewidth=0.5, zorder=6)),
+            (cfeature.BORDERS, dict(linestyle=':', linewidth=0.5)),
+        ])
+
+    return _naturalEarthLayers
+
+# Rendered basemap rasters of this session, keyed by extent, zoom and size. Only the most recently
+# used ones are kept, since a 300-dpi raster takes tens of MB.
+_basemapRasters = {}
+_maxBasemapRasters = 4
+
+def esriShadedRelief():
+    """
+    Tile source class of the Esri shaded relief service; the cartopy subclass is defined on first use.
+    """
+    if _tileSourceClass:
+        return _tileSourceClass[0]
+    from PIL import Image
+    from cartopy.io.img_tiles import GoogleTiles
 
     class EsriShadedRelief(GoogleTiles):
         # Customize this class to use the specific Esri shaded relief tile service
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            # Tiles that could not be downloaded and were drawn blank.
+            self.failedTiles = set()
+
         def _image_url(self, tile):
             x, y, z = tile
             return f'http://server.arcgisonline.com/ArcGIS/rest/services/World_Shaded_Relief/MapServer/tile/{z}/{y}/{x}'
 
+        def get_image(self, tile):
+            # Same as GoogleWTS.get_image, but only successful downloads are written to the cache, so an
+            # offline run never stores blank tiles.
+            cached_file = None
+            if self.cache_path is not None:
+                cached_file = self._cache_dir / ("_".join([str(i) for i in tile]) + ".npy")
+
+            if cached_file in self.cache:
+                img = np.load(cached_file, allow_pickle=False)
+            else:
+                try:
+                    request = Request(self._image_url(tile), headers={"User-Agent": self.user_agent})
+                    with urlopen(request, timeout=10) as fh:
+                        img = Image.open(io.BytesIO(fh.read())).convert(self.desired_tile_form)
+                except (HTTPError, URLError, OSError):
+                    self.failedTiles.add(tuple(tile))
+                    img = Image.fromarray(np.full((256, 256, 3), (250, 250, 250), dtype=np.uint8))
+                    return img, self.tileextent(tile), 'lower'
+
+                if cached_file is not None:
+                    cached_file.parent.mkdir(parents=True, exist_ok=True)
+                    np.save(cached_file, img, allow_pickle=False)
+                    self.cache.add(cached_file)
+
+            return img, self.tileextent(tile), 'lower'
+
+    _tileSourceClass.append(EsriShadedRelief)
+    return EsriShadedRelief
+
+def useBasemapCache(cacheDir=BASEMAP_CACHE_DIR):
+    """
+    Point cartopy's Natural Earth data directory to the cache and return the tile source.
+    """
+    import cartopy
+
+    cartopy.config['data_dir'] = os.path.join(cacheDir, 'naturalearth')
+    return esriShadedRelief()(cache=os.path.join(cacheDir, 'tiles'))
+
+def getMapExtent(site_coordinate):
+    # [x min, x max, y min, y max] of the map around the site.
+    return [site_coordinate[0] - 3, site_coordinate[0] + 3, site_coordinate[1] - 2.5, site_coordinate[1] + 2.5]
+
+def prefetchBasemap(extent, zoom=8, cacheDir=BASEMAP_CACHE_DIR):
+    """
+    Download the relief tiles of a bounding box and the Natural Earth layers into the cache.
+    :param extent: [x min, x max, y min, y max] in degrees.
+    :return: Number of tiles in the cache for the bounding box.
+    """
+    import shapely.geometry as sgeom
+    import cartopy.crs as ccrs
+    from cartopy.io import shapereader
+
+    terrain = useBasemapCache(cacheDir)
+    for feature, _ in naturalEarthLayers():
+        shapereader.natural_earth(resolution=feature.scale, category=feature.category, name=feature.name)
+
+    domain = terrain.crs.project_geometry(sgeom.box(extent[0], extent[2], extent[1], extent[3]),
+                                          ccrs.PlateCarree())
+    tiles = list(terrain.find_images(domain, zoom))
+    for tile in tiles:
+        terrain.get_image(tile)
+
+    return sum(terrain._cache_dir.joinpath("_".join(map(str, tile)) + ".npy").exists() for tile in tiles)
+
+def renderBasemap(extent, zoom=8, width=11, dpi=300, cacheDir=BASEMAP_CACHE_DIR):
+    """
+    Render relief tiles and Natural Earth layers for the extent into an RGBA raster. Rasters are reused
+    from memory or from the cache directory when the same extent is drawn again.
+    """
+    import matplotlib.pyplot as plt
+
+    height = width * (extent[3] - extent[2]) / (extent[1] - extent[0])
+    key = "basemap_{}_{}_{}_{}".format("_".join(f"{value:.4f}" for value in extent), zoom, width, dpi)
+    rasterFile = os.path.join(cacheDir, 'rendered', key + '.png')
+
+    if key in _basemapRasters:
+        # Moved to the end, so that the least recently used raster is the first one.
+        _basemapRasters[key] = _basemapRasters.pop(key)
+        return _basemapRasters[key]
+    if os.path.exists(rasterFile):
+        return keepBasemapRaster(key, plt.imread(rasterFile))
+
+    import cartopy.crs as ccrs
+    from cartopy.io import shapereader
+
+    proj = ccrs.PlateCarree()
+    terrain = useBasemapCache(cacheDir)
+
+    fig = plt.figure(figsize=(width, height), dpi=dpi)
+    ax = fig.add_axes([0, 0, 1, 1], projection=proj)
+    ax.set_extent(extent, crs=proj)
+    ax.axis('off')
+    ax.add_image(terrain, zoom)  # The second argument is the zoom level of the tile, adjust as needed
+
+    # Natural Earth layers are skipped when they are neither cached nor downloadable.
+    complete = True
+    for feature, options in naturalEarthLayers():
+        try:
+            shapereader.natural_earth(resolution=feature.scale, category=feature.category, name=feature.name)
+        except (URLError, OSError):
+            complete = False
+            continue
+        ax.add_feature(feature, **options)
+
+    fig.canvas.draw()
+    raster = np.asarray(fig.canvas.buffer_rgba()).copy()
+    plt.close(fig)
+
+    # Incomplete basemaps, with missing layers or blank tiles, are neither written to disk nor kept in
+    # memory, so a later online run can complete them.
+    if complete and not terrain.failedTiles:
+        os.makedirs(os.path.dirname(rasterFile), exist_ok=True)
+        plt.imsave(rasterFile, raster)
+        keepBasemapRaster(key, raster)
+
+    return raster
+
+def keepBasemapRaster(key, raster):
+    # Keep a raster in memory, removing the least recently used one above _maxBasemapRasters.
+    _basemapRasters[key] = raster
+    while len(_basemapRasters) > _maxBasemapRasters:
+        _basemapRasters.pop(next(iter(_basemapRasters)))
+
+    return raster
+
+def generateRuptureMap(coordinates, site_coordinate, ruptureDataframe, zoom=8, dpi=300):
+    import matplotlib.pyplot as plt
+    import cartopy.crs as ccrs
+    import streamlit as st
+
     # Define the map projection
     proj = ccrs.PlateCarree()
-    terrain = EsriShadedRelief()  # Now using shaded relief instead of plain terrain
+    extent = getMapExtent(site_coordinate)
 
     # Create figure with a GeoAxes in the desired projection
     fig, ax = plt.subplots(figsize=(11, 14), subplot_kw={'projection': proj},
-                           dpi=300)  # Increased DPI for better resolution
-
-    # Set map extent with a small buffer to avoid white zones at the edges
-    # ax.set_extent([site_coordinate[1]-10.5, site_coordinate[0]-2, site_coordinate[1]+1, site_coordinate[0]+10.5]) # Adjust these values based on your data extent
-    ax.add_image(terrain, 8)  # The second argument is the zoom level of the tile, adjust as needed
+                           dpi=dpi)  # Increased DPI for better resolution
 
-    # Add natural earth features to mask water
-    ocean_10m = cfeature.NaturalEarthFeature('physical', 'ocean', '10m', edgecolor='face',
-                                             facecolor=cfeature.COLORS['water'])
-    ax.add_feature(ocean_10m, zorder=5)
-
-    # Add natural features with Cartopy
-    ax.add_feature(cfeature.LAND, linewidth=0.5)  # Adjust line width for better visibility
-    ax.add_feature(cfeature.COASTLINE, linewidth=0.5, zorder=6)
-    ax.add_feature(cfeature.BORDERS, linestyle=':', linewidth=0.5)
+    # Shaded relief and Natural Earth layers come from the pre-rendered basemap raster.
+    ax.imshow(renderBasemap(extent, zoom, dpi=dpi), extent=extent, transform=proj, origin='upper', zorder=0)
 
     # Add gridlines with labels -- LAT AND LONG INFORMATION
     gl = ax.gridlines(crs=ccrs.PlateCarree(), draw_labels=True,
@@ -67,9 +230,19 @@ def generateRuptureMap(coordinates, site_coordinate, ruptureDataframe):
     ax.set_title('Ruptures and Site')
     ax.set_xlabel('Latitude')
     ax.set_ylabel('Longitude')
-    ax.set_xlim([site_coordinate[0]-3, site_coordinate[0]+3])
-    ax.set_ylim([site_coordinate[1]-2.5, site_coordinate[1]+2.5])
+    ax.set_xlim([extent[0], extent[1]])
+    ax.set_ylim([extent[2], extent[3]])
 
     return fig
 
-
+if __name__ == "__main__":
+    # Prefetch the basemap of a bounding box, e.g.
+    # python -m visualizations.mapGen --extent 26 32 38.5 43 --zoom 8
+    parser = argparse.ArgumentParser(description="Prefetch relief tiles and Natural Earth layers for offline maps.")
+    parser.add_argument("--extent", type=float, nargs=4, required=True, metavar=("XMIN", "XMAX", "YMIN", "YMAX"))
+    parser.add_argument("--zoom", type=int, default=8)
+    parser.add_argument("--cache-dir", default=BASEMAP_CACHE_DIR)
+    args = parser.parse_args()
+
+    tileCount = prefetchBasemap(args.extent, args.zoom, args.cache_dir)
+    print(f"{tileCount} tiles cached in {args.cache_dir}")